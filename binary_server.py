@@ -0,0 +1,135 @@
+"""
+High-throughput alternative to `server.py`: the same private/public/shares operations,
+served with asyncio streams over a compact length-prefixed binary protocol.
+
+Every request and response is a frame: a 4-byte length followed by the payload.
+A request payload is a record (see `communication.encode_record`) whose kind is one of
+the operations defined in `communication.py`, whose sender field names the channel owner (the receiver of a
+private message, the sender of a public message, the client asking for triplet shares)
+and whose label is the message label (or the operation ID for triplets).
+A response payload is a status byte followed by the message body.
+
+Retrieval blocks on the server side until the message is available, so the clients
+do not need to poll. Use `BinaryCommunication` from `communication.py` as the client.
+
+`python relay_benchmark.py binary` measures its messages/sec against those of `server.py`, both
+on one core.
+"""
+
+import asyncio
+import collections
+import sys
+from typing import Dict, List, Tuple
+
+from communication import (
+    ERROR,
+    FRAME_LENGTH,
+    OK,
+    PUBLISH,
+    RETRIEVE_PRIVATE,
+    RETRIEVE_PUBLIC,
+    RETRIEVE_SHARES,
+    SEND_PRIVATE,
+    TRIPLET,
+    decode_record,
+)
+from ttp import TrustedParamGenerator
+
+
+class BinaryRelay:
+    """
+    In-memory store of the relay, with the clients waiting for messages that were not sent yet.
+    """
+
+    def __init__(self, participants: List[str]):
+        self.store: Dict[str, Dict[Tuple[str, str], bytes]] = collections.defaultdict(dict)
+        self.waiters: Dict[Tuple[str, Tuple[str, str]], List[asyncio.Future]] = collections.defaultdict(list)
+        self.ttp = TrustedParamGenerator()
+        for participant in participants:
+            self.ttp.add_participant(participant)
+
+    def set_value(self, pool: str, channel: Tuple[str, str], data: bytes) -> None:
+        """
+        Push data to a channel in a given pool and wake up the clients waiting for it.
+        """
+        self.store[pool][channel] = data
+        for waiter in self.waiters.pop((pool, channel), []):
+            if not waiter.done():
+                waiter.set_result(data)
+
+    async def get_value(self, pool: str, channel: Tuple[str, str]) -> bytes:
+        """
+        Get the data of a channel in a given pool, waiting until it is set.
+        """
+        if channel in self.store[pool]:
+            return self.store[pool][channel]
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[(pool, channel)].append(waiter)
+        return await waiter
+
+    async def handle_request(self, payload: bytes) -> bytes:
+        kind, owner_id, label, body = decode_record(payload)
+
+        if kind == SEND_PRIVATE:
+            self.set_value("private", (owner_id, label), body)
+            return b""
+        if kind == RETRIEVE_PRIVATE:
+            return await self.get_value("private", (owner_id, label))
+        if kind == PUBLISH:
+            self.set_value("public", (owner_id, label), body)
+            return b""
+        if kind == RETRIEVE_PUBLIC:
+            return await self.get_value("public", (owner_id, label))
+        if kind == RETRIEVE_SHARES:
+            shares = self.ttp.retrieve_share(owner_id, label)
+            return TRIPLET.pack(*(share.bn for share in shares))
+
+        raise ValueError(f"Unknown operation {kind}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serve the requests of one client, in order.
+        """
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_LENGTH.size)
+                (length,) = FRAME_LENGTH.unpack(header)
+                payload = await reader.readexactly(length)
+
+                try:
+                    response = bytes([OK]) + await self.handle_request(payload)
+                except (ValueError, KeyError) as error:
+                    response = bytes([ERROR]) + str(error).encode("utf-8")
+
+                writer.write(FRAME_LENGTH.pack(len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            # client disconnected
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host: str, port: int, participants: List[str]) -> None:
+    relay = BinaryRelay(participants)
+    server = await asyncio.start_server(relay.handle_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def run(host: str, port: int, participants: List[str]) -> None:
+    """
+    Register the participants, then run the server.
+    """
+    asyncio.run(serve(host, port, participants))
+
+
+def main(args: List[str]) -> None:
+    """
+    Entrypoint of the program.
+    """
+    run("localhost", 5000, args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
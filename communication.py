@@ -3,9 +3,13 @@ Utilities for client communication with the trusted server.
 You should not need to change this file.
 """
 
+import bisect
+import hashlib
 import json
-import time
-from typing import Union, Tuple, Any
+import socket
+import struct
+import threading
+from typing import Dict, List, Optional, Union, Tuple, Any
 
 import requests
 
@@ -20,6 +24,65 @@ def serialize_object(object: Any) -> bytes:
     return jsonpickle.encode(object).encode('utf-8')
 
 
+# Framing shared by the non-HTTP transports: a record is
+# kind | len(sender) | len(label) | sender | label | body,
+# and on a stream every record is prefixed with its length.
+RECORD_HEADER = struct.Struct("<BHH")
+FRAME_LENGTH = struct.Struct("<I")
+
+
+def encode_record(kind: int, sender_id: str, label: str, body: bytes) -> bytes:
+    """
+    Encode a record as kind | len(sender) | len(label) | sender | label | body.
+    """
+    sender_bytes = sender_id.encode("utf-8")
+    label_bytes = label.encode("utf-8")
+    return RECORD_HEADER.pack(kind, len(sender_bytes), len(label_bytes)) + \
+        sender_bytes + label_bytes + body
+
+
+def decode_record(record: bytes) -> Tuple[int, str, str, bytes]:
+    """
+    Inverse of `encode_record`.
+    """
+    kind, sender_len, label_len = RECORD_HEADER.unpack_from(record)
+    offset = RECORD_HEADER.size
+    sender_id = record[offset:offset + sender_len].decode("utf-8")
+    offset += sender_len
+    label = record[offset:offset + label_len].decode("utf-8")
+    offset += label_len
+    return kind, sender_id, label, record[offset:]
+
+
+def send_frame(sock: socket.socket, record: bytes) -> None:
+    """
+    Write a length-prefixed record to a stream socket.
+    """
+    sock.sendall(FRAME_LENGTH.pack(len(record)) + record)
+
+
+def _recv_exactly(sock: socket.socket, length: int) -> Optional[bytes]:
+    chunks = []
+    while length > 0:
+        chunk = sock.recv(length)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        length -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock: socket.socket) -> Optional[bytes]:
+    """
+    Read a length-prefixed record from a stream socket; None once the peer closed the connection.
+    """
+    header = _recv_exactly(sock, FRAME_LENGTH.size)
+    if header is None:
+        return None
+    (length,) = FRAME_LENGTH.unpack(header)
+    return _recv_exactly(sock, length)
+
+
 def sanitize_url_param(url_param: Union[bytes, str]) -> str:
     """
     Sanitize URL parameter to be URL-safe.
@@ -34,6 +97,48 @@ def sanitize_url_param(url_param: Union[bytes, str]) -> str:
     return url_param.replace("/", "_").replace("+", "-")  # type: ignore
 
 
+def response_bytes(res: requests.Response) -> int:
+    """
+    Size of an HTTP response on the wire: status line, headers and body.
+    """
+    version = f"HTTP/{res.raw.version // 10}.{res.raw.version % 10}"
+    size = len(f"{version} {res.status_code} {res.reason}\r\n")
+    for name, value in res.raw.headers.items():
+        size += len(name) + len(": \r\n") + len(value)
+    return size + len("\r\n") + len(res.content)
+
+
+class ConsistentHashRing:
+    """
+    Maps keys to nodes by consistent hashing, with several virtual points per node so
+    that the keys spread evenly. The hash is stable across processes (unlike `hash`).
+
+    Attributes:
+        nodes: the nodes to distribute the keys on
+        replicas: number of virtual points per node on the ring (default: 64)
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        self.nodes = list(nodes)
+        self.points = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in self.points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def node_for(self, key: str) -> str:
+        """
+        The first node clockwise from the position of key on the ring.
+        """
+        index = bisect.bisect(self.hashes, self._hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
 class Communication:
     """
     Network communications with the server.
@@ -44,6 +149,9 @@ class Communication:
         client_id: Identifier of this client
         poll_delay: delay between requests in seconds (default: 0.2 s)
         protocol: network protocol to use (default: "http")
+        relays: (host, port) of several server processes to spread the channels on (optional).
+            Every channel is routed to one of them by consistent hashing; server_host:server_port
+            is then only used for the Beaver triplets and may or may not be one of the relays.
     """
 
     def __init__(
@@ -52,19 +160,108 @@ class Communication:
             server_port: int,
             client_id: str,
             poll_delay: float = 0.2,
-            protocol: str = "http"
+            protocol: str = "http",
+            relays: Optional[List[Tuple[str, int]]] = None
     ):
         self.base_url = f"{protocol}://{server_host}:{server_port}"
         self.client_id = client_id
         self.poll_delay = poll_delay
 
-        # for performance evaluation
+        # The same channel is hashed by its sender and its receiver, so both end up on the same relay.
+        if relays:
+            self.relay_ring: Optional[ConsistentHashRing] = ConsistentHashRing(
+                [f"{protocol}://{host}:{port}" for host, port in relays])
+        else:
+            self.relay_ring = None
+
+        self._init_metrics()
+
+    def _init_metrics(self) -> None:
+        """
+        Reset the counters used for performance evaluation.
+        """
+        # The counters may be updated by several threads of the party at once (e.g. the input shares
+        # are sent in the background, see SMCParty), under this lock
+        self.metrics_lock = threading.Lock()
         self.bytes_sent_smc_party = 0
         self.bytes_received_smc_party = 0
         self.bytes_sent_ttp = 0
         self.comp_cost_ttp = 0
+        # The waiting times are counted per thread: the time a background thread waits for the
+        # network is not time the party waited
+        self.waits = threading.local()
         self.time_spent_sending = 0 # compute time spent waiting when sending messages
         self.time_spent_retrieving = 0 # compute time spent waiting when retrieving messages
+        # Exact accounting reported by server.py for the HTTP requests (see server.py)
+        self.wire_bytes_sent = 0 # requests as received by the server, headers included
+        self.wire_bytes_received = 0 # responses as received from the server, headers included
+        self.server_time = 0 # time the server spent processing the requests
+        self.ttp_time = None # time the ttp spent on the triplet requests (None: not measured)
+        # Set by stop: the retrievals still waiting give up
+        self.stopped = threading.Event()
+
+    @property
+    def time_spent_sending(self) -> float:
+        """
+        Time the calling thread spent waiting when sending messages.
+        """
+        return getattr(self.waits, "sending", 0)
+
+    @time_spent_sending.setter
+    def time_spent_sending(self, value: float) -> None:
+        self.waits.sending = value
+
+    @property
+    def time_spent_retrieving(self) -> float:
+        """
+        Time the calling thread spent waiting when retrieving messages.
+        """
+        return getattr(self.waits, "retrieving", 0)
+
+    @time_spent_retrieving.setter
+    def time_spent_retrieving(self, value: float) -> None:
+        self.waits.retrieving = value
+
+    def add_wait(self, kind: str, seconds: float) -> None:
+        """
+        Count seconds the calling thread waited, kind "sending" or "retrieving" (e.g. a party waiting
+        for its background threads, or an emulated link). The wrappers of a transport forward it to
+        the transport rather than assigning the waits on themselves.
+        """
+        if kind not in ("sending", "retrieving"):
+            raise ValueError(f"Unknown kind of wait {kind!r}")
+        setattr(self.waits, kind, getattr(self.waits, kind, 0) + seconds)
+
+    def stop(self) -> None:
+        """
+        Give up the retrievals still waiting for a message, e.g. those of a party's background threads
+        after the party failed: they raise a ConnectionAbortedError.
+        """
+        self.stopped.set()
+
+    def wait_poll_delay(self) -> None:
+        """
+        Sleep between two polls of a retrieval, unless the communication is stopped.
+        """
+        if self.stopped.wait(self.poll_delay):
+            raise ConnectionAbortedError(f"Communication of client {self.client_id} stopped")
+
+    def account(self, res: requests.Response) -> None:
+        """
+        Record the server's accounting of an HTTP request.
+        """
+        with self.metrics_lock:
+            self.wire_bytes_sent += int(res.headers.get("X-Request-Bytes", 0))
+            self.wire_bytes_received += response_bytes(res)
+            self.server_time += float(res.headers.get("X-Server-Time", 0))
+
+    def relay_url(self, pool: str, owner_id: str, label: str) -> str:
+        """
+        Base URL of the relay responsible for the channel (owner_id, label) of a pool.
+        """
+        if self.relay_ring is None:
+            return self.base_url
+        return self.relay_ring.node_for(f"{pool}/{owner_id}/{label}")
 
     def send_private_message(
         self,
@@ -77,23 +274,27 @@ class Communication:
         """
 
         # sending bytes, add to bytes_sent
-        self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
 
         client_id_san = sanitize_url_param(self.client_id)
         receiver_id_san = sanitize_url_param(receiver_id)
         label_san = sanitize_url_param(label)
 
-        url = f"{self.base_url}/private/{client_id_san}/{receiver_id_san}/{label_san}"
+        relay_url = self.relay_url("private", receiver_id, label)
+        url = f"{relay_url}/private/{client_id_san}/{receiver_id_san}/{label_san}"
         print(f"POST {url}")
 
         # compute time spent sending message
         starttime_send_private_msg = timeit.default_timer() 
 
-        requests.post(url, message)
+        res = requests.post(url, message)
 
         # add the time spent sending message to the corresponding metric
         self.time_spent_sending += (timeit.default_timer() - starttime_send_private_msg)
 
+        self.account(res)
+
     def retrieve_private_message(
         self,
         label: str
@@ -105,7 +306,8 @@ class Communication:
         client_id_san = sanitize_url_param(self.client_id)
         label_san = sanitize_url_param(label)
 
-        url = f"{self.base_url}/private/{client_id_san}/{label_san}"
+        relay_url = self.relay_url("private", self.client_id, label)
+        url = f"{relay_url}/private/{client_id_san}/{label_san}"
         # We can either use a websocket, or do some polling, but websockets would require asyncio.
         # So we are doing polling to avoid introducing a new programming paradigm.
 
@@ -115,18 +317,58 @@ class Communication:
         while True:
             print(f"GET  {url}")
             res = requests.get(url)
+            self.account(res)
             if res.status_code == 200:
 
                 # received bytes, add to bytes_received
-                self.bytes_received_smc_party = self.bytes_received_smc_party + \
-                    len(res.content)
+                with self.metrics_lock:
+                    self.bytes_received_smc_party = self.bytes_received_smc_party + \
+                        len(res.content)
 
                 # add the time spent receiving message to the corresponding metric
                 self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_private_msg)
 
                 return res.content
 
-            time.sleep(self.poll_delay)
+            self.wait_poll_delay()
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        """
+        Retrieve several private messages from the server, waiting for all of them at once: every
+        polling round asks for each message still missing, then sleeps once.
+        """
+        client_id_san = sanitize_url_param(self.client_id)
+        urls = {label: f"{self.relay_url('private', self.client_id, label)}/private/{client_id_san}/"
+                       f"{sanitize_url_param(label)}"
+                for label in labels}
+        messages: Dict[str, bytes] = dict()
+
+        # compute time spent retrieving the messages
+        starttime_retrieve_private_msgs = timeit.default_timer()
+
+        while True:
+            for label, url in urls.items():
+                if label in messages:
+                    continue
+                print(f"GET  {url}")
+                res = requests.get(url)
+                self.account(res)
+                if res.status_code == 200:
+                    # received bytes, add to bytes_received
+                    with self.metrics_lock:
+                        self.bytes_received_smc_party = self.bytes_received_smc_party + \
+                            len(res.content)
+                    messages[label] = res.content
+
+            if len(messages) == len(urls):
+                # add the time spent receiving the messages to the corresponding metric
+                self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_private_msgs)
+                return messages
+
+            self.wait_poll_delay()
 
     def publish_message(
         self,
@@ -138,22 +380,26 @@ class Communication:
         """
 
         # sending bytes, add to bytes_sent
-        self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
 
         client_id_san = sanitize_url_param(self.client_id)
         label_san = sanitize_url_param(label)
 
-        url = f"{self.base_url}/public/{client_id_san}/{label_san}"
+        relay_url = self.relay_url("public", self.client_id, label)
+        url = f"{relay_url}/public/{client_id_san}/{label_san}"
         print(f"POST {url}")
 
         # compute time spent publishing message
         starttime_publish_msg = timeit.default_timer() 
 
-        requests.post(url, message)
+        res = requests.post(url, message)
 
         # add the time spent publishing message to the corresponding metric
         self.time_spent_sending += (timeit.default_timer() - starttime_publish_msg)
 
+        self.account(res)
+
     def retrieve_public_message(
         self,
         sender_id: str,
@@ -167,7 +413,8 @@ class Communication:
         sender_id_san = sanitize_url_param(sender_id)
         label_san = sanitize_url_param(label)
 
-        url = f"{self.base_url}/public/{client_id_san}/{sender_id_san}/{label_san}"
+        relay_url = self.relay_url("public", sender_id, label)
+        url = f"{relay_url}/public/{client_id_san}/{sender_id_san}/{label_san}"
 
         # We can either use a websocket, or do some polling, but websockets would require asyncio.
         # So we are doing polling to avoid introducing a new programming paradigm.
@@ -178,17 +425,19 @@ class Communication:
         while True:
             print(f"GET  {url}")
             res = requests.get(url)
+            self.account(res)
             if res.status_code == 200:
 
                 # received bytes, add to bytes_received
-                self.bytes_received_smc_party = self.bytes_received_smc_party + \
-                    len(res.content)
+                with self.metrics_lock:
+                    self.bytes_received_smc_party = self.bytes_received_smc_party + \
+                        len(res.content)
 
                 # add the time spent retrieving public message to the corresponding metric
                 self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_public_msg)
 
                 return res.content
-            time.sleep(self.poll_delay)
+            self.wait_poll_delay()
 
     def retrieve_beaver_triplet_shares(
         self,
@@ -233,12 +482,225 @@ class Communication:
 
         # **********************************************************
 
-        # receiving bytes from ttp, add to bytes received
-        self.bytes_received_smc_party = self.bytes_received_smc_party + \
-            len(res.content)
+        # The server also measures how long the ttp itself took
+        self.account(res)
+        if "X-TTP-Time" in res.headers:
+            with self.metrics_lock:
+                self.ttp_time = (self.ttp_time or 0) + float(res.headers["X-TTP-Time"])
 
-        # ttp is sending those bytes, add to bytes sent
-        self.bytes_sent_ttp = self.bytes_sent_ttp + \
-            len(res.content)
+        with self.metrics_lock:
+            # receiving bytes from ttp, add to bytes received
+            self.bytes_received_smc_party = self.bytes_received_smc_party + \
+                len(res.content)
+
+            # ttp is sending those bytes, add to bytes sent
+            self.bytes_sent_ttp = self.bytes_sent_ttp + \
+                len(res.content)
 
         return tuple(json.loads(res.text))  # type: ignore
+
+
+# Operations of the binary protocol spoken by binary_server.py
+SEND_PRIVATE = 1
+RETRIEVE_PRIVATE = 2
+PUBLISH = 3
+RETRIEVE_PUBLIC = 4
+RETRIEVE_SHARES = 5
+
+# Response status of the binary protocol
+OK = 0
+ERROR = 1
+
+# Body of a RETRIEVE_SHARES response: the three shares of the triplet
+TRIPLET = struct.Struct("<QQQ")
+
+# Connections to binary_server.py kept open for the next requests once idle (the others are closed)
+MAX_IDLE_CONNECTIONS = 16
+
+
+class BinaryCommunication(Communication):
+    """
+    Network communications with binary_server.py over persistent TCP connections.
+
+    Retrieval blocks on the server until the message is available, so there is no polling.
+
+    Attributes:
+        server_host: hostname of the server
+        server_port: port of the server
+        client_id: Identifier of this client
+    """
+
+    def __init__(
+            self,
+            server_host: str,
+            server_port: int,
+            client_id: str,
+            poll_delay: float = 0.2
+    ):
+        super().__init__(server_host, server_port, client_id, poll_delay)
+        self.server_address = (server_host, server_port)
+
+        # one connection per request in progress, so that concurrent requests do not interleave; the
+        # idle ones are reused by the next requests, whatever their thread
+        self.idle: List[socket.socket] = []
+        self.sockets: List[socket.socket] = []  # all of them, shut down by stop
+
+    def stop(self) -> None:
+        """
+        Give up the requests still waiting for a response: the retrievals block on the server, so
+        their connections are shut down.
+        """
+        super().stop()
+        with self.metrics_lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _close(self, sock: socket.socket) -> None:
+        with self.metrics_lock:
+            self.sockets.remove(sock)
+        sock.close()
+
+    def _request(self, kind: int, owner_id: str, label: str, body: bytes = b"") -> bytes:
+        """
+        Send one request and wait for its response, on an idle connection or a new one.
+        """
+        with self.metrics_lock:
+            sock = self.idle.pop() if self.idle else None
+        if sock is None:
+            sock = socket.create_connection(self.server_address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.metrics_lock:
+                self.sockets.append(sock)
+
+        try:
+            send_frame(sock, encode_record(kind, owner_id, label, body))
+            response = recv_frame(sock)
+        except BaseException:
+            self._close(sock)
+            raise
+        if response is None:
+            self._close(sock)
+            if self.stopped.is_set():
+                raise ConnectionAbortedError(f"Communication of client {self.client_id} stopped")
+            raise ConnectionError("Server closed the connection")
+
+        with self.metrics_lock:
+            if len(self.idle) < MAX_IDLE_CONNECTIONS and not self.stopped.is_set():
+                self.idle.append(sock)
+                sock = None
+        if sock is not None:
+            self._close(sock)
+
+        if response[0] != OK:
+            raise RuntimeError(response[1:].decode("utf-8"))
+        return response[1:]
+
+    def send_private_message(
+        self,
+        receiver_id: str,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Send a private message to the server.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_send_private_msg = timeit.default_timer()
+
+        self._request(SEND_PRIVATE, receiver_id, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_send_private_msg)
+
+    def retrieve_private_message(
+        self,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a private message from the server.
+        """
+        starttime_retrieve_private_msg = timeit.default_timer()
+
+        message = self._request(RETRIEVE_PRIVATE, self.client_id, label)
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_private_msg)
+
+        return message
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        """
+        Retrieve several private messages. Retrieval blocks on the server, so retrieving them one
+        after the other waits only as long as the last one takes to arrive.
+        """
+        return {label: self.retrieve_private_message(label) for label in labels}
+
+    def publish_message(
+        self,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Publish a message on the server.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_publish_msg = timeit.default_timer()
+
+        self._request(PUBLISH, self.client_id, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_publish_msg)
+
+    def retrieve_public_message(
+        self,
+        sender_id: str,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a public message from the server.
+        """
+        starttime_retrieve_public_msg = timeit.default_timer()
+
+        message = self._request(RETRIEVE_PUBLIC, sender_id, label)
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_public_msg)
+
+        return message
+
+    def retrieve_beaver_triplet_shares(
+        self,
+        op_id: str
+    ) -> Tuple[int, int, int]:
+        """
+        Retrieve a triplet of shares generated by the trusted server.
+        """
+        starttime = timeit.default_timer()
+
+        message = self._request(RETRIEVE_SHARES, self.client_id, op_id)
+
+        time_taken = timeit.default_timer() - starttime
+        self.comp_cost_ttp = time_taken
+        self.time_spent_retrieving += time_taken
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+            self.bytes_sent_ttp = self.bytes_sent_ttp + len(message)
+
+        return TRIPLET.unpack(message)
@@ -0,0 +1,195 @@
+"""
+Static cost model of a computation: what running a `ProtocolSpec` will cost, without running it.
+
+The model walks the expression once and applies the rules of `SMCParty.process_expression`
+(which operations need a Beaver multiplication, who retrieves which share, one triplet per
+operation ID from the TTP), so its counts are those of `simulator.simulate` and of a real run:
+
+* multiplicative depth: Beaver multiplications on the longest path of the expression;
+* Beaver multiplications, triplets generated by the TTP and triplet shares it serves;
+* rounds: one for the input sharing, one per level of Beaver multiplications (the depth) and one
+  for the result, as a party waits for them one after the other with the dataflow scheduler of
+  `SMCParty.evaluate` (the `rounds` metric of a run); `sequential_rounds` counts one per Beaver
+  multiplication instead, as the depth-first `process_expression` does;
+* messages sent and received per party (only the output parties retrieve the shares of the result);
+* bytes per party and in total, in the wire format of `server.py` (jsonpickle'd shares and
+  JSON triplets, the payloads counted by the `bytes_*` metrics; HTTP headers and polls are
+  not modelled) and of `binary_server.py` (length-prefixed records, binary triplets).
+
+Shares are uniformly random field elements, so their sizes are expectations: exact for the
+binary triplets, within a few percent of a real run for the decimal shares.
+
+Which party owns which secret is not part of the `ProtocolSpec`. Pass it to get the counts of
+every party; without it, every secret counts as owned by each party with probability 1/n.
+
+>>> costs = analyze(ProtocolSpec(expr=expr, participant_ids=["Alice", "Bob", "Charlie"]))
+>>> costs['multiplicative_depth'], costs['triplets_generated'], costs['rounds'], costs['bytes']
+"""
+
+from typing import Any, Dict, Iterable, Optional
+
+from communication import FRAME_LENGTH, RECORD_HEADER, TRIPLET
+from expression import Secret
+from protocol import ProtocolSpec
+from secret_sharing import get_prime
+from simulator import SHARE_ENVELOPE_LENGTH
+from smc_party import beaver_gates, input_secrets, multiplicative_depth
+
+
+def expected_digits(prime: int) -> float:
+    """
+    Expected number of decimal digits of a uniformly random element of [0, prime).
+    """
+    expected = 0.0
+    low = 0
+    digits = 1
+    while low < prime:
+        high = min(10 ** digits, prime)
+        expected += digits * (high - low) / prime
+        low = high
+        digits += 1
+    return expected
+
+
+# Expected sizes of the payloads: a jsonpickle'd share and the JSON triplet of server.py
+SHARE_MESSAGE_LENGTH = SHARE_ENVELOPE_LENGTH + expected_digits(get_prime())
+TRIPLET_MESSAGE_LENGTH = len("[\n  , \n  , \n  \n]\n") + 3 * expected_digits(get_prime())
+
+# binary_server.py: a request is a framed record, a response a framed status byte and body
+BINARY_OVERHEAD = FRAME_LENGTH.size + RECORD_HEADER.size
+
+
+def binary_request_length(owner_id: str, label: str, body: float = 0) -> float:
+    return BINARY_OVERHEAD + len(owner_id.encode("utf-8")) + len(label.encode("utf-8")) + body
+
+
+def binary_response_length(body: float = 0) -> float:
+    return FRAME_LENGTH.size + 1 + body
+
+
+class PartyCosts:
+    """
+    What one party is expected to send and receive (see `analyze`).
+    """
+
+    def __init__(self):
+        self.messages_sent = 0.0
+        self.messages_received = 0.0
+        self.bytes_sent_smc_party = 0.0
+        self.bytes_received_smc_party = 0.0
+        self.bytes_sent_ttp = 0.0
+        self.binary_bytes_sent = 0.0
+        self.binary_bytes_received = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return dict(vars(self))
+
+
+def analyze(
+    protocol_spec: ProtocolSpec,
+    secrets: Optional[Dict[str, Iterable[Secret]]] = None
+) -> Dict[str, Any]:
+    """
+    Predict the cost of running protocol_spec.
+
+    Args:
+        protocol_spec: the computation
+        secrets: the secrets of every party, per participant ID (e.g. the value dicts of the parties);
+            by default the secrets of the expression, owned by each party with probability 1/n. Raises a
+            ValueError if a secret of the expression has no owner.
+
+    Returns the costs: per party ('parties': messages and bytes sent and received, bytes sent to it by
+    the TTP, in the wire formats of server.py and binary_server.py) and in total (multiplicative depth,
+    Beaver multiplications, triplets generated and triplet shares served, rounds of the dataflow and of the
+    depth-first evaluation, messages, bytes).
+    """
+    participant_ids = list(protocol_spec.participant_ids)
+    output_ids = protocol_spec.output_ids
+    n = len(participant_ids)
+    expr = protocol_spec.expr
+
+    if secrets is None:
+        owned = {secret: {participant_id: 1 / n for participant_id in participant_ids}
+                 for secret in input_secrets(expr)}
+    else:
+        # the parties share only the secrets the expression uses
+        used_secrets = set(input_secrets(expr))
+        owned = dict()
+        for participant_id, party_secrets in secrets.items():
+            for secret in party_secrets:
+                if secret in used_secrets:
+                    owned[secret] = {other_id: float(other_id == participant_id) for other_id in participant_ids}
+        unowned = [secret for secret in used_secrets if secret not in owned]
+        if unowned:
+            unowned_ids = [str(secret.id) for secret in unowned]
+            raise ValueError(f"No participant holds the secrets of the expression with IDs {unowned_ids}")
+
+    gates = beaver_gates(expr)
+    op_id = str(expr)  # SMCParty asks the TTP for the triplet of the whole expression
+    costs = {participant_id: PartyCosts() for participant_id in participant_ids}
+
+    for participant_id, party in costs.items():
+        def send_private(receiver_id: str, label: str, count: float = 1,
+                         length: float = SHARE_MESSAGE_LENGTH) -> None:
+            party.messages_sent += count
+            party.bytes_sent_smc_party += count * length
+            party.binary_bytes_sent += count * binary_request_length(receiver_id, label, length)
+            party.binary_bytes_received += count * binary_response_length()
+
+        def retrieve(owner_id: str, label: str, count: float = 1, length: float = SHARE_MESSAGE_LENGTH) -> None:
+            party.messages_received += count
+            party.bytes_received_smc_party += count * length
+            party.binary_bytes_sent += count * binary_request_length(owner_id, label)
+            party.binary_bytes_received += count * binary_response_length(length)
+
+        def publish(label: str, length: float = SHARE_MESSAGE_LENGTH) -> None:
+            send_private(participant_id, label, length=length)
+
+        peer_ids = [peer_id for peer_id in participant_ids if peer_id != participant_id]
+
+        # input sharing: a share of each own secret to every peer
+        for secret, owners in owned.items():
+            for peer_id in peer_ids:
+                send_private(peer_id, str(secret.id), owners[participant_id])
+
+        # input sharing: the shares of the others' secrets used by the expression
+        for secret in input_secrets(expr):
+            retrieve(participant_id, str(secret.id), 1 - owned[secret][participant_id])
+
+        # evaluation: per Beaver multiplication a triplet, then x-a and y-b are opened
+        for gate in gates:
+            party.bytes_received_smc_party += TRIPLET_MESSAGE_LENGTH
+            party.bytes_sent_ttp += TRIPLET_MESSAGE_LENGTH
+            party.binary_bytes_sent += binary_request_length(participant_id, op_id)
+            party.binary_bytes_received += binary_response_length(TRIPLET.size)
+            for opening in ("(x-a)", "(y-b)"):
+                publish(f'{participant_id}-{gate}-{opening}')
+                for peer_id in peer_ids:
+                    retrieve(peer_id, f'{peer_id}-{gate}-{opening}')
+
+        # result exchange: only the output parties retrieve the shares of the result, the first one
+        # broadcasts the result (a jsonpickle'd int) to the others if asked to
+        publish(f'{participant_id}-res')
+        if participant_id in output_ids:
+            for peer_id in peer_ids:
+                retrieve(peer_id, f'{peer_id}-res')
+            if protocol_spec.broadcast and participant_id == output_ids[0]:
+                publish(f'{participant_id}-result', expected_digits(get_prime()))
+        elif protocol_spec.broadcast:
+            retrieve(output_ids[0], f'{output_ids[0]}-result', length=expected_digits(get_prime()))
+
+    parties = {participant_id: party.as_dict() for participant_id, party in costs.items()}
+    return {
+        'parties': parties,
+        'multiplicative_depth': multiplicative_depth(expr),
+        'beaver_multiplications': len(gates),
+        'triplets_generated': 1 if gates else 0,
+        'triplet_shares_served': len(gates) * n,
+        'rounds': multiplicative_depth(expr) + 2,
+        'sequential_rounds': len(gates) + 2,
+        'messages': sum(party['messages_sent'] for party in parties.values()),
+        'bytes': sum(party['bytes_sent_smc_party'] for party in parties.values()),
+        'bytes_sent_ttp': sum(party['bytes_sent_ttp'] for party in parties.values()),
+        'binary_bytes': sum(party['binary_bytes_sent'] + party['binary_bytes_received']
+                            for party in parties.values()),
+    }
@@ -1,13 +1,14 @@
 
 from random import randint
-import time
-from multiprocessing import Process, Queue
 
 from expression import Scalar, Secret
+from harness import default_concurrency, run_parallel, run_processes, run_threads, shared_server
 from protocol import ProtocolSpec
-from server import run
 
-from smc_party import SMCParty
+import mesh_communication
+import shared_memory_communication
+from network_emulation import LinkConditions, NetworkEmulation
+from results_store import ResultsStore
 
 from typing import (
     Dict,
@@ -20,6 +21,8 @@ import random
 
 import json
 
+import os
+
 import sys
 sys.setrecursionlimit(10000)
 
@@ -35,6 +38,11 @@ def process_metrics(metrics_dicts: List[Dict[str, int]]) -> Dict[str, int]:
     bytes_sent_smc_parties = []
     bytes_received_smc_parties = []
     runtime_overall = []
+    runtime_wall_clock = []
+    rounds = []
+    wire_bytes_sent_smc_parties = []
+    wire_bytes_received_smc_parties = []
+    server_time = 0
 
     # For the ttp: add the bytes sent across the different participants (no received bytes as smc_party instances only
     # communicate with the ttp via GET requests);
@@ -52,6 +60,11 @@ def process_metrics(metrics_dicts: List[Dict[str, int]]) -> Dict[str, int]:
             metrics_dict['bytes_received_smc_party'])
         bytes_sent_smc_parties.append(metrics_dict['bytes_sent_smc_party'])
         runtime_overall.append(metrics_dict['runtime_overall'])
+        runtime_wall_clock.append(metrics_dict['runtime_wall_clock'])
+        rounds.append(metrics_dict['rounds'])
+        wire_bytes_sent_smc_parties.append(metrics_dict['wire_bytes_sent_smc_party'])
+        wire_bytes_received_smc_parties.append(metrics_dict['wire_bytes_received_smc_party'])
+        server_time += metrics_dict['server_time']
 
         # NOTE obv metrics related to ttp only make sense in the cases where
         # there is multiplication of secrets involved
@@ -68,9 +81,28 @@ def process_metrics(metrics_dicts: List[Dict[str, int]]) -> Dict[str, int]:
         bytes_received_smc_parties)
     overall_metrics['bytes_sent_smc_party'] = mean(bytes_sent_smc_parties)
     overall_metrics['runtime_overall'] = mean(runtime_overall)
+    # the computation is done once the slowest party has the result
+    overall_metrics['runtime_wall_clock'] = max(runtime_wall_clock)
+    overall_metrics['rounds'] = max(rounds)
     overall_metrics['bytes_sent_ttp'] = bytes_sent_ttp
-
-    # The logic here is: when an smc_party first requests their triplet shares from the ttp,
+    # HTTP traffic with server.py, headers included, and the time the server spent on it
+    overall_metrics['wire_bytes_sent_smc_party'] = mean(wire_bytes_sent_smc_parties)
+    overall_metrics['wire_bytes_received_smc_party'] = mean(wire_bytes_received_smc_parties)
+    overall_metrics['server_time'] = server_time
+
+    # memory use (if measured, see observers.MemoryObserver): the party that needed the most
+    for key in metrics_dicts[0]:
+        if key.startswith('memory_'):
+            overall_metrics[key] = max(metrics_dict[key] for metrics_dict in metrics_dicts)
+
+    # server.py measures the time its ttp spends on each triplet request: the total is exact
+    ttp_times = [metrics_dict['ttp_time'] for metrics_dict in metrics_dicts if metrics_dict['ttp_time'] is not None]
+    if ttp_times:
+        overall_metrics['comp_time_ttp'] = sum(ttp_times)
+        return overall_metrics
+
+    # Without these measurements (other transports), estimate it from the round trip times:
+    # when an smc_party first requests their triplet shares from the ttp,
     # the ttp will have to generate the triplets & shares.
     # For all the smc_party instances requesting their shares from the ttp thereafter, the time we
     # are measuring is simply network delay.
@@ -84,54 +116,28 @@ def process_metrics(metrics_dicts: List[Dict[str, int]]) -> Dict[str, int]:
     return overall_metrics
 
 
-def smc_client(client_id, prot, value_dict, queue):
-    cli = SMCParty(
-        client_id,
-        "localhost",
-        5000,
-        protocol_spec=prot,
-        value_dict=value_dict
-    )
-    res = cli.run_instrumented()  # New: run instrumented so we can get metrics
-    queue.put(res)
-    print(f"{client_id} has finished!")
-
-
-def smc_server(args):
-    run("localhost", 5000, args)
-
-
-def run_processes(server_args, *client_args):
-    queue = Queue()
-
-    server = Process(target=smc_server, args=(server_args,))
-    clients = [Process(target=smc_client, args=(*args, queue))
-               for args in client_args]
-
-    server.start()
-    time.sleep(3)
-    for client in clients:
-        client.start()
-
-    results = list()
-    for client in clients:
-        client.join()
-
-    for client in clients:
-        results.append(queue.get())
-
-    server.terminate()
-    server.join()
-
-    # To "ensure" the workers are dead.
-    time.sleep(2)
-
-    print("Server stopped.")
-
-    return results
-
-
-def suite(parties, expr, expected):
+def suite(parties, expr, expected, transport="http", network: NetworkEmulation = None, server=None, cpus=None,
+          runner="processes", trace=None, profile=None, memory=False, preprocess=False):
+    """
+    Run the computation and return the aggregated metrics.
+
+    transport: "http" (parties talk through server.py), "shared_memory"
+               (co-located parties talk through shared memory, see shared_memory_communication.py)
+               or "mesh" (parties talk directly over TCP, see mesh_communication.py)
+    network: latency/jitter/bandwidth of the parties' links to the server (optional, "http" only,
+             see network_emulation.py)
+    server, cpus: server and cores to run the "http" computation on (optional, see harness.run_parallel)
+    runner: "processes" (one process per party) or "threads" (all parties as threads of one
+            process, see harness.run_threads); "http" only
+    trace: file to write a Chrome trace of the parties and the server to (optional, "http" only,
+           see tracing.py)
+    profile: files (without extension) to write the sampled stacks of the parties and the server to,
+             as collapsed stacks and flame graph (optional, "http" only, see profiling.py)
+    memory: also measure the memory use of the parties per phase (see observers.MemoryObserver) and of
+            the server's store ("http" only; slows the parties down)
+    preprocess: retrieve the Beaver triplets before the runs (see SMCParty.preprocess), so that the
+                metrics are those of the online phase ("http" only)
+    """
 
     print(f"Expr: {expr}")
 
@@ -143,7 +149,33 @@ def suite(parties, expr, expected):
     clients = [(name, prot, value_dict)
                for name, value_dict in parties.items()]
 
-    results = run_processes(participants, *clients)
+    if network is not None and transport != "http":
+        raise ValueError("Network emulation is only available with the http transport")
+    if runner != "processes" and transport != "http":
+        raise ValueError("Running the parties as threads is only available with the http transport")
+    if trace is not None and transport != "http":
+        raise ValueError("Tracing is only available with the http transport")
+    if profile is not None and transport != "http":
+        raise ValueError("Profiling is only available with the http transport")
+    if memory and transport != "http":
+        raise ValueError("Memory accounting is only available with the http transport")
+    if preprocess and transport != "http":
+        raise ValueError("Preprocessing is only available with the http transport")
+
+    if transport == "shared_memory":
+        results = shared_memory_communication.run_processes(
+            participants, *clients, instrumented=True)
+    elif transport == "mesh":
+        results = mesh_communication.run_processes(
+            participants, *clients, instrumented=True)
+    elif runner == "threads":
+        results = run_threads(
+            participants, *clients, instrumented=True, network=network, server=server, cpus=cpus, trace=trace,
+            profile=profile, memory=memory, preprocess=preprocess)
+    else:
+        results = run_processes(
+            participants, *clients, instrumented=True, network=network, server=server, cpus=cpus, trace=trace,
+            profile=profile, memory=memory, preprocess=preprocess)
 
     # List which will contain all the dictionaries with metrics as measured by the parties
     metrics_dicts = []
@@ -159,23 +191,84 @@ def suite(parties, expr, expected):
     # For the ttp: add the bytes sent and received across the different participants; for the comp. time: get the max value and subtract the avg of all the other values
     metrics_processed = process_metrics(metrics_dicts)
 
+    if memory:
+        server_memory = (server or shared_server()).memory()
+        metrics_processed['memory_server_store_peak'] = server_memory['store_bytes_peak']
+        if 'rss_peak' in server_memory:
+            metrics_processed['memory_server_rss_peak'] = server_memory['rss_peak']
+
     return metrics_processed
 
+
+def run_experiment(jobs, concurrency=None, experiment=None):
+    """
+    Run the repetitions of an experiment, several of them in parallel.
+
+    jobs: list of (variables, suite_kwargs): the variables of the repetition (e.g. number of
+          parties, iteration), added to its metrics, and the arguments for `suite`
+    concurrency: maximum number of repetitions running at the same time (default: as many as
+                 fit on the usable cores, see harness.default_concurrency; the environment
+                 variable SMC_BENCH_CONCURRENCY overrides the default)
+    experiment: name under which the results are recorded in the results store (optional,
+                see results_store.py)
+
+    Every parallel slot uses its own server and, when there are enough cores, its own cores.
+    The load average at the end of each repetition and the concurrency are recorded along
+    with the metrics, so that contaminated measurements can be recognized.
+    """
+
+    # one process per party + the server
+    processes_per_job = max(len(suite_kwargs['parties']) for _, suite_kwargs in jobs) + 1
+
+    if concurrency is None:
+        concurrency = int(os.environ.get('SMC_BENCH_CONCURRENCY', default_concurrency(processes_per_job)))
+
+    def run_job(job, server, cpus):
+
+        variables, suite_kwargs = job
+
+        metrics_processed = suite(**suite_kwargs, server=server, cpus=cpus)
+
+        # Add our variables
+        metrics_processed.update(variables)
+        metrics_processed.update({'concurrency': concurrency})
+        metrics_processed.update({'pinned': cpus is not None})
+        if hasattr(os, 'getloadavg'):
+            metrics_processed.update({'load_avg': os.getloadavg()[0]})
+
+        print("Metrics aggregated: ")
+
+        print(metrics_processed)
+
+        return metrics_processed
+
+    results = run_parallel(run_job, jobs, concurrency, processes_per_job)
+
+    if experiment is not None:
+        store = ResultsStore()
+        run_id = store.record_run(experiment, results)
+        store.close()
+        print(f"Results recorded in {store.path} as run {run_id}")
+
+    return results
+
 # **************************************************************
 # MEASUREMENT 1: influence of number of participants
 
 
-def test_influence_of_number_of_participants() -> None:
+def test_influence_of_number_of_participants(concurrency: int = None, runner: str = "processes") -> None:
     """
     We want to use an expression that contains all our operations
     f(a, b, c) = (a*b + c) * K1 + K2
+
+    runner: "threads" hosts the parties as threads instead of processes (see suite)
     """
 
     # Initialize randomness generator with seed
     random.seed(10)
 
-    # List which will store dictionaries with results
-    results = []
+    # List which will store the computations to run
+    jobs = []
 
     # now we are adding some dummy participants whose secrets we won't use
     for num_parts in [5, 10, 25, 50, 75, 100]:
@@ -217,19 +310,11 @@ def test_influence_of_number_of_participants() -> None:
                 parties.update(
                     {f'party_{i}': {Secret(): random.randint(0, 1753388297-1)}})
 
-            # Grab the metrics computed
-            metrics_processed = suite(parties, expr, expected)
-
-            # Add our variables: number of parties, iteration
-            metrics_processed.update({'num_parties': num_parts})
-            metrics_processed.update({'iteration': iteration})
-
-            print("Metrics aggregated: ")
+            # Queue the computation together with our variables
+            jobs.append(({'num_parties': num_parts, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected, runner=runner)))
 
-            print(metrics_processed)
-
-            # append to results
-            results.append(metrics_processed)
+    results = run_experiment(jobs, concurrency, experiment='num_participants')
 
     # write result to json array
     with open('num_participants_results.json', 'w') as out:
@@ -239,7 +324,7 @@ def test_influence_of_number_of_participants() -> None:
 # **************************************************************
 # MEASUREMENT 2: influence of number of secret additions
 
-def test_influence_of_number_of_secret_additions() -> None:
+def test_influence_of_number_of_secret_additions(concurrency: int = None) -> None:
     """
     We want to use an expression that contains many additions of secrets
     f(a, b, c) = a + b + c + a + b + c + ..... + a + b + c
@@ -248,8 +333,8 @@ def test_influence_of_number_of_secret_additions() -> None:
     # Initialize randomness generator with seed
     random.seed(10)
 
-    # List which will store dictionaries with results
-    results = []
+    # List which will store the computations to run
+    jobs = []
 
     # Now vary the number of additions
     for num_secret_additions in [10, 100, 500, 1000]:
@@ -292,22 +377,13 @@ def test_influence_of_number_of_secret_additions() -> None:
 
                 expected = (expected + values_list[ind]) % 1753388297
 
-            # run the suite and grab the results
-            metrics_processed = suite(parties, expr, expected)
-
-            # Add our variables: number of parties, iteration
-            metrics_processed.update(
-                {'num_secret_additions': num_secret_additions})
-            metrics_processed.update({'iteration': iteration})
-
-            print("Metrics aggregated: ")
+            # Queue the computation together with our variables
+            jobs.append(({'num_secret_additions': num_secret_additions, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected)))
 
-            print(metrics_processed)
+    results = run_experiment(jobs, concurrency, experiment='num_secret_additions')
 
-            # append to results
-            results.append(metrics_processed)
-
-     # write result to json array
+    # write result to json array
     with open('num_secret_additions_results.json', 'w') as out:
         json.dump(results, out)
 
@@ -315,7 +391,7 @@ def test_influence_of_number_of_secret_additions() -> None:
 # MEASUREMENT 3: influence of number of scalar additions
 
 
-def test_influence_of_number_of_scalar_additions() -> None:
+def test_influence_of_number_of_scalar_additions(concurrency: int = None) -> None:
     """
     We want to use an expression that contains many additions of scalars
     f(a, b, c) = k1 + k2 + k3 + ..... + kn
@@ -324,8 +400,8 @@ def test_influence_of_number_of_scalar_additions() -> None:
     # Initialize randomness generator with seed
     random.seed(10)
 
-    # List which will store dictionaries with results
-    results = []
+    # List which will store the computations to run
+    jobs = []
 
     # Now vary the number of additions
     for num_scalar_additions in [10, 100, 500, 1000]:
@@ -366,20 +442,11 @@ def test_influence_of_number_of_scalar_additions() -> None:
 
                 expected = (expected + scalar_val) % 1753388297
 
-            # run the suite and grab the results
-            metrics_processed = suite(parties, expr, expected)
-
-            # Add our variables: number of parties, iteration
-            metrics_processed.update(
-                {'num_scalar_additions': num_scalar_additions})
-            metrics_processed.update({'iteration': iteration})
+            # Queue the computation together with our variables
+            jobs.append(({'num_scalar_additions': num_scalar_additions, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected)))
 
-            print("Metrics aggregated: ")
-
-            print(metrics_processed)
-
-            # append to results
-            results.append(metrics_processed)
+    results = run_experiment(jobs, concurrency, experiment='num_scalar_additions')
 
     # write result to json array
     with open('num_scalar_additions_results.json', 'w') as out:
@@ -389,7 +456,7 @@ def test_influence_of_number_of_scalar_additions() -> None:
 # MEASUREMENT 4: influence of number of secret multiplications
 
 
-def test_influence_of_number_of_secret_multiplications() -> None:
+def test_influence_of_number_of_secret_multiplications(concurrency: int = None) -> None:
     """
     We want to use an expression that contains many multiplications of secrets
     f(a, b, c) = a * b * c * a * b * c * ..... * a * b * c
@@ -398,8 +465,8 @@ def test_influence_of_number_of_secret_multiplications() -> None:
     # Initialize randomness generator with seed
     random.seed(10)
 
-    # List which will store dictionaries with results
-    results = []
+    # List which will store the computations to run
+    jobs = []
 
     # Now vary the number of multiplications
     for num_secret_multiplications in [10, 100, 500, 1000]:
@@ -440,20 +507,11 @@ def test_influence_of_number_of_secret_multiplications() -> None:
 
                 expected = (expected * values_list[ind]) % 1753388297
 
-            # run the suite and grab the results
-            metrics_processed = suite(parties, expr, expected)
-
-            # Add our variables: number of parties, iteration
-            metrics_processed.update(
-                {'num_secret_multiplications': num_secret_multiplications})
-            metrics_processed.update({'iteration': iteration})
+            # Queue the computation together with our variables
+            jobs.append(({'num_secret_multiplications': num_secret_multiplications, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected)))
 
-            print("Metrics aggregated: ")
-
-            print(metrics_processed)
-
-            # append to results
-            results.append(metrics_processed)
+    results = run_experiment(jobs, concurrency, experiment='num_secret_multiplications')
 
     # write result to json array
     with open('num_secret_multiplications_results.json', 'w') as out:
@@ -463,7 +521,7 @@ def test_influence_of_number_of_secret_multiplications() -> None:
     # MEASUREMENT 5: influence of number of scalar multiplications
 
 
-def test_influence_of_number_of_scalar_multiplications() -> None:
+def test_influence_of_number_of_scalar_multiplications(concurrency: int = None) -> None:
     """
     We want to use an expression that contains many additions of scalars
     f(a, b, c) = k1 * k2 * k3 * ..... * kn
@@ -472,8 +530,8 @@ def test_influence_of_number_of_scalar_multiplications() -> None:
     # Initialize randomness generator with seed
     random.seed(10)
 
-    # List which will store dictionaries with results
-    results = []
+    # List which will store the computations to run
+    jobs = []
 
     # Now vary the number of multiplications
     for num_scalar_multiplications in [10, 100, 500, 1000]:
@@ -515,23 +573,76 @@ def test_influence_of_number_of_scalar_multiplications() -> None:
 
                 expected = (expected * scalar_val) % 1753388297
 
-            # run the suite and grab the results
-            metrics_processed = suite(parties, expr, expected)
+            # Queue the computation together with our variables
+            jobs.append(({'num_scalar_multiplications': num_scalar_multiplications, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected)))
 
-            # Add our variables: number of parties, iteration
-            metrics_processed.update(
-                {'num_scalar_multiplications': num_scalar_multiplications})
-            metrics_processed.update({'iteration': iteration})
+    results = run_experiment(jobs, concurrency, experiment='num_scalar_multiplications')
 
-            print("Metrics aggregated: ")
+    # write result to json array
+    with open('num_scalar_multiplications_results.json', 'w') as out:
+        json.dump(results, out)
+
+# **************************************************************
+# MEASUREMENT 6: influence of network latency (emulated, see network_emulation.py)
 
-            print(metrics_processed)
 
-            # append to results
-            results.append(metrics_processed)
+def test_influence_of_network_latency(concurrency: int = None) -> None:
+    """
+    Same expression as in measurement 1, with every party's link to the server
+    getting a one-way latency (10% jitter) on a 100 Mbit/s link
+    f(a, b, c) = (a*b + c) * K1 + K2
+    """
+
+    # Initialize randomness generator with seed
+    random.seed(10)
+
+    # List which will store the computations to run
+    jobs = []
+
+    # one-way latencies in seconds: same rack, same region, cross-continent
+    for latency in [0.0, 0.001, 0.01, 0.05]:
+
+        network = NetworkEmulation(default=LinkConditions(
+            latency=latency, jitter=latency / 10, bandwidth=12.5e6))
+
+        # 30 iterations each => central limit theorem
+        for iteration in range(30):
+
+            # Generate three secrets & associated values
+            alice_secret = Secret()
+            alice_val = random.randint(0, 1753388297-1)
+
+            bob_secret = Secret()
+            bob_val = random.randint(0, 1753388297-1)
+
+            charlie_secret = Secret()
+            charlie_val = random.randint(0, 1753388297-1)
+
+            parties = {
+                "Alice": {alice_secret: alice_val},
+                "Bob": {bob_secret: bob_val},
+                "Charlie": {charlie_secret: charlie_val}
+            }
+
+            # Generate two scalars
+            scalar_one = random.randint(0, 1753388297-1)
+            scalar_two = random.randint(0, 1753388297-1)
+
+            expr = ((alice_secret * bob_secret) + charlie_secret) * \
+                Scalar(scalar_one) + Scalar(scalar_two)
+
+            expected = ((alice_val * bob_val + charlie_val) *
+                        scalar_one + scalar_two) % 1753388297
+
+            # Queue the computation together with our variables
+            jobs.append(({'latency': latency, 'iteration': iteration},
+                         dict(parties=parties, expr=expr, expected=expected, network=network)))
+
+    results = run_experiment(jobs, concurrency, experiment='network_latency')
 
     # write result to json array
-    with open('num_scalar_multiplications_results.json', 'w') as out:
+    with open('network_latency_results.json', 'w') as out:
         json.dump(results, out)
 
 
@@ -547,3 +658,5 @@ if __name__ == "__main__":
 
     test_influence_of_number_of_participants()
 
+
+    test_influence_of_network_latency()
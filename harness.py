@@ -0,0 +1,364 @@
+"""
+Reusable harness for running SMC computations against `server.py`.
+
+Replaces the copies of `run_processes` with fixed sleeps: the server is started once per
+process on a free port, detected as ready as soon as it accepts connections, and reset
+(store emptied, TTP re-created with the new participants) between computations instead of
+being restarted.
+
+`run_threads` hosts the parties as threads of one process (or of a few worker processes)
+instead of one process per party, for computations with many parties.
+
+Both take a `trace` file name to record a Chrome trace of the parties and the server
+(see tracing.py), and a `profile` file name to sample the stacks of the parties and the
+server into a flame graph (see profiling.py). With `preprocess`, the parties retrieve their
+Beaver triplets before they start (see `SMCParty.preprocess`), so that only the online phase
+is measured.
+
+`run_parallel` runs independent computations side by side, each on its own server and,
+where the platform allows it, pinned to its own set of cores.
+"""
+
+import atexit
+import os
+import queue as queue_module
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+import requests
+
+from profiling import Profiler, write_profile
+from server import run
+from smc_party import SMCParty
+from tracing import Tracer, TracingCommunication, write_chrome_trace
+
+
+def free_port(host: str = "localhost") -> int:
+    """
+    A port on host nobody is listening on right now.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10.0) -> None:
+    """
+    Block until something accepts connections on (host, port).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port)).close()
+            return
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def usable_cpus() -> List[int]:
+    """
+    The cores this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin_to_cpus(cpus: Optional[Set[int]]) -> None:
+    """
+    Restrict the calling process to cpus (no-op if cpus is None or the platform cannot do it).
+    """
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def run_pinned(cpus, target, *args):
+    pin_to_cpus(cpus)
+    target(*args)
+
+
+class RelayServer:
+    """
+    A `server.py` process that stays up across computations.
+
+    Attributes:
+        host: hostname to listen on (default: "localhost")
+        port: port to listen on (default: a free port)
+        cpus: cores to pin the server to (optional)
+    """
+
+    def __init__(self, host: str = "localhost", port: Optional[int] = None, cpus: Optional[Set[int]] = None):
+        self.host = host
+        self.port = port if port is not None else free_port(host)
+        self.cpus = cpus
+        self.process: Optional[Process] = None
+
+    def start(self, participants: List[str]) -> None:
+        self.process = Process(target=run_pinned, args=(self.cpus, run, self.host, self.port, participants),
+                               daemon=True)
+        self.process.start()
+        wait_for_port(self.host, self.port)
+
+    def reset(self, participants: List[str]) -> None:
+        """
+        Prepare the server for a new computation among participants, starting it if needed.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.start(participants)
+        else:
+            requests.post(f"http://{self.host}:{self.port}/reset", json=list(participants))
+
+    def start_tracing(self) -> None:
+        requests.post(f"http://{self.host}:{self.port}/trace")
+
+    def trace_events(self) -> List[Dict[str, Any]]:
+        return requests.get(f"http://{self.host}:{self.port}/trace").json()
+
+    def start_profiling(self) -> None:
+        requests.post(f"http://{self.host}:{self.port}/profile")
+
+    def profile_stacks(self) -> Dict[str, int]:
+        return requests.get(f"http://{self.host}:{self.port}/profile").json()
+
+    def memory(self) -> Dict[str, int]:
+        return requests.get(f"http://{self.host}:{self.port}/memory").json()
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+            print("Server stopped.")
+
+
+# The server shared by all computations of this process, started on first use
+_server: Optional[RelayServer] = None
+
+
+def shared_server() -> RelayServer:
+    global _server
+    if _server is None:
+        _server = RelayServer()
+        atexit.register(_server.stop)
+    return _server
+
+
+def run_party(client_id, prot, value_dict, host, port, instrumented=False, network=None, trace=False,
+              profile=False, memory=False, preprocess=False):
+    """
+    Run one party (instrumented: with its metrics, memory: including its memory use); with trace or
+    profile, return (result, client_id, recordings) where recordings are its spans ('trace') and its
+    sampled stacks ('profile').
+    """
+    tracer = Tracer(client_id) if trace else None
+    profiler = Profiler(client_id) if profile else None
+    cli = SMCParty(
+        client_id,
+        host,
+        port,
+        protocol_spec=prot,
+        value_dict=value_dict,
+        observers=[observer for observer in (tracer, profiler) if observer is not None]
+    )
+    # Emulate WAN conditions on top of the loopback connection to the server
+    if network is not None:
+        cli.comm = network.wrap(cli.comm)
+    if tracer is not None:
+        cli.comm = TracingCommunication(cli.comm, tracer)
+    if preprocess:
+        cli.preprocess()
+    res = cli.run_instrumented(memory) if instrumented else cli.run()
+    if not (trace or profile):
+        return res
+    recordings = dict()
+    if tracer is not None:
+        recordings['trace'] = tracer.events
+    if profiler is not None:
+        recordings['profile'] = profiler.stacks
+    return res, client_id, recordings
+
+
+def smc_client(client_id, prot, value_dict, host, port, queue, instrumented=False, network=None, cpus=None,
+               trace=False, profile=False, memory=False, preprocess=False):
+    pin_to_cpus(cpus)
+    queue.put(run_party(client_id, prot, value_dict, host, port, instrumented, network, trace, profile, memory,
+                        preprocess))
+    print(f"{client_id} has finished!")
+
+
+def smc_threads(client_args, host, port, queue, instrumented=False, network=None, cpus=None, trace=False,
+                profile=False, memory=False, preprocess=False):
+    """
+    Run the parties of client_args as threads of this process, putting their results on queue.
+    """
+    pin_to_cpus(cpus)
+
+    def run_thread(client_id, prot, value_dict):
+        queue.put(run_party(client_id, prot, value_dict, host, port, instrumented, network, trace, profile,
+                            memory, preprocess))
+        print(f"{client_id} has finished!")
+
+    threads = [threading.Thread(target=run_thread, args=args) for args in client_args]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def start_recording(server: RelayServer, trace: Optional[str], profile: Optional[str]) -> None:
+    if trace is not None:
+        server.start_tracing()
+    if profile is not None:
+        server.start_profiling()
+
+
+def collect_recordings(server: RelayServer, outputs: List[Any], trace: Optional[str],
+                       profile: Optional[str]) -> List[Any]:
+    """
+    Without trace and profile, the outputs of the parties are their results. Otherwise they are
+    (result, client_id, recordings): write the spans of the parties and of the server to the file
+    trace, their stacks to the files profile.collapsed and profile.svg, and return the results.
+    """
+    if trace is None and profile is None:
+        return outputs
+    if trace is not None:
+        write_chrome_trace(trace, {"server": server.trace_events(),
+                                   **{client_id: recordings['trace'] for _, client_id, recordings in outputs}})
+    if profile is not None:
+        write_profile(profile, [server.profile_stacks()] + [recordings['profile'] for _, _, recordings in outputs])
+    return [res for res, _, _ in outputs]
+
+
+def run_processes(server_args, *client_args, instrumented: bool = False, network=None,
+                  server: Optional[RelayServer] = None, cpus: Optional[Set[int]] = None,
+                  trace: Optional[str] = None, profile: Optional[str] = None, memory: bool = False,
+                  preprocess: bool = False) -> List[Any]:
+    """
+    Run one computation: server_args is the list of participant IDs, each of client_args is
+    (client_id, prot, value_dict). Returns what the parties' run (or run_instrumented) returned,
+    in order of completion.
+
+    network: NetworkEmulation applied to the parties' transports (optional)
+    server: the server to use (default: the server shared by this process)
+    cpus: cores to pin the parties to (optional)
+    trace: file to write the Chrome trace of the parties and the server to (optional)
+    profile: files (without extension) to write the merged stacks of the parties and the server to,
+             as collapsed stacks and as a flame graph (optional)
+    memory: with instrumented, add the memory use of the parties to their metrics (see
+            observers.MemoryObserver; slows the parties down)
+    preprocess: retrieve the Beaver triplets before running (SMCParty.preprocess), outside of the metrics
+    """
+    if server is None:
+        server = shared_server()
+    server.reset(server_args)
+    start_recording(server, trace, profile)
+
+    queue = Queue()
+    clients = [Process(target=smc_client,
+                       args=(*args, server.host, server.port, queue, instrumented, network, cpus, trace is not None,
+                             profile is not None, memory, preprocess))
+               for args in client_args]
+
+    for client in clients:
+        client.start()
+
+    # Empty the queue before joining: a child does not exit while its result is unread.
+    results = [queue.get() for _ in clients]
+
+    for client in clients:
+        client.join()
+
+    return collect_recordings(server, results, trace, profile)
+
+
+def run_threads(server_args, *client_args, instrumented: bool = False, network=None,
+                server: Optional[RelayServer] = None, cpus: Optional[Set[int]] = None,
+                num_workers: int = 1, trace: Optional[str] = None, profile: Optional[str] = None,
+                memory: bool = False, preprocess: bool = False) -> List[Any]:
+    """
+    Same as run_processes, but the parties run as threads: in this process (num_workers=1) or
+    spread over num_workers worker processes. This avoids starting a process per party, so that
+    computations with a large number of parties fit on one machine.
+
+    The parties of a process share its interpreter: their computation time metrics include the
+    time the other threads held the interpreter lock, spread the parties over more workers to
+    reduce that effect.
+    """
+    if server is None:
+        server = shared_server()
+    server.reset(server_args)
+    start_recording(server, trace, profile)
+
+    if num_workers == 1:
+        queue = queue_module.Queue()
+        smc_threads(client_args, server.host, server.port, queue, instrumented, network, None, trace is not None,
+                    profile is not None, memory, preprocess)
+        return collect_recordings(server, [queue.get() for _ in client_args], trace, profile)
+
+    queue = Queue()
+    workers = [Process(target=smc_threads,
+                       args=(client_args[i::num_workers], server.host, server.port, queue, instrumented, network, cpus,
+                             trace is not None, profile is not None, memory, preprocess))
+               for i in range(min(num_workers, len(client_args)))]
+
+    for worker in workers:
+        worker.start()
+
+    # Empty the queue before joining: a child does not exit while its result is unread.
+    results = [queue.get() for _ in client_args]
+
+    for worker in workers:
+        worker.join()
+
+    return collect_recordings(server, results, trace, profile)
+
+
+def default_concurrency(processes_per_job: int) -> int:
+    """
+    How many computations of processes_per_job processes (parties + server) fit on the usable cores.
+    """
+    return max(1, len(usable_cpus()) // processes_per_job)
+
+
+def run_parallel(run_job: Callable[[Any, RelayServer, Optional[Set[int]]], Any], jobs: Sequence[Any],
+                 concurrency: int, processes_per_job: int) -> List[Any]:
+    """
+    Call run_job(job, server, cpus) for every job, with at most `concurrency` jobs at a time,
+    and return the results in the order of jobs.
+
+    Each of the `concurrency` slots has its own server on its own port. If there are at
+    least concurrency * processes_per_job usable cores, each slot also gets a disjoint set of
+    processes_per_job cores for its server and parties (cpus), so that concurrent jobs do not
+    compete for the same cores; otherwise cpus is None.
+    """
+    cpus = usable_cpus()
+    slots = queue_module.Queue()
+    servers = []
+    for slot in range(concurrency):
+        if len(cpus) >= concurrency * processes_per_job:
+            slot_cpus = set(cpus[slot * processes_per_job:(slot + 1) * processes_per_job])
+        else:
+            slot_cpus = None
+        server = RelayServer(cpus=slot_cpus)
+        servers.append(server)
+        slots.put(server)
+
+    def run_in_slot(job):
+        server = slots.get()
+        try:
+            return run_job(job, server, server.cpus)
+        finally:
+            slots.put(server)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(run_in_slot, jobs))
+    finally:
+        for server in servers:
+            server.stop()
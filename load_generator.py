@@ -0,0 +1,297 @@
+"""
+Closed-loop load generator measuring the sessions/sec a `server.py` relay (and its TTP) sustains.
+
+A session is one complete computation among its own parties, each running as an `SMCParty`
+in a thread of this process. Up to `concurrency` sessions run at the same time: every time one
+finishes the next one starts, no earlier than the arrival rate allows (if one is given). The
+circuit of each session is drawn from a weighted mix, and each session registers its
+participants through the `/sessions` route of the server so that its Beaver triplets are its own
+(and unregisters them once finished, so that the server does not keep its messages).
+
+The report contains the sustained sessions/sec, the percentiles of the session latency and the
+CPU and memory use of the server process (when it runs on this machine):
+
+    python load_generator.py --sessions 200 --concurrency 16 --parties 3 --mix sum:2,product:1,mixed:1
+    python load_generator.py --host relay.example.org --port 5000 --rate 10
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import timeit
+from statistics import mean
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+
+from expression import Expression, Scalar, Secret
+from harness import RelayServer
+from protocol import ProtocolSpec
+from secret_sharing import get_prime
+from smc_party import SMCParty
+
+
+def sum_circuit(inputs: List[Tuple[Secret, int]]) -> Tuple[Expression, int]:
+    """
+    Sum of the inputs of all parties (no multiplication).
+    """
+    expr, expected = inputs[0]
+    for secret, value in inputs[1:]:
+        expr = expr + secret
+        expected += value
+    return expr, expected % get_prime()
+
+
+def product_circuit(inputs: List[Tuple[Secret, int]]) -> Tuple[Expression, int]:
+    """
+    Product of the inputs of the first two parties (one Beaver multiplication).
+    """
+    (a, a_value), (b, b_value) = inputs[0], inputs[1 % len(inputs)]
+    return a * b, a_value * b_value % get_prime()
+
+
+def mixed_circuit(inputs: List[Tuple[Secret, int]]) -> Tuple[Expression, int]:
+    """
+    f(a, b, c) = (a*b + c) * K1 + K2, as in the experiments of evaluate_performance.py.
+    """
+    (a, a_value), (b, b_value), (c, c_value) = (inputs[i % len(inputs)] for i in range(3))
+    k1, k2 = random.randrange(get_prime()), random.randrange(get_prime())
+    return (a * b + c) * Scalar(k1) + Scalar(k2), ((a_value * b_value + c_value) * k1 + k2) % get_prime()
+
+
+CIRCUITS: Dict[str, Callable[[List[Tuple[Secret, int]]], Tuple[Expression, int]]] = {
+    "sum": sum_circuit,
+    "product": product_circuit,
+    "mixed": mixed_circuit,
+}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    "sum:2,product:1" -> {"sum": 2.0, "product": 1.0} (the weight defaults to 1).
+    """
+    mix = dict()
+    for entry in text.split(","):
+        name, _, weight = entry.partition(":")
+        if name not in CIRCUITS:
+            raise ValueError(f"Unknown circuit {name!r}, choose from {', '.join(CIRCUITS)}")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Nearest-rank percentile (q in [0, 100]) of a non-empty list.
+    """
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[int(rank) - 1]
+
+
+class ServerMonitor:
+    """
+    Samples the CPU and memory use of the server process while the load runs.
+
+    Attributes:
+        pid: process ID of the server
+        interval: seconds between two samples of the memory use
+    """
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        import psutil
+
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.rss_samples: List[int] = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.rss_samples.append(self.process.memory_info().rss)
+
+    def start(self) -> None:
+        self.cpu_times = self.process.cpu_times()
+        self.starttime = timeit.default_timer()
+        self.thread.start()
+
+    def stop(self) -> Dict[str, float]:
+        self.stopped.set()
+        self.thread.join()
+        cpu_times = self.process.cpu_times()
+        cpu_seconds = (cpu_times.user - self.cpu_times.user) + (cpu_times.system - self.cpu_times.system)
+        rss = self.rss_samples or [self.process.memory_info().rss]
+        return {
+            'cpu_seconds': cpu_seconds,
+            'cpu_utilization': cpu_seconds / (timeit.default_timer() - self.starttime),
+            'rss_max_bytes': max(rss),
+            'rss_mean_bytes': mean(rss),
+        }
+
+
+def run_session(session_id: int, circuit: str, num_parties: int, host: str, port: int) -> bool:
+    """
+    Run one computation among num_parties fresh parties; True if they all got the expected result.
+    """
+    prime = get_prime()
+    participants = [f"session{session_id}-party{i}" for i in range(num_parties)]
+    inputs = [(Secret(), random.randrange(prime)) for _ in participants]
+    expr, expected = CIRCUITS[circuit](inputs)
+
+    requests.post(f"http://{host}:{port}/sessions", json=participants)
+
+    prot = ProtocolSpec(participant_ids=participants, expr=expr)
+    results = [None] * num_parties
+
+    def run_party(i: int) -> None:
+        secret, value = inputs[i]
+        results[i] = SMCParty(participants[i], host, port, protocol_spec=prot, value_dict={secret: value}).run()
+
+    parties = [threading.Thread(target=run_party, args=(i,)) for i in range(num_parties)]
+    for party in parties:
+        party.start()
+    for party in parties:
+        party.join()
+
+    # the server forgets the messages and the ttp of the session
+    requests.delete(f"http://{host}:{port}/sessions", json=participants)
+
+    return all(result == expected for result in results)
+
+
+def run_load(
+    host: str,
+    port: int,
+    sessions: int,
+    concurrency: int,
+    num_parties: int,
+    mix: Dict[str, float],
+    rate: Optional[float] = None,
+    server_pid: Optional[int] = None
+) -> Dict[str, object]:
+    """
+    Run the sessions and return the report.
+
+    rate: maximum sessions started per second (default: unlimited, i.e. purely closed loop)
+    server_pid: process of the server whose resource use is reported (optional)
+    """
+    circuits = random.choices(list(mix), weights=list(mix.values()), k=sessions)
+    latencies: List[Tuple[str, float]] = []
+    failures = 0
+    next_session = 0
+    lock = threading.Lock()
+
+    monitor = ServerMonitor(server_pid) if server_pid is not None else None
+
+    def worker() -> None:
+        nonlocal next_session, failures
+        while True:
+            with lock:
+                session_id = next_session
+                next_session += 1
+            if session_id >= sessions:
+                return
+
+            # open the session no earlier than its arrival time
+            if rate is not None:
+                delay = starttime + session_id / rate - timeit.default_timer()
+                if delay > 0:
+                    threading.Event().wait(delay)
+
+            session_start = timeit.default_timer()
+            succeeded = run_session(session_id, circuits[session_id], num_parties, host, port)
+            latency = timeit.default_timer() - session_start
+
+            with lock:
+                latencies.append((circuits[session_id], latency))
+                failures += not succeeded
+
+    if monitor is not None:
+        monitor.start()
+
+    # The parties print every step; keep that out of the report.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        starttime = timeit.default_timer()
+        workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        duration = timeit.default_timer() - starttime
+
+    all_latencies = [latency for _, latency in latencies]
+    report = {
+        'sessions': sessions,
+        'failures': failures,
+        'concurrency': concurrency,
+        'num_parties': num_parties,
+        'mix': mix,
+        'arrival_rate': rate,
+        'duration': duration,
+        'sessions_per_sec': sessions / duration,
+        'latency': {
+            'mean': mean(all_latencies),
+            'p50': percentile(all_latencies, 50),
+            'p90': percentile(all_latencies, 90),
+            'p99': percentile(all_latencies, 99),
+            'max': max(all_latencies),
+        },
+        'latency_p99_per_circuit': {
+            circuit: percentile([latency for name, latency in latencies if name == circuit], 99)
+            for circuit in sorted(set(circuits))
+        },
+    }
+    if monitor is not None:
+        report['server'] = monitor.stop()
+
+    return report
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost", help="host of the server (default: localhost)")
+    parser.add_argument("--port", type=int,
+                        help="port of a running server (default: start a server on a free port)")
+    parser.add_argument("--server-pid", type=int,
+                        help="process ID of the running server, to report its resource use")
+    parser.add_argument("--sessions", type=int, default=100, help="number of sessions (default: 100)")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum number of sessions running at the same time (default: 8)")
+    parser.add_argument("--parties", type=int, default=3, help="parties per session (default: 3)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("sum,product,mixed"),
+                        help="weighted circuit mix, e.g. sum:2,product:1,mixed:1 (default: equal weights)")
+    parser.add_argument("--rate", type=float, help="maximum sessions started per second (default: unlimited)")
+    parser.add_argument("--seed", type=int, help="seed of the circuit mix and the inputs")
+    parser.add_argument("--output", help="write the report to this JSON file")
+    options = parser.parse_args(args)
+
+    random.seed(options.seed)
+
+    server = None
+    port, server_pid = options.port, options.server_pid
+    if port is None:
+        server = RelayServer(options.host)
+        server.start([])
+        port, server_pid = server.port, server.process.pid
+
+    try:
+        report = run_load(options.host, port, options.sessions, options.concurrency, options.parties,
+                          options.mix, options.rate, server_pid)
+    finally:
+        if server is not None:
+            server.stop()
+
+    print(json.dumps(report, indent=2, sort_keys=True))
+    if options.output:
+        with open(options.output, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+    return 1 if report['failures'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+Peer-to-peer transport: the participants exchange their messages over a full mesh of
+persistent TCP connections instead of going through the relay in `server.py`.
+
+Every participant listens on its own address from `addresses` and opens one outgoing
+connection to each peer (so each pair of participants is connected by two sockets, one per
+direction). Records are framed with a length prefix. The trusted server is only contacted
+for the Beaver triplets.
+"""
+
+import socket
+import threading
+import time
+from multiprocessing import Process, Queue
+from typing import Dict, List, Tuple, Union
+
+from communication import (
+    Communication,
+    decode_record,
+    encode_record,
+    recv_frame,
+    send_frame,
+)
+from harness import free_port, wait_for_port
+from server import run
+from smc_party import SMCParty
+
+# Imports for benchmarking
+import timeit
+
+
+# Record kinds
+HELLO = 0
+PRIVATE = 1
+PUBLIC = 2
+
+
+def allocate_addresses(participant_ids: List[str], host: str = "localhost") -> Dict[str, Tuple[str, int]]:
+    """
+    Pick a free port on host for every participant.
+    """
+    return {participant_id: (host, free_port(host)) for participant_id in participant_ids}
+
+
+class MeshCommunication(Communication):
+    """
+    Drop-in replacement for `Communication` sending messages directly to the peers.
+
+    Attributes:
+        server_host: hostname of the server (only used for the Beaver triplets)
+        server_port: port of the server (only used for the Beaver triplets)
+        client_id: Identifier of this client
+        addresses: (host, port) each participant listens on, including this client
+        connect_timeout: how long to keep retrying to connect to a peer that is not listening yet
+    """
+
+    def __init__(
+            self,
+            server_host: str,
+            server_port: int,
+            client_id: str,
+            addresses: Dict[str, Tuple[str, int]],
+            poll_delay: float = 0.2,
+            connect_timeout: float = 10.0
+    ):
+        super().__init__(server_host, server_port, client_id, poll_delay)
+        self.addresses = addresses
+        self.connect_timeout = connect_timeout
+
+        # messages received from the peers, guarded by a condition notified on every arrival
+        self.private_messages: Dict[str, bytes] = dict()
+        self.public_messages: Dict[Tuple[str, str], bytes] = dict()
+        self.messages_arrived = threading.Condition()
+
+        # outgoing connections, opened on first use
+        self.connections: Dict[str, socket.socket] = dict()
+        self.connection_locks = {peer_id: threading.Lock() for peer_id in addresses}
+
+        self.listener = socket.create_server(addresses[client_id])
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                # listener closed
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._read_loop, args=(sock,), daemon=True).start()
+
+    def _read_loop(self, sock: socket.socket) -> None:
+        with sock:
+            hello = recv_frame(sock)
+            if hello is None:
+                return
+            _, peer_id, _, _ = decode_record(hello)
+
+            while True:
+                record = recv_frame(sock)
+                if record is None:
+                    return
+                kind, _, label, body = decode_record(record)
+                with self.messages_arrived:
+                    if kind == PRIVATE:
+                        self.private_messages[label] = body
+                    elif kind == PUBLIC:
+                        self.public_messages[(peer_id, label)] = body
+                    self.messages_arrived.notify_all()
+
+    def _connection(self, peer_id: str) -> socket.socket:
+        """
+        Persistent connection to peer_id, retrying while the peer is not listening yet.
+        """
+        if peer_id not in self.connections:
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    sock = socket.create_connection(self.addresses[peer_id])
+                    break
+                except ConnectionRefusedError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.01)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(sock, encode_record(HELLO, self.client_id, "", b""))
+            self.connections[peer_id] = sock
+        return self.connections[peer_id]
+
+    def _send(self, peer_id: str, kind: int, label: str, message: bytes) -> None:
+        with self.connection_locks[peer_id]:
+            send_frame(self._connection(peer_id), encode_record(kind, self.client_id, label, message))
+
+    def _wait_for(self, messages: dict, key) -> bytes:
+        with self.messages_arrived:
+            while not self.messages_arrived.wait_for(lambda: key in messages, self.poll_delay):
+                if self.stopped.is_set():
+                    raise ConnectionAbortedError(f"Communication of client {self.client_id} stopped")
+            return messages[key]
+
+    def send_private_message(
+        self,
+        receiver_id: str,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Send a private message directly to receiver_id.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_send_private_msg = timeit.default_timer()
+
+        self._send(receiver_id, PRIVATE, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_send_private_msg)
+
+    def retrieve_private_message(
+        self,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a private message, waiting until a peer sent it.
+        """
+        starttime_retrieve_private_msg = timeit.default_timer()
+
+        message = self._wait_for(self.private_messages, label)
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_private_msg)
+
+        return message
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        """
+        Retrieve several private messages. Retrieval waits until the message arrives, so retrieving
+        them one after the other waits only as long as the last one takes to arrive.
+        """
+        return {label: self.retrieve_private_message(label) for label in labels}
+
+    def publish_message(
+        self,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Publish a message by sending it to every peer.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_publish_msg = timeit.default_timer()
+
+        with self.messages_arrived:
+            self.public_messages[(self.client_id, label)] = message
+        for peer_id in self.addresses:
+            if peer_id != self.client_id:
+                self._send(peer_id, PUBLIC, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_publish_msg)
+
+    def retrieve_public_message(
+        self,
+        sender_id: str,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a public message, waiting until sender_id published it.
+        """
+        starttime_retrieve_public_msg = timeit.default_timer()
+
+        message = self._wait_for(self.public_messages, (sender_id, label))
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_public_msg)
+
+        return message
+
+    def close(self) -> None:
+        """
+        Close the listener and the outgoing connections.
+        """
+        self.listener.close()
+        for sock in self.connections.values():
+            sock.close()
+
+
+def smc_client(client_id, prot, value_dict, server_port, addresses, queue, instrumented=False):
+    comm = MeshCommunication("localhost", server_port, client_id, addresses)
+    cli = SMCParty(
+        client_id,
+        "localhost",
+        server_port,
+        protocol_spec=prot,
+        value_dict=value_dict,
+        comm=comm
+    )
+    res = cli.run_instrumented() if instrumented else cli.run()
+    comm.close()
+    queue.put(res)
+    print(f"{client_id} has finished!")
+
+
+def smc_server(args, server_port):
+    run("localhost", server_port, args)
+
+
+def run_processes(server_args, *client_args, instrumented: bool = False):
+    """
+    Counterpart of `harness.run_processes` with the parties connected in a mesh.
+
+    server_args is the list of participant IDs, each of client_args is (client_id, prot, value_dict).
+    The server (for the Beaver triplets) and the parties listen on free localhost ports.
+    """
+    addresses = allocate_addresses(server_args)
+    server_port = free_port()
+    queue = Queue()
+
+    server = Process(target=smc_server, args=(server_args, server_port))
+    clients = [Process(target=smc_client, args=(*args, server_port, addresses, queue, instrumented))
+               for args in client_args]
+
+    server.start()
+    wait_for_port("localhost", server_port)
+    for client in clients:
+        client.start()
+
+    # Empty the queue before joining: a child does not exit while its result is unread.
+    results = [queue.get() for _ in clients]
+
+    for client in clients:
+        client.join()
+
+    server.terminate()
+    server.join()
+
+    return results
@@ -0,0 +1,264 @@
+"""
+Offline micro-benchmarks for the arithmetic and evaluator hot paths.
+
+No server and no network: the `Share` operations, `share_secret`, `reconstruct_secret`,
+`scalars_only`, `SMCParty.process_expression` and the dataflow `SMCParty.evaluate` are timed
+directly, the latter three on synthetic circuits of parameterized size, depth and multiplication
+ratio (evaluated by a single party, with the Beaver triplets coming from a local
+`TrustedParamGenerator`).
+
+For every benchmark the report contains the operations per second (best of several
+repetitions) and the memory allocated while running one batch, as traced by tracemalloc.
+The JSON output has a stable layout (sorted keys) so that it can be saved as a baseline
+and compared with a later run:
+
+    python microbenchmarks.py --output baseline.json
+    python microbenchmarks.py --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from communication import Communication
+from expression import AddOp, Expression, MultOp, Scalar, Secret, SubOp
+from protocol import ProtocolSpec
+from secret_sharing import Share, get_prime, reconstruct_secret, share_secret
+from smc_party import SMCParty, scalars_only
+from ttp import TrustedParamGenerator
+
+
+# Version of the JSON layout
+FORMAT_VERSION = 1
+
+# Circuits of the default run: (size, depth, multiplication ratio)
+DEFAULT_CIRCUITS = [
+    (10, 4, 0.0),
+    (10, 4, 0.5),
+    (100, 8, 0.0),
+    (100, 8, 0.5),
+    (100, 100, 0.5),
+    (1000, 16, 0.0),
+    (1000, 16, 0.5),
+]
+
+
+class LoopbackCommunication(Communication):
+    """
+    Transport of a party computing alone: published messages are kept in memory and
+    the Beaver triplets come from a local trusted parameter generator.
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.poll_delay = 0
+        self.messages: Dict[Tuple[str, str], bytes] = dict()
+        self.ttp = TrustedParamGenerator()
+        self.ttp.add_participant(client_id)
+        self._init_metrics()
+
+    def send_private_message(self, receiver_id: str, label: str, message: Union[bytes, str]) -> None:
+        self.messages[(receiver_id, label)] = message
+
+    def retrieve_private_message(self, label: str) -> bytes:
+        return self.messages[(self.client_id, label)]
+
+    def retrieve_private_messages(self, labels: List[str]) -> Dict[str, bytes]:
+        return {label: self.retrieve_private_message(label) for label in labels}
+
+    def publish_message(self, label: str, message: Union[bytes, str]) -> None:
+        self.messages[(self.client_id, label)] = message
+
+    def retrieve_public_message(self, sender_id: str, label: str) -> bytes:
+        return self.messages[(sender_id, label)]
+
+    def retrieve_beaver_triplet_shares(self, op_id: str) -> Tuple[int, int, int]:
+        return tuple(share.bn for share in self.ttp.retrieve_share(self.client_id, op_id))  # type: ignore
+
+
+def synthetic_circuit(
+    size: int,
+    depth: int,
+    mult_ratio: float,
+    num_secrets: int = 3,
+    seed: int = 0
+) -> Tuple[Expression, Dict[Secret, int], int]:
+    """
+    A random expression tree with `size` operations, `depth` levels of operations along its
+    leftmost path and a fraction `mult_ratio` of multiplications (the others are additions and
+    subtractions). The leaves are drawn from num_secrets secrets (80 %) and scalars.
+
+    Returns the expression, the values of the secrets and the expected result.
+    """
+    rng = random.Random(seed)
+    prime = get_prime()
+
+    secrets = [Secret() for _ in range(num_secrets)]
+    values = {secret: rng.randrange(prime) for secret in secrets}
+
+    def leaf() -> Tuple[Expression, int]:
+        if rng.random() < 0.8:
+            secret = rng.choice(secrets)
+            return secret, values[secret]
+        value = rng.randrange(prime)
+        return Scalar(value), value
+
+    def build(size: int, depth: int) -> Tuple[Expression, int]:
+        if size == 0:
+            return leaf()
+
+        # The left subtree keeps the required depth, the remaining operations are split evenly.
+        depth = max(1, min(depth, size))
+        left_size = max(depth - 1, (size - 1) // 2)
+        left, left_value = build(left_size, depth - 1)
+        right, right_value = build(size - 1 - left_size, depth - 1)
+
+        if rng.random() < mult_ratio:
+            return MultOp(left, right), left_value * right_value % prime
+        if rng.random() < 0.5:
+            return AddOp(left, right), (left_value + right_value) % prime
+        return SubOp(left, right), (left_value - right_value) % prime
+
+    expr, expected = build(size, depth)
+    return expr, values, expected
+
+
+def measure(function: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    """
+    Operations per second of function (best of repeat batches), and the memory allocated
+    during one batch: peak traced bytes and the number of blocks still allocated afterwards.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(number):
+        function()
+    blocks_after = sys.getallocatedblocks()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': number / best,
+        'peak_alloc_bytes_per_batch': peak,
+        'retained_blocks_per_op': (blocks_after - blocks_before) / number,
+        'batch_size': number,
+    }
+
+
+def primitive_benchmarks(num_parties: int = 3) -> Dict[str, Callable[[], object]]:
+    prime = get_prime()
+    x = Share(random.randrange(prime))
+    y = Share(random.randrange(prime))
+    shares = share_secret(random.randrange(prime), num_parties)
+
+    return {
+        'Share.__add__': lambda: x + y,
+        'Share.__sub__': lambda: x - y,
+        'Share.__mul__': lambda: x * y,
+        f'share_secret[n={num_parties}]': lambda: share_secret(12345, num_parties),
+        f'reconstruct_secret[n={num_parties}]': lambda: reconstruct_secret(shares),
+    }
+
+
+def circuit_benchmarks(circuits: List[Tuple[int, int, float]]) -> Dict[str, Callable[[], object]]:
+    benchmarks = dict()
+
+    for size, depth, mult_ratio in circuits:
+        expr, values, expected = synthetic_circuit(size, depth, mult_ratio)
+        party = SMCParty("bench", "localhost", 0, ProtocolSpec(["bench"], expr), values,
+                         comm=LoopbackCommunication("bench"))
+        party.peer_ids = []
+        party.shares_dict = {secret: Share(value) for secret, value in values.items()}
+
+        # Sanity check: a single party holds the whole secret
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            assert party.process_expression(expr).bn == expected
+            assert party.evaluate(expr).bn == expected
+
+        name = f'[size={size},depth={depth},mult={mult_ratio}]'
+        benchmarks['scalars_only' + name] = lambda expr=expr: scalars_only(expr)
+        benchmarks['process_expression' + name] = lambda party=party, expr=expr: party.process_expression(expr)
+        benchmarks['evaluate' + name] = lambda party=party, expr=expr: party.evaluate(expr)
+
+    return benchmarks
+
+
+def run_benchmarks(circuits: List[Tuple[int, int, float]], repeat: int = 5) -> Dict[str, object]:
+    """
+    Run all benchmarks; the output of the code under test is discarded.
+    """
+    benchmarks = primitive_benchmarks()
+    benchmarks.update(circuit_benchmarks(circuits))
+
+    results = dict()
+    for name, function in benchmarks.items():
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = measure(function, repeat)
+        print(f"{name:60} {results[name]['ops_per_sec']:14.1f} ops/sec")
+
+    return {
+        'format_version': FORMAT_VERSION,
+        'machine': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(report: Dict[str, object], baseline: Dict[str, object], threshold: float = 0.1) -> List[str]:
+    """
+    Names of the benchmarks whose ops/sec dropped by more than threshold against baseline.
+    """
+    regressions = []
+    for name, result in sorted(report['benchmarks'].items()):
+        if name not in baseline['benchmarks']:
+            continue
+        ratio = result['ops_per_sec'] / baseline['benchmarks'][name]['ops_per_sec']
+        flag = "REGRESSION" if ratio < 1 - threshold else ""
+        print(f"{name:60} {ratio:6.2f}x {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--baseline", help="compare against this JSON report")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative ops/sec drop flagged as a regression (default: 0.1)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed batches per benchmark (default: 5)")
+    parser.add_argument("--quick", action="store_true", help="only the small circuits")
+    options = parser.parse_args(args)
+
+    circuits = [circuit for circuit in DEFAULT_CIRCUITS if circuit[0] <= 100] if options.quick else DEFAULT_CIRCUITS
+    report = run_benchmarks(circuits, options.repeat)
+
+    if options.output:
+        with open(options.output, 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if compare(report, baseline, options.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
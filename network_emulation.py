@@ -0,0 +1,198 @@
+"""
+Network emulation for realistic latency/bandwidth benchmarks.
+
+The parties talk to each other through the relay, so the network is modelled as a star:
+every party has an access link to the relay with a one-way latency, a jitter and a
+bandwidth. `EmulatedCommunication` wraps any transport and delays each call by what it
+would cost on the party's link:
+
+* sending (private or public message): the message travels to the relay (latency plus
+  transmission time), then the acknowledgement travels back (latency);
+* retrieving (private or public message, Beaver triplet): the request travels to the relay
+  (latency), then the message travels back (latency plus transmission time);
+* retrieving several private messages at once: the requests travel to the relay together
+  (latency), then the messages travel back together (latency plus their transmission time).
+
+The link is shared by the calls of all threads of the party (e.g. the input shares sent in the
+background and the Beaver multiplications of the dataflow evaluation): a message is transmitted
+once the messages before it in the same direction are, so the concurrent calls share the
+bandwidth instead of each getting all of it.
+
+The delays are added to the transport's `time_spent_sending`/`time_spent_retrieving` (of the
+calling thread, through `Communication.add_wait`), so the computation time metrics of `SMCParty.run_instrumented` stay corrected
+for them.
+
+Example (a party in another data center, 40 ms away, on a 10 Mbit/s link):
+>>> wan = NetworkEmulation(links={"Bob": LinkConditions(latency=0.04, jitter=0.005, bandwidth=1.25e6)})
+>>> comm = wan.wrap(Communication("localhost", 5000, "Bob"))
+"""
+
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from communication import Communication
+
+
+class LinkConditions:
+    """
+    Conditions of the link between a party and the relay.
+
+    Attributes:
+        latency: one-way latency in seconds
+        jitter: maximum deviation from the latency in seconds (uniformly distributed)
+        bandwidth: bytes per second, None for unlimited
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, bandwidth: Optional[float] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(latency={self.latency}, jitter={self.jitter}, bandwidth={self.bandwidth})"
+
+    def propagation_delay(self) -> float:
+        """
+        One-way latency including jitter.
+        """
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def transmission_delay(self, num_bytes: int) -> float:
+        """
+        Time to push num_bytes through the link.
+        """
+        if self.bandwidth is None:
+            return 0.0
+        return num_bytes / self.bandwidth
+
+
+class NetworkEmulation:
+    """
+    Link conditions of all parties of a run.
+
+    Attributes:
+        default: conditions of the parties without an entry in links
+        links: conditions per party ID
+    """
+
+    def __init__(self, default: Optional[LinkConditions] = None, links: Optional[Dict[str, LinkConditions]] = None):
+        self.default = default if default is not None else LinkConditions()
+        self.links = links if links is not None else dict()
+
+    def link(self, client_id: str) -> LinkConditions:
+        return self.links.get(client_id, self.default)
+
+    def wrap(self, comm: Communication) -> "EmulatedCommunication":
+        """
+        Emulate the link of comm.client_id on top of comm.
+        """
+        return EmulatedCommunication(comm, self.link(comm.client_id))
+
+
+class EmulatedCommunication:
+    """
+    Transport wrapper delaying every call according to the conditions of the party's link.
+
+    Everything that is not a transport call (client_id, the metrics, ...) is read from the
+    wrapped transport.
+
+    Attributes:
+        comm: the wrapped transport
+        link: conditions of the link between this party and the relay
+        busy_until: per direction ("up" to the relay, "down" from it), when the link has transmitted
+            the messages on it (time.monotonic)
+    """
+
+    def __init__(self, comm: Communication, link: LinkConditions):
+        self.comm = comm
+        self.link = link
+        self.busy_until = {"up": 0.0, "down": 0.0}
+        self.link_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.comm, name)
+
+    def add_wait(self, kind: str, seconds: float) -> None:
+        self.comm.add_wait(kind, seconds)
+
+    def transmission_delay(self, direction: str, num_bytes: int) -> float:
+        """
+        Time until num_bytes are through the link in direction, after the messages already on it.
+        """
+        duration = self.link.transmission_delay(num_bytes)
+        if duration == 0.0:
+            return 0.0
+        with self.link_lock:
+            now = time.monotonic()
+            self.busy_until[direction] = max(now, self.busy_until[direction]) + duration
+            return self.busy_until[direction] - now
+
+    def _delay_sending(self, delay: float) -> None:
+        time.sleep(delay)
+        self.comm.add_wait("sending", delay)
+
+    def _delay_retrieving(self, delay: float) -> None:
+        time.sleep(delay)
+        self.comm.add_wait("retrieving", delay)
+
+    def send_private_message(
+        self,
+        receiver_id: str,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        self._delay_sending(self.link.propagation_delay() + self.transmission_delay("up", len(message)))
+        self.comm.send_private_message(receiver_id, label, message)
+        self._delay_sending(self.link.propagation_delay())
+
+    def retrieve_private_message(
+        self,
+        label: str
+    ) -> bytes:
+        self._delay_retrieving(self.link.propagation_delay())
+        message = self.comm.retrieve_private_message(label)
+        self._delay_retrieving(self.link.propagation_delay() + self.transmission_delay("down", len(message)))
+        return message
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        # the requests go out together, the messages come back one after the other
+        self._delay_retrieving(self.link.propagation_delay())
+        messages = self.comm.retrieve_private_messages(labels)
+        self._delay_retrieving(self.link.propagation_delay() +
+                               self.transmission_delay("down", sum(len(message) for message in messages.values())))
+        return messages
+
+    def publish_message(
+        self,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        self._delay_sending(self.link.propagation_delay() + self.transmission_delay("up", len(message)))
+        self.comm.publish_message(label, message)
+        self._delay_sending(self.link.propagation_delay())
+
+    def retrieve_public_message(
+        self,
+        sender_id: str,
+        label: str
+    ) -> bytes:
+        self._delay_retrieving(self.link.propagation_delay())
+        message = self.comm.retrieve_public_message(sender_id, label)
+        self._delay_retrieving(self.link.propagation_delay() + self.transmission_delay("down", len(message)))
+        return message
+
+    def retrieve_beaver_triplet_shares(
+        self,
+        op_id: str
+    ) -> Tuple[int, int, int]:
+        self._delay_retrieving(self.link.propagation_delay())
+        bytes_received = self.comm.bytes_received_smc_party
+        triplet = self.comm.retrieve_beaver_triplet_shares(op_id)
+        num_bytes = self.comm.bytes_received_smc_party - bytes_received
+        self._delay_retrieving(self.link.propagation_delay() + self.transmission_delay("down", num_bytes))
+        return triplet
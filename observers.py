@@ -0,0 +1,290 @@
+"""
+Instrumentation hooks of `SMCParty`.
+
+An observer attached to a party is notified when the run starts and finishes (or fails), when each
+phase of the protocol starts and finishes and when the evaluation of each gate starts and
+finishes. A party without observers skips the notifications altogether, so production runs
+pay nothing for the instrumentation.
+
+Phases (nested phases in brackets):
+* "input sharing" ["secret sharing" for every own secret]: sharing the own secrets and handing
+  the shares to the peers over to the background threads sending them (see `SMCParty.run`);
+* "evaluation" ["Beaver round" for every multiplication of two secret operands];
+* "result exchange": publishing the own result share and, for an output party (see
+  `ProtocolSpec.output_ids`), retrieving those of the peers;
+* "reconstruction": reconstructing the result from the shares (output parties only).
+
+With the dataflow scheduler of `SMCParty.evaluate`, the Beaver rounds (and gates) of independent
+multiplications are outstanding at the same time and finish in any order: they overlap instead of
+nesting. Their notifications carry a key (the position of the gate in the expression, the same
+for the gate and its round) that pairs the start of each with its end; the phases and gates that
+nest have the key None. All notifications come on the party's thread.
+
+`MetricsObserver` computes the metrics returned by `SMCParty.run_instrumented`, `MemoryObserver`
+adds the memory use per phase to them on demand; `tracing.Tracer` records the phases and gates as
+spans.
+"""
+
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+from statistics import mean
+from typing import Any, Dict, Hashable, List, Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+from expression import Expression
+
+
+class Observer:
+    """
+    Base class of the observers; every hook does nothing.
+    """
+
+    def run_started(self, party: "SMCParty") -> None:
+        pass
+
+    def run_finished(self, party: "SMCParty") -> None:
+        pass
+
+    def run_failed(self, party: "SMCParty", error: BaseException) -> None:
+        """
+        The run raised error: instead of run_finished, e.g. to stop what run_started started.
+        """
+        pass
+
+    def phase_started(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        pass
+
+    def phase_finished(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        pass
+
+    def gate_started(self, party: "SMCParty", expr: Expression, key: Optional[Hashable] = None) -> None:
+        pass
+
+    def gate_finished(self, party: "SMCParty", expr: Expression, key: Optional[Hashable] = None) -> None:
+        pass
+
+
+class MetricsObserver(Observer):
+    """
+    Computation and communication cost of a run.
+
+    The computation times are corrected for the time the transport spent sending and
+    retrieving messages (`Communication.time_spent_sending`/`time_spent_retrieving`) and bounded
+    by the CPU time of the party's thread, which does not count the time it waited for the threads
+    of the dataflow evaluation to release the interpreter lock. They include the time these threads
+    spent computing the Beaver multiplications (`SMCParty.worker_compute_time`).
+
+    Attributes:
+        metrics: the metrics, complete once the run has finished
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = dict()
+        self.starttimes: Dict[str, float] = dict()
+        self.computation_cost_sharing = []
+
+    def run_started(self, party: "SMCParty") -> None:
+        self.starttime_overall = timeit.default_timer()
+        self.cpu_starttime_overall = time.thread_time()
+        self.worker_compute_time_overall = party.worker_compute_time
+
+    def phase_started(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        if phase == "Beaver round":
+            return
+        if phase == "evaluation":
+            # the evaluation time is corrected for the messages sent and retrieved meanwhile
+            self.time_spent_sending = party.comm.time_spent_sending
+            self.time_spent_retrieving = party.comm.time_spent_retrieving
+            self.worker_compute_time = party.worker_compute_time
+            self.cpu_starttime = time.thread_time()
+        self.starttimes[phase] = timeit.default_timer()
+
+    def phase_finished(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        if phase == "Beaver round":
+            return
+
+        time_taken = timeit.default_timer() - self.starttimes[phase]
+
+        # (1) average time for sharing each of this party's secrets
+        if phase == "secret sharing":
+            self.computation_cost_sharing.append(time_taken)
+
+        # (2) time for processing the expression
+        elif phase == "evaluation":
+            time_spent_waiting = (party.comm.time_spent_sending - self.time_spent_sending) + \
+                (party.comm.time_spent_retrieving - self.time_spent_retrieving)
+            # the party waits for the Beaver multiplications of the dataflow evaluation while its
+            # threads compute them: their computing time is added back
+            self.metrics['comp_time_processing'] = \
+                min(time_taken - time_spent_waiting, time.thread_time() - self.cpu_starttime) + \
+                (party.worker_compute_time - self.worker_compute_time)
+
+        # (3) time for reconstructing the result
+        elif phase == "reconstruction":
+            self.metrics['comp_time_reconstruction'] = time_taken
+
+    def run_finished(self, party: "SMCParty") -> None:
+        time_taken_overall = timeit.default_timer() - self.starttime_overall
+
+        # a party whose secrets the expression does not use shares nothing
+        self.metrics['comp_time_sharing'] = mean(self.computation_cost_sharing) if self.computation_cost_sharing else 0
+
+        # a party that is not an output party reconstructs nothing
+        self.metrics.setdefault('comp_time_reconstruction', 0)
+
+        # (4) total time for the run, corrected for the time spent sending and receiving messages
+        self.metrics['runtime_overall'] = \
+            min(time_taken_overall - (party.comm.time_spent_sending + party.comm.time_spent_retrieving),
+                time.thread_time() - self.cpu_starttime_overall) + \
+            (party.worker_compute_time - self.worker_compute_time_overall)
+
+        # (5) wall-clock time including the time spent waiting for the network
+        self.metrics['runtime_wall_clock'] = time_taken_overall
+
+        # communication cost, as counted by the transport
+        self.metrics['bytes_sent_smc_party'] = party.comm.bytes_sent_smc_party
+        self.metrics['bytes_received_smc_party'] = party.comm.bytes_received_smc_party
+        self.metrics['bytes_sent_ttp'] = party.comm.bytes_sent_ttp
+        self.metrics['comp_cost_ttp'] = party.comm.comp_cost_ttp
+
+        # exact accounting of server.py (see Communication.account)
+        self.metrics['wire_bytes_sent_smc_party'] = party.comm.wire_bytes_sent
+        self.metrics['wire_bytes_received_smc_party'] = party.comm.wire_bytes_received
+        self.metrics['server_time'] = party.comm.server_time
+        self.metrics['ttp_time'] = party.comm.ttp_time
+
+        # Communication rounds: distributing the input shares, those of the evaluation (one per
+        # Beaver multiplication, or per level of them with the dataflow evaluation), exchanging the results
+        self.metrics['rounds'] = party.evaluation_rounds() + 2
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident set size of this process in bytes, None where the platform does not tell.
+    """
+    if resource is None:
+        return None
+    # kilobytes on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def expression_size(expr: Expression) -> int:
+    """
+    Bytes taken by the nodes of an expression tree (objects and their attributes, shared nodes once).
+    """
+    seen = set()
+    size = 0
+    stack = [expr]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        size += sys.getsizeof(node) + sys.getsizeof(vars(node))
+        size += sum(sys.getsizeof(value) for value in vars(node).values() if not isinstance(value, Expression))
+        stack.extend(value for value in vars(node).values() if isinstance(value, Expression))
+    return size
+
+
+# The memory observers of the runs in progress in this process (e.g. of parties running as threads)
+# share tracemalloc, under this lock
+tracing_lock = threading.Lock()
+tracing_observers: List["MemoryObserver"] = []
+started_tracing = False  # whether they started tracemalloc (rather than whoever else uses it)
+
+
+class MemoryObserver(Observer):
+    """
+    Memory allocated by a party, per phase (with tracemalloc, which slows the run down: the
+    computation times of the same run are not representative).
+
+    Metrics, in bytes:
+    * memory_peak_<phase>: most memory allocated during the phase on top of what was allocated
+      when it started (the largest over the repetitions of a nested phase; overlapping Beaver
+      rounds count each other's allocations);
+    * memory_retained_<phase>: memory allocated during the phase and still allocated at its end
+      (summed over the repetitions of a nested phase), e.g. the shares kept by the input sharing;
+    * memory_peak_overall, memory_retained_overall: the same for the whole run;
+    * memory_expression: size of the expression tree;
+    * memory_rss_peak: peak resident set size of the process (where the platform tells it).
+
+    tracemalloc and the resident set size cover the whole process: parties running as threads
+    of one process count each other's allocations. The observers of these parties share the
+    tracing, which runs from the start of the first run to the end of the last one.
+
+    Attributes:
+        metrics: the metrics, complete once the run has finished
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = dict()
+        # the phases not finished yet: (name, key, memory allocated at the start, peak so far)
+        self.phases: List[List[Any]] = []
+
+    def update_peaks(self) -> int:
+        """
+        Fold the peak since the last call into the peaks of the open phases (of every memory observer
+        running, as the peak is reset for all of them), and return the memory allocated right now.
+        """
+        with tracing_lock:
+            current, peak = tracemalloc.get_traced_memory()
+            for observer in tracing_observers:
+                for phase in observer.phases:
+                    phase[3] = max(phase[3], peak)
+            tracemalloc.reset_peak()
+        return current
+
+    def run_started(self, party: "SMCParty") -> None:
+        global started_tracing
+        with tracing_lock:
+            if not tracing_observers and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracing_observers.append(self)
+        self.metrics['memory_expression'] = expression_size(party.protocol_spec.expr)
+        self.phase_started(party, "overall")
+
+    def phase_started(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        current = self.update_peaks()
+        self.phases.append([phase, key, current, current])
+
+    def phase_finished(self, party: "SMCParty", phase: str, key: Optional[Hashable] = None) -> None:
+        current = self.update_peaks()
+        # the latest phase of this name and key: the overlapping ones do not finish in order
+        position = max(i for i, entry in enumerate(self.phases) if entry[:2] == [phase, key])
+        _, _, start, peak = self.phases.pop(position)
+        metric = phase.replace(" ", "_")
+        self.metrics[f'memory_peak_{metric}'] = max(self.metrics.get(f'memory_peak_{metric}', 0), peak - start)
+        self.metrics[f'memory_retained_{metric}'] = self.metrics.get(f'memory_retained_{metric}', 0) + current - start
+
+    def stop_tracing(self) -> None:
+        """
+        Leave the observers sharing the tracing, stopping it if this is the last one.
+        """
+        global started_tracing
+        with tracing_lock:
+            if self in tracing_observers:  # (not after a failure of run_finished)
+                tracing_observers.remove(self)
+            # the last run of the process stops the tracing, if a memory observer started it
+            if not tracing_observers and started_tracing:
+                tracemalloc.stop()
+                started_tracing = False
+
+    def run_finished(self, party: "SMCParty") -> None:
+        self.phase_finished(party, "overall")
+        self.stop_tracing()
+        if peak_rss() is not None:
+            self.metrics['memory_rss_peak'] = peak_rss()
+
+    def run_failed(self, party: "SMCParty", error: BaseException) -> None:
+        # the metrics of the phases that did finish are kept
+        self.phases.clear()
+        self.stop_tracing()
@@ -0,0 +1,224 @@
+"""
+Sampling CPU profiler of the parties and the server, with flame-graph output.
+
+A `StackSampler` looks at the stack of one thread every `interval` seconds from a background
+thread and charges the CPU time the thread used since the previous sample to the stack it sees
+(so the time spent polling the server asleep does not count), prefixed with what the thread
+is doing: for a party
+(a `Profiler`, attached as an observer) its client ID and the current phase of the protocol (see
+observers.py), for the server its route (through the `/profile` route of server.py). The
+background threads of a party (input sharing, Beaver multiplications of the dataflow evaluation)
+are sampled too, under the same prefix. The counts
+of all participants are merged into one file of collapsed stacks (one "frame;frame;... microseconds"
+line per stack, the input of flamegraph.pl, speedscope or inferno) and into an SVG flame graph.
+Where the CPU time of a thread cannot be read, every sample counts as one.
+
+Sampling only sees the Python frames, and the sampler competes for the interpreter lock with
+the sampled thread, so the run gets a little slower; the proportions are what counts.
+
+Example:
+>>> profiler = Profiler("Alice")
+>>> party = SMCParty("Alice", "localhost", 5000, protocol_spec=prot, value_dict=values, observers=[profiler])
+>>> party.run()
+>>> write_profile("profile", [profiler.stacks])  # profile.collapsed and profile.svg
+"""
+
+import collections
+import html
+import os
+import sys
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from observers import Observer
+
+
+# Seconds between two samples
+DEFAULT_INTERVAL = 0.001
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_cpu_time(thread_id: int) -> Callable[[], Optional[int]]:
+    """
+    A function reading the CPU time (microseconds) used so far by a thread, returning None if the
+    platform cannot tell.
+    """
+    try:
+        clock = time.pthread_getcpuclockid(thread_id)
+    except (AttributeError, OSError):
+        return lambda: None
+    return lambda: time.clock_gettime_ns(clock) // 1000
+
+
+class StackSampler:
+    """
+    CPU time of a thread per stack, sampled every interval seconds while running.
+
+    Attributes:
+        thread_id: the sampled thread (threading.get_ident())
+        prefix: called at every sample: the frames to put in front of the stack (e.g. participant
+            and phase), or None to skip the sample
+        workers: called at every sample: more threads to sample with the same prefix, e.g. the
+            background threads of a party (optional)
+        stacks: CPU microseconds (or number of samples) per collapsed stack
+    """
+
+    def __init__(self, thread_id: int, prefix: Callable[[], Optional[List[str]]], interval: float = DEFAULT_INTERVAL,
+                 workers: Optional[Callable[[], Iterable[int]]] = None):
+        self.thread_id = thread_id
+        self.prefix = prefix
+        self.interval = interval
+        self.workers = workers
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def sample(self) -> None:
+        # per thread: its CPU clock and the CPU time it had used at the previous sample (a worker
+        # started after the sampler has used none before)
+        clocks = {self.thread_id: thread_cpu_time(self.thread_id)}
+        previous = {self.thread_id: clocks[self.thread_id]()}
+        while not self.stopped.wait(self.interval):
+            prefix = self.prefix()
+            frames_by_thread = sys._current_frames()
+            thread_ids = [self.thread_id] + (list(self.workers()) if self.workers is not None else [])
+            for thread_id in thread_ids:
+                if thread_id not in clocks:
+                    clocks[thread_id] = thread_cpu_time(thread_id)
+                    previous[thread_id] = 0
+                try:
+                    current = clocks[thread_id]()
+                except OSError:  # the thread has finished meanwhile
+                    del clocks[thread_id]
+                    continue
+                # a new thread may reuse the identifier of a finished one, with a new clock
+                weight = current - min(previous[thread_id], current) if current is not None else 1
+                previous[thread_id] = current
+                frame = frames_by_thread.get(thread_id)
+                if prefix is None or frame is None or weight == 0:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(prefix + frames[::-1])] += weight
+
+
+class Profiler(Observer):
+    """
+    Profile of a party: its stacks while it runs, under "<client ID>;<phase>;<nested phase>".
+
+    Attributes:
+        name: the participant (client ID)
+        stacks: CPU time per collapsed stack (see `StackSampler`), complete once the run has finished
+    """
+
+    def __init__(self, name: str, interval: float = DEFAULT_INTERVAL):
+        self.name = name
+        self.interval = interval
+        self.phases: List[Tuple[str, Optional[Hashable]]] = []  # (phase, key) not finished yet
+        self.stacks: Dict[str, int] = dict()
+
+    def prefix(self) -> List[str]:
+        # overlapping Beaver rounds (see SMCParty.evaluate) count once
+        return [self.name] + list(dict.fromkeys(phase for phase, _ in self.phases))
+
+    def run_started(self, party) -> None:
+        # the background threads of the party too: the Beaver multiplications run there
+        self.sampler = StackSampler(threading.get_ident(), self.prefix, self.interval, party.threads)
+        self.sampler.start()
+
+    def run_finished(self, party) -> None:
+        self.sampler.stop()
+        self.stacks = dict(self.sampler.stacks)
+
+    def run_failed(self, party, error: BaseException) -> None:
+        # the stacks sampled until the failure
+        self.run_finished(party)
+        self.phases.clear()
+
+    def phase_started(self, party, phase: str, key: Optional[Hashable] = None) -> None:
+        self.phases.append((phase, key))
+
+    def phase_finished(self, party, phase: str, key: Optional[Hashable] = None) -> None:
+        # the overlapping Beaver rounds do not finish in order
+        del self.phases[max(i for i, entry in enumerate(self.phases) if entry == (phase, key))]
+
+
+def merge_stacks(profiles: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    """
+    The stacks of several participants (their stacks start with their name) in one profile.
+    """
+    merged: Dict[str, int] = collections.Counter()
+    for stacks in profiles:
+        merged.update(stacks)
+    return dict(merged)
+
+
+def write_collapsed(path: str, stacks: Dict[str, int]) -> None:
+    with open(path, 'w') as out:
+        for stack, count in sorted(stacks.items()):
+            out.write(f"{stack} {count}\n")
+
+
+def flame_graph_svg(stacks: Dict[str, int], width: int = 1200, frame_height: int = 16) -> str:
+    """
+    A flame graph of the collapsed stacks: the width of a frame is its share of the CPU time.
+    """
+    # prefix tree of the stacks: name -> [CPU time, children]
+    root: List = [0, dict()]
+    for stack, count in stacks.items():
+        node = root
+        node[0] += count
+        for name in stack.split(";"):
+            node = node[1].setdefault(name, [0, dict()])
+            node[0] += count
+
+    depth = max((stack.count(";") + 1 for stack in stacks), default=0)
+    height = (depth + 1) * frame_height
+    scale = width / root[0] if root[0] else 0
+    rects = []
+
+    def draw(children: Dict[str, List], x: float, level: int) -> None:
+        for name, (weight, grandchildren) in sorted(children.items()):
+            frame_width = weight * scale
+            if frame_width >= 0.5:
+                y = height - (level + 2) * frame_height
+                shade = zlib.crc32(name.encode("utf-8"))
+                color = 200 + shade % 55, 100 + shade % 120, 50
+                rects.append(
+                    f'<g><title>{html.escape(name)} ({100 * weight / root[0]:.1f}%)</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{frame_width:.1f}" height="{frame_height - 1}" '
+                    f'fill="rgb{color}"/>'
+                    f'<text x="{x + 2:.1f}" y="{y + frame_height - 4}" font-size="11" font-family="monospace">'
+                    f'{html.escape(name[:int(frame_width / 7)])}</text></g>')
+                draw(grandchildren, x, level + 1)
+            x += frame_width
+
+    draw(root[1], 0, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">\n'
+            + "\n".join(rects) + "\n</svg>\n")
+
+
+def write_profile(path: str, profiles: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    """
+    Merge the profiles, write them to path.collapsed and path.svg and return the merged stacks.
+    """
+    stacks = merge_stacks(profiles)
+    write_collapsed(f"{path}.collapsed", stacks)
+    with open(f"{path}.svg", 'w') as out:
+        out.write(flame_graph_svg(stacks))
+    return stacks
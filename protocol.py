@@ -1,3 +1,5 @@
+from typing import Optional
+
 from expression import Expression
 
 
@@ -7,8 +9,17 @@ class ProtocolSpec:
     Attributes:
         participant_ids: List of IDs of the participating clients
         expr: Expression to be computed
+        output_ids: List of IDs of the clients that reconstruct the result (default: all participants);
+            the others only publish their share of it
+        broadcast: Whether the first output client publishes the result for the others (default: False)
     """
 
-    def __init__(self, participant_ids: list, expr: Expression):
+    def __init__(self, participant_ids: list, expr: Expression, output_ids: Optional[list] = None,
+                 broadcast: bool = False):
         self.participant_ids = participant_ids
         self.expr = expr
+        self.output_ids = list(output_ids) if output_ids is not None else list(participant_ids)
+        self.broadcast = broadcast
+
+        if not self.output_ids or any(output_id not in participant_ids for output_id in self.output_ids):
+            raise ValueError(f"The output clients {self.output_ids} must be participants of the protocol")
@@ -0,0 +1,139 @@
+"""
+Throughput of the relay as a function of the number of `server.py` shards.
+
+A number of worker processes publish and retrieve messages as fast as they can through a
+`Communication` that spreads the channels over the shards by consistent hashing
+(see `Communication.relays`). The messages/sec should grow with the number of shards
+as long as there are cores left for them.
+
+`test_http_against_binary_relay` compares one `server.py` with one `binary_server.py` (through
+`BinaryCommunication`), both pinned to the same single core, and checks the speedup against
+`TARGET_SPEEDUP` (the exit status of the command line tells whether it was reached):
+
+    python relay_benchmark.py                  # shards
+    python relay_benchmark.py binary [workers] [messages]
+"""
+
+import contextlib
+import json
+import os
+import sys
+import timeit
+from multiprocessing import Process, Queue
+from typing import Dict, List, Optional, Set, Tuple
+
+from binary_server import run as run_binary_server
+from communication import BinaryCommunication, Communication
+from harness import free_port, run_pinned, usable_cpus, wait_for_port
+from server import run
+
+
+# Messages/sec of binary_server.py over those of server.py aimed at
+TARGET_SPEEDUP = 10.0
+
+
+def relay_worker(worker_id: int, relays: List[Tuple[str, int]], num_messages: int, queue, binary: bool = False) -> None:
+    """
+    Publish and retrieve num_messages messages, then report (messages, seconds, bytes sent, bytes received).
+    """
+    if binary:
+        comm = BinaryCommunication(relays[0][0], relays[0][1], f"worker{worker_id}")
+    else:
+        comm = Communication(relays[0][0], relays[0][1], f"worker{worker_id}", relays=relays)
+    message = b"x" * 64
+
+    # The client prints every request; keep that out of the measurement output.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        starttime = timeit.default_timer()
+        for i in range(num_messages):
+            comm.publish_message(f"msg-{i}", message)
+            comm.retrieve_public_message(comm.client_id, f"msg-{i}")
+        time_taken = timeit.default_timer() - starttime
+
+    queue.put((2 * num_messages, time_taken, comm.bytes_sent_smc_party, comm.bytes_received_smc_party))
+
+
+def measure_throughput(num_shards: int, num_workers: int, num_messages: int, binary: bool = False,
+                       cpus: Optional[Set[int]] = None) -> float:
+    """
+    Messages/sec through num_shards freshly started servers (binary: binary_server.py instead of
+    server.py, a single shard), pinned to cpus if given.
+    """
+    if binary and num_shards != 1:
+        raise ValueError("BinaryCommunication talks to a single relay")
+
+    relays = [("localhost", free_port()) for _ in range(num_shards)]
+    queue = Queue()
+
+    servers = [Process(target=run_pinned, args=(cpus, run_binary_server if binary else run, host, port, [])) for host, port in relays]
+    for server in servers:
+        server.start()
+    for host, port in relays:
+        wait_for_port(host, port)
+
+    workers = [Process(target=relay_worker, args=(i, relays, num_messages, queue, binary))
+               for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    results = [queue.get() for _ in workers]
+
+    for worker in workers:
+        worker.join()
+    for server in servers:
+        server.terminate()
+        server.join()
+
+    # The workers run concurrently: total messages over the time of the slowest one.
+    return sum(result[0] for result in results) / max(result[1] for result in results)
+
+
+def test_influence_of_number_of_shards(num_workers: int = 8, num_messages: int = 200) -> List[Dict[str, float]]:
+
+    results = []
+
+    for num_shards in [1, 2, 4, 8]:
+
+        throughput = measure_throughput(num_shards, num_workers, num_messages)
+
+        print(f"{num_shards} shard(s): {throughput:.0f} messages/sec")
+
+        results.append({'num_shards': num_shards, 'messages_per_sec': throughput})
+
+    # write result to json array
+    with open('num_shards_results.json', 'w') as out:
+        json.dump(results, out)
+
+    return results
+
+
+def test_http_against_binary_relay(num_workers: int = 4, num_messages: int = 500) -> Dict[str, float]:
+    """
+    Messages/sec through server.py and through binary_server.py, each on one core.
+    """
+    cpus = {usable_cpus()[0]}
+
+    http = measure_throughput(1, num_workers, num_messages, cpus=cpus)
+    binary = measure_throughput(1, num_workers, num_messages, binary=True, cpus=cpus)
+
+    speedup = binary / http
+
+    print(f"server.py: {http:.0f} messages/sec, binary_server.py: {binary:.0f} messages/sec "
+          f"({speedup:.1f}x, target {TARGET_SPEEDUP:.0f}x {'reached' if speedup >= TARGET_SPEEDUP else 'missed'})")
+
+    results = {'http_messages_per_sec': http, 'binary_messages_per_sec': binary, 'speedup': speedup,
+               'target_speedup': TARGET_SPEEDUP, 'target_reached': speedup >= TARGET_SPEEDUP}
+
+    # write result to json
+    with open('relay_comparison_results.json', 'w') as out:
+        json.dump(results, out)
+
+    return results
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1:2] == ["binary"]:
+        sys.exit(0 if test_http_against_binary_relay(*map(int, sys.argv[2:]))['target_reached'] else 1)
+    else:
+        test_influence_of_number_of_shards(*map(int, sys.argv[1:]))
@@ -0,0 +1,269 @@
+"""
+Store of benchmark results, with regression detection against a baseline.
+
+Every experiment run of `evaluate_performance.py` is recorded in an SQLite database
+(`benchmark_results.sqlite`, or the file named by the environment variable SMC_RESULTS_DB):
+the metrics of each repetition as returned by `process_metrics`, together with the git
+revision of the code and information about the machine.
+
+The comparator tests, for every configuration (e.g. number of parties) and every metric, whether
+the candidate run is worse than the baseline run:
+
+* compute time (`comp_time_*`, `runtime_*`, `server_time`, `ttp_time`), memory (`memory_*`) and
+  bytes (`bytes_*`, `wire_bytes_*`: the size of a share depends on its number of digits, the wire
+  bytes on the polls that missed their message): one-sided Mann-Whitney U test over the repetitions;
+  a regression is flagged when the test is significant and the median is worse by more than the
+  threshold;
+* rounds: these do not vary between repetitions, so any increase counts.
+
+Usage:
+
+    python results_store.py list [--experiment num_participants]
+    python results_store.py compare BASELINE_RUN_ID CANDIDATE_RUN_ID [--alpha 0.05] [--threshold 0.05]
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Any, Dict, List, Optional, Tuple
+
+
+DEFAULT_DATABASE = "benchmark_results.sqlite"
+
+# Keys of the results describing how a repetition was run rather than what was measured or varied
+CONTEXT_KEYS = {'iteration', 'concurrency', 'pinned', 'load_avg'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    experiment TEXT NOT NULL,
+    created REAL NOT NULL,
+    git_revision TEXT,
+    git_dirty INTEGER,
+    machine TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    repetition INTEGER NOT NULL,
+    metrics TEXT NOT NULL,
+    PRIMARY KEY (run_id, repetition)
+);
+"""
+
+
+def metric_kind(name: str) -> Optional[str]:
+    """
+    "compute time", "memory", "bytes" or "rounds" for the metrics checked for regressions, None otherwise.
+    """
+    if name.startswith('comp_time_') or name.startswith('runtime_') or name in ('server_time', 'ttp_time'):
+        return "compute time"
+    if name.startswith('memory_'):
+        return "memory"
+    if name.startswith('bytes_') or name.startswith('wire_bytes_'):
+        return "bytes"
+    if name == 'rounds':
+        return "rounds"
+    return None
+
+
+def git_revision() -> Tuple[Optional[str], Optional[bool]]:
+    """
+    Commit checked out in the current directory and whether the working tree has changes
+    (None, None outside of a git repository).
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True)
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return revision.stdout.strip(), bool(status.stdout.strip())
+
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+class ResultsStore:
+    """
+    SQLite database of experiment runs.
+
+    Attributes:
+        path: file of the database (default: SMC_RESULTS_DB or benchmark_results.sqlite)
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else os.environ.get('SMC_RESULTS_DB', DEFAULT_DATABASE)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record_run(self, experiment: str, results: List[Dict[str, Any]]) -> int:
+        """
+        Store the metrics of all repetitions of an experiment run and return the ID of the run.
+        """
+        revision, dirty = git_revision()
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (experiment, created, git_revision, git_dirty, machine) VALUES (?, ?, ?, ?, ?)",
+                (experiment, time.time(), revision, dirty, json.dumps(machine_info(), sort_keys=True)))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO results (run_id, repetition, metrics) VALUES (?, ?, ?)",
+                [(run_id, repetition, json.dumps(metrics, sort_keys=True))
+                 for repetition, metrics in enumerate(results)])
+        return run_id
+
+    def runs(self, experiment: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        All runs (of an experiment), oldest first.
+        """
+        query = "SELECT run_id, experiment, created, git_revision, git_dirty, machine FROM runs"
+        parameters: Tuple = ()
+        if experiment is not None:
+            query += " WHERE experiment = ?"
+            parameters = (experiment,)
+        return [
+            {'run_id': run_id, 'experiment': name, 'created': created, 'git_revision': revision,
+             'git_dirty': None if dirty is None else bool(dirty), 'machine': json.loads(machine)}
+            for run_id, name, created, revision, dirty, machine
+            in self.connection.execute(query + " ORDER BY run_id", parameters)
+        ]
+
+    def results(self, run_id: int) -> List[Dict[str, Any]]:
+        """
+        Metrics of the repetitions of a run.
+        """
+        rows = self.connection.execute(
+            "SELECT metrics FROM results WHERE run_id = ? ORDER BY repetition", (run_id,))
+        return [json.loads(metrics) for (metrics,) in rows]
+
+
+def group_by_configuration(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Samples of every metric, per configuration (the values of the experiment variables).
+    """
+    groups: Dict[str, Dict[str, List[float]]] = dict()
+    for metrics in results:
+        configuration = json.dumps(
+            {key: value for key, value in metrics.items()
+             if key not in CONTEXT_KEYS and metric_kind(key) is None},
+            sort_keys=True)
+        samples = groups.setdefault(configuration, dict())
+        for key, value in metrics.items():
+            if metric_kind(key) is not None and value is not None:
+                samples.setdefault(key, []).append(value)
+    return groups
+
+
+def compare_runs(
+    baseline: List[Dict[str, Any]],
+    candidate: List[Dict[str, Any]],
+    alpha: float = 0.05,
+    threshold: float = 0.05
+) -> List[Dict[str, Any]]:
+    """
+    Compare every metric of every configuration present in both runs.
+
+    Returns one entry per comparison, with the medians, the p-value (None for the rounds) and
+    whether it is a regression.
+    """
+    # only needed for comparing, recording works without scipy
+    from scipy.stats import mannwhitneyu
+
+    baseline_groups = group_by_configuration(baseline)
+    comparisons = []
+
+    for configuration, samples in sorted(group_by_configuration(candidate).items()):
+        if configuration not in baseline_groups:
+            continue
+        for metric, values in sorted(samples.items()):
+            baseline_values = baseline_groups[configuration].get(metric)
+            if not baseline_values:
+                continue
+
+            baseline_median = median(baseline_values)
+            candidate_median = median(values)
+            worse = candidate_median > baseline_median * (1 + threshold)
+
+            if metric_kind(metric) != "rounds":
+                p_value = mannwhitneyu(values, baseline_values, alternative='greater').pvalue
+                regression = worse and p_value < alpha
+            else:
+                p_value = None
+                regression = candidate_median > baseline_median
+
+            comparisons.append({
+                'configuration': json.loads(configuration),
+                'metric': metric,
+                'kind': metric_kind(metric),
+                'baseline_median': baseline_median,
+                'candidate_median': candidate_median,
+                'p_value': p_value,
+                'regression': regression,
+            })
+
+    return comparisons
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database file (default: SMC_RESULTS_DB or benchmark_results.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = commands.add_parser("list", help="list the recorded runs")
+    list_parser.add_argument("--experiment", help="only the runs of this experiment")
+
+    compare_parser = commands.add_parser("compare", help="flag the regressions of a run against a baseline run")
+    compare_parser.add_argument("baseline", type=int, help="ID of the baseline run")
+    compare_parser.add_argument("candidate", type=int, help="ID of the run to check")
+    compare_parser.add_argument("--alpha", type=float, default=0.05,
+                                help="significance level of the tests (default: 0.05)")
+    compare_parser.add_argument("--threshold", type=float, default=0.05,
+                                help="relative slowdown of the median ignored as noise (default: 0.05)")
+
+    options = parser.parse_args(args)
+    store = ResultsStore(options.db)
+
+    try:
+        if options.command == "list":
+            for run in store.runs(options.experiment):
+                dirty = " (modified)" if run['git_dirty'] else ""
+                created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run['created']))
+                print(f"{run['run_id']:5} {created} {run['experiment']:30} "
+                      f"{run['git_revision']}{dirty} {run['machine']['hostname']}")
+            return 0
+
+        comparisons = compare_runs(store.results(options.baseline), store.results(options.candidate),
+                                   options.alpha, options.threshold)
+    finally:
+        store.close()
+
+    regressions = 0
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison['regression'] else ""
+        p_value = "" if comparison['p_value'] is None else f"p={comparison['p_value']:.3g}"
+        print(f"{json.dumps(comparison['configuration'], sort_keys=True):40} {comparison['metric']:28} "
+              f"{comparison['baseline_median']:14.6g} -> {comparison['candidate_median']:14.6g} {p_value:10} {flag}")
+        regressions += comparison['regression']
+
+    print(f"{regressions} regression(s) in {len(comparisons)} comparisons")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
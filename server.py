@@ -1,15 +1,26 @@
 """
 Trusted server that should help SMC client to communicate.
 You should not need to change this file.
+
+Every response carries the server's own accounting of the request:
+* X-Server-Time: seconds the server spent processing the request;
+* X-Request-Bytes: size of the request as received (request line, headers and body);
+* X-TTP-Time (triplet shares only): seconds the TTP spent generating or looking up the shares.
 """
 
 import collections
 import sys
+import threading
+import timeit
 from os import environ
 from typing import Dict, List, Optional, Tuple
 
-from flask import Flask, request, Response, jsonify
+from flask import Flask, g, request, Response, jsonify
 
+from observers import peak_rss
+from profiling import StackSampler
+from server_metrics import ServerMetrics
+from tracing import Tracer, now
 from ttp import TrustedParamGenerator
 
 
@@ -17,6 +28,58 @@ environ["WERKZEUG_RUN_MAIN"] = "true"
 app: Flask = Flask("Trusted Third Party Server")
 store: Dict[str, Dict[Tuple[str, str], bytes]] = collections.defaultdict(dict)
 ttp: TrustedParamGenerator = TrustedParamGenerator()
+# TTPs of the computations registered through /sessions, per participant
+session_ttps: Dict[str, TrustedParamGenerator] = dict()
+# Spans of the requests, once enabled through POST /trace
+tracer: Optional[Tracer] = None
+# Counters and histograms served by /metrics
+metrics: ServerMetrics = ServerMetrics()
+# Stacks of the requests, once enabled through POST /profile
+sampler: Optional[StackSampler] = None
+# Route of the request being processed, for the sampler
+current_route: Optional[str] = None
+# Size of the messages in the store, and its largest value since the last /reset
+store_bytes: int = 0
+store_bytes_peak: int = 0
+
+
+def _request_bytes() -> int:
+    """
+    Size of the current request on the wire: request line, headers and body.
+    """
+    environ = request.environ
+    size = len(f"{environ['REQUEST_METHOD']} {environ.get('RAW_URI', request.full_path)} "
+               f"{environ['SERVER_PROTOCOL']}\r\n")
+    for key, value in environ.items():
+        # HTTP_USER_AGENT is "User-Agent", CONTENT_TYPE and CONTENT_LENGTH come without prefix
+        # (some WSGI servers set both)
+        if key.startswith("HTTP_") and key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            size += len(key) - len("HTTP_") + len(": \r\n") + len(value)
+        elif key in ("CONTENT_TYPE", "CONTENT_LENGTH") and value:
+            size += len(key) + len(": \r\n") + len(value)
+    return size + len("\r\n") + (request.content_length or 0)
+
+
+@app.before_request
+def _start_request():
+    global current_route
+    current_route = request.endpoint or "not_found"
+    g.starttime = timeit.default_timer()
+    g.starttime_trace = now()
+
+
+@app.after_request
+def _end_request(response: Response):
+    global current_route
+    current_route = None
+    server_time = timeit.default_timer() - g.starttime
+    response.headers["X-Server-Time"] = f"{server_time:.9f}"
+    response.headers["X-Request-Bytes"] = str(_request_bytes())
+    if tracer is not None and request.endpoint != "trace":
+        tracer.add_span(request.endpoint or "not_found", "server", g.starttime_trace, now(),
+                        path=request.path, status=response.status_code)
+    metrics.record_request(request.endpoint or "not_found", request.method, response.status_code, server_time)
+    return response
 
 
 @app.route("/private/<sender_id>/<receiver_id>/<label>", methods=["POST"])
@@ -73,14 +136,126 @@ def retrieve_share(client_id: str, op_id: str):
     """
     The client retrieve Beaver triplets generated by the server.
     """
-    shares = ttp.retrieve_share(client_id, op_id)
-    return jsonify([share.bn for share in shares]), 200
+    session_ttp = session_ttps.get(client_id, ttp)
+    generated = not session_ttp.triplet_shares
+    starttime = timeit.default_timer()
+    shares = session_ttp.retrieve_share(client_id, op_id)
+    ttp_time = timeit.default_timer() - starttime
+    metrics.record_triplet_shares(generated)
+    return jsonify([share.bn for share in shares]), 200, {"X-TTP-Time": f"{ttp_time:.9f}"}
+
+
+@app.route("/reset", methods=["POST"])
+def reset():
+    """
+    Forget all messages and register a new list of participants (JSON body),
+    so that the server can be reused for the next computation.
+    """
+    global ttp, store_bytes, store_bytes_peak
+    store.clear()
+    store_bytes = store_bytes_peak = 0
+    session_ttps.clear()
+    ttp = TrustedParamGenerator()
+    for participant in request.get_json():
+        ttp.add_participant(participant)
+    return Response(status=200)
+
+
+@app.route("/sessions", methods=["POST", "DELETE"])
+def register_session():
+    """
+    POST: register the participants (JSON body) of one more computation running next to the others.
+    The computation gets its own TTP, so that its Beaver triplets are shared among its participants only.
+    DELETE: forget the TTP and the messages of a finished computation (JSON body: its participants), so
+    that the store does not grow over a long run of computations.
+    """
+    global store_bytes
+    participants = set(request.get_json())
+    if request.method == "DELETE":
+        for pool in list(store):
+            # private channels are (receiver, label), public ones (sender, label)
+            for channel in [channel for channel in store[pool] if channel[0] in participants]:
+                store_bytes -= len(store[pool].pop(channel))
+        for participant in participants:
+            session_ttps.pop(participant, None)
+        return Response(status=200)
+
+    session_ttp = TrustedParamGenerator()
+    for participant in participants:
+        session_ttp.add_participant(participant)
+        session_ttps[participant] = session_ttp
+    return Response(status=200)
+
+
+@app.route("/trace", methods=["GET", "POST"])
+def trace():
+    """
+    POST: start recording the requests as spans (forgetting the previous ones);
+    GET: the spans recorded so far (JSON list of Chrome trace events, see tracing.py).
+    """
+    global tracer
+    if request.method == "POST":
+        tracer = Tracer("server")
+        return Response(status=200)
+    return jsonify(tracer.events if tracer is not None else []), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def export_metrics():
+    """
+    Request counts, poll misses, store size, ttp work and request latencies
+    (Prometheus text format, see server_metrics.py).
+    """
+    return Response(metrics.render(store), status=200, mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/memory", methods=["GET"])
+def memory():
+    """
+    Memory of the server (JSON): messages and bytes in the store, largest size of the store since
+    the last /reset and peak resident set size of the process (where the platform tells it).
+    """
+    usage = {
+        'store_entries': sum(len(messages) for messages in store.values()),
+        'store_bytes': store_bytes,
+        'store_bytes_peak': store_bytes_peak,
+    }
+    if peak_rss() is not None:
+        usage['rss_peak'] = peak_rss()
+    return jsonify(usage), 200
+
+
+def _profile_prefix() -> Optional[List[str]]:
+    if current_route is None or current_route == "profile":
+        return None
+    return ["server", current_route]
+
+
+@app.route("/profile", methods=["GET", "POST"])
+def profile():
+    """
+    POST: start sampling the stacks of the requests (forgetting the previous ones);
+    GET: stop sampling and return the stacks (JSON object of collapsed stack -> samples, see profiling.py).
+    """
+    global sampler
+    if sampler is not None:
+        sampler.stop()
+    if request.method == "POST":
+        sampler = StackSampler(threading.get_ident(), _profile_prefix)
+        sampler.start()
+        return Response(status=200)
+    stacks = dict(sampler.stacks) if sampler is not None else dict()
+    sampler = None
+    return jsonify(stacks), 200
 
 
 def _set_value(pool: str, channel: Tuple[str, str], data: bytes) -> None:
     """
     Push data to a channel in a given pool and send an event.
     """
+    global store_bytes, store_bytes_peak
+    store_bytes += len(data) - len(store[pool].get(channel, b""))
+    store_bytes_peak = max(store_bytes_peak, store_bytes)
     store[pool][channel] = data
 
 
@@ -0,0 +1,151 @@
+"""
+Live metrics of the relay (server.py), in the Prometheus text exposition format.
+
+Served by the `/metrics` route of the server, e.g. `curl localhost:5000/metrics`, or scraped
+by a local Prometheus. The counters only grow (a `/reset` does not clear them), so rates are
+computed by the consumer between two scrapes.
+
+Metrics:
+* smc_relay_requests_total{route, method, status}: requests answered;
+* smc_relay_poll_hits_total{route}, smc_relay_poll_misses_total{route}: polls (GET on
+  /private and /public) that found their message, and that got a 404 because the message
+  was not there yet; smc_relay_poll_miss_ratio{route} is misses / hits;
+* smc_relay_store_entries{pool}, smc_relay_store_bytes{pool}: messages held by the server;
+* smc_relay_triplets_generated_total, smc_relay_triplet_shares_served_total: work of the ttp;
+* smc_relay_request_duration_seconds{route}: histogram of the time spent on each request.
+"""
+
+import bisect
+import collections
+import math
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Routes answering the polls of the parties with a 404 until the message is there
+POLL_ROUTES = ("retrieve_private_message", "retrieve_public_message")
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, with their count and sum.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> List[Tuple[str, int]]:
+        """
+        (upper bound, number of values below it) per bucket, as in the "le" label.
+        """
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        cumulative = []
+        total = 0
+        for bound, count in zip(bounds, self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+def _value(value: float) -> str:
+    return "+Inf" if value == math.inf else str(value)
+
+
+class ServerMetrics:
+    """
+    Counters and histograms of the requests answered by the server.
+    """
+
+    def __init__(self):
+        self.requests: Dict[Tuple[str, str, int], int] = collections.Counter()
+        self.latency: Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.triplets_generated = 0
+        self.triplet_shares_served = 0
+
+    def record_request(self, route: str, method: str, status: int, seconds: float) -> None:
+        self.requests[(route, method, status)] += 1
+        self.latency[route].observe(seconds)
+
+    def record_triplet_shares(self, generated: bool) -> None:
+        """
+        Count triplet shares served by a ttp, which first had to generate the triplet if `generated`.
+        """
+        self.triplet_shares_served += 1
+        if generated:
+            self.triplets_generated += 1
+
+    def poll_counts(self) -> Dict[str, Tuple[int, int]]:
+        """
+        (hits, misses) per poll route.
+        """
+        polls = {route: (0, 0) for route in POLL_ROUTES}
+        for (route, method, status), count in self.requests.items():
+            if route in polls:
+                hits, misses = polls[route]
+                if status == 404:
+                    polls[route] = (hits, misses + count)
+                elif status == 200:
+                    polls[route] = (hits + count, misses)
+        return polls
+
+    def render(self, store: Mapping[str, Mapping[Tuple[str, str], bytes]]) -> str:
+        """
+        All metrics in the Prometheus text format, with the current content of the server's store.
+        """
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, description: str, samples: Iterable[Tuple[str, float]]) -> None:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{labels} {_value(value)}" for labels, value in samples)
+
+        metric("smc_relay_requests_total", "counter", "Requests answered, per route, method and status.",
+               ((_labels(route=route, method=method, status=status), count)
+                for (route, method, status), count in sorted(self.requests.items())))
+
+        polls = self.poll_counts()
+        metric("smc_relay_poll_hits_total", "counter", "Polls that found their message.",
+               ((_labels(route=route), hits) for route, (hits, _) in polls.items()))
+        metric("smc_relay_poll_misses_total", "counter", "Polls answered with a 404 (message not there yet).",
+               ((_labels(route=route), misses) for route, (_, misses) in polls.items()))
+        metric("smc_relay_poll_miss_ratio", "gauge", "Polls answered with a 404 per poll that found its message.",
+               ((_labels(route=route), misses / hits if hits else (math.inf if misses else 0.0))
+                for route, (hits, misses) in polls.items()))
+
+        metric("smc_relay_store_entries", "gauge", "Messages held by the server, per pool.",
+               ((_labels(pool=pool), len(messages)) for pool, messages in sorted(store.items())))
+        metric("smc_relay_store_bytes", "gauge", "Size of the messages held by the server, per pool.",
+               ((_labels(pool=pool), sum(len(message) for message in messages.values()))
+                for pool, messages in sorted(store.items())))
+
+        metric("smc_relay_triplets_generated_total", "counter", "Beaver triplets generated by the ttps.",
+               [("", self.triplets_generated)])
+        metric("smc_relay_triplet_shares_served_total", "counter", "Beaver triplet shares served to the parties.",
+               [("", self.triplet_shares_served)])
+
+        name = "smc_relay_request_duration_seconds"
+        lines.append(f"# HELP {name} Time spent processing the requests, per route.")
+        lines.append(f"# TYPE {name} histogram")
+        for route, histogram in sorted(self.latency.items()):
+            for bound, count in histogram.cumulative_counts():
+                lines.append(f"{name}_bucket{_labels(route=route, le=bound)} {count}")
+            lines.append(f"{name}_sum{_labels(route=route)} {histogram.sum}")
+            lines.append(f"{name}_count{_labels(route=route)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
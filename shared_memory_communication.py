@@ -0,0 +1,408 @@
+"""
+Shared-memory transport for SMC parties running as processes on the same host.
+
+Instead of travelling over loopback HTTP through `server.py`, every participant (and the
+trusted third party) owns an inbox: a ring buffer living in a `multiprocessing.shared_memory`
+segment. Senders append framed records to the receiver's inbox and signal it through a
+condition variable; the owner drains its inbox into local dictionaries and serves the
+`retrieve_*` calls from there. This gives an honest lower bound on the protocol overhead
+of co-located parties.
+
+Usage (the network has to be created before the party processes are started):
+>>> network = SharedMemoryNetwork(["Alice", "Bob"])
+>>> ttp = Process(target=network.serve_ttp)
+>>> # in each party process:
+>>> party = SMCParty("Alice", "localhost", 0, prot, value_dict, comm=network.communication("Alice"))
+"""
+
+import json
+import struct
+from multiprocessing import Condition, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple, Union
+
+from communication import Communication, decode_record, encode_record
+from smc_party import SMCParty
+from ttp import TrustedParamGenerator
+
+# Imports for benchmarking
+import timeit
+
+
+# Name of the inbox of the trusted third party
+TTP_ID = "__ttp__"
+
+# Record kinds
+PRIVATE = 0
+PUBLIC = 1
+TRIPLET_REQUEST = 2
+TRIPLET_RESPONSE = 3
+STOP = 4
+
+# The header of a ring buffer holds the total number of bytes ever written (head)
+# and ever read (tail); both only grow, positions are taken modulo the capacity.
+HEADER = struct.Struct("<QQ")
+RECORD_LENGTH = struct.Struct("<I")
+
+# Default inbox size: 1 MiB per participant
+DEFAULT_INBOX_SIZE = 1 << 20
+
+# Default time a party waits for room in a full inbox before giving up, in seconds
+DEFAULT_SEND_TIMEOUT = 60.0
+
+
+class RingBuffer:
+    """
+    Multi-producer, single-consumer byte ring buffer in shared memory.
+
+    Attributes:
+        shm: shared memory segment holding the header and the data
+        cond: condition variable guarding the header, notified on every write and read
+    """
+
+    def __init__(self, shm: SharedMemory, cond):
+        self.shm = shm
+        self.cond = cond
+        self.capacity = shm.size - HEADER.size
+
+    def _positions(self) -> Tuple[int, int]:
+        return HEADER.unpack_from(self.shm.buf, 0)
+
+    def _copy_in(self, position: int, data: bytes) -> None:
+        start = position % self.capacity
+        first = min(len(data), self.capacity - start)
+        base = HEADER.size
+        self.shm.buf[base + start:base + start + first] = data[:first]
+        if first < len(data):
+            self.shm.buf[base:base + len(data) - first] = data[first:]
+
+    def _copy_out(self, position: int, length: int) -> bytes:
+        start = position % self.capacity
+        first = min(length, self.capacity - start)
+        base = HEADER.size
+        data = bytes(self.shm.buf[base + start:base + start + first])
+        if first < length:
+            data += bytes(self.shm.buf[base:base + length - first])
+        return data
+
+    def write(self, record: bytes, timeout: Optional[float] = None) -> None:
+        """
+        Append a record, blocking while the buffer is too full to hold it (at most `timeout` seconds,
+        then raise a TimeoutError).
+        """
+        framed = RECORD_LENGTH.pack(len(record)) + record
+        if len(framed) > self.capacity:
+            raise ValueError(
+                f"Record of {len(record)} bytes does not fit into an inbox of {self.capacity} bytes")
+
+        with self.cond:
+            if not self.cond.wait_for(
+                    lambda: self.capacity - (self._positions()[0] - self._positions()[1]) >= len(framed), timeout):
+                raise TimeoutError(f"No room for a record of {len(record)} bytes after {timeout} s")
+            head, tail = self._positions()
+            self._copy_in(head, framed)
+            HEADER.pack_into(self.shm.buf, 0, head + len(framed), tail)
+            self.cond.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> List[bytes]:
+        """
+        Take all records currently in the buffer, waiting up to `timeout` seconds for one to arrive.
+        """
+        records = []
+        with self.cond:
+            if not self.cond.wait_for(lambda: self._positions()[0] != self._positions()[1], timeout):
+                return records
+            head, tail = self._positions()
+            while tail != head:
+                (length,) = RECORD_LENGTH.unpack(self._copy_out(tail, RECORD_LENGTH.size))
+                records.append(self._copy_out(tail + RECORD_LENGTH.size, length))
+                tail += RECORD_LENGTH.size + length
+            HEADER.pack_into(self.shm.buf, 0, head, tail)
+            self.cond.notify_all()
+        return records
+
+
+class SharedMemoryNetwork:
+    """
+    The set of inboxes of all participants and of the trusted third party.
+
+    Create it in the parent process, then start the parties and the TTP as child processes.
+
+    Attributes:
+        participant_ids: List of IDs of the participating clients
+        inbox_size: size of each inbox in bytes (default: 1 MiB)
+    """
+
+    def __init__(self, participant_ids: List[str], inbox_size: int = DEFAULT_INBOX_SIZE):
+        self.participant_ids = list(participant_ids)
+        self.inboxes: Dict[str, RingBuffer] = dict()
+
+        for owner_id in self.participant_ids + [TTP_ID]:
+            shm = SharedMemory(create=True, size=HEADER.size + inbox_size)
+            HEADER.pack_into(shm.buf, 0, 0, 0)
+            self.inboxes[owner_id] = RingBuffer(shm, Condition())
+
+    def communication(self, client_id: str, poll_delay: float = 0.05,
+                      send_timeout: float = DEFAULT_SEND_TIMEOUT) -> "SharedMemoryCommunication":
+        """
+        Transport of a participant; to be created in the participant's process.
+        """
+        return SharedMemoryCommunication(self, client_id, poll_delay, send_timeout)
+
+    def deliver(self, receiver_id: str, kind: int, sender_id: str, label: str, body: bytes,
+                timeout: Optional[float] = None) -> None:
+        """
+        Write a record into the inbox of receiver_id (waiting at most timeout seconds for room, see
+        `RingBuffer.write`).
+        """
+        self.inboxes[receiver_id].write(encode_record(kind, sender_id, label, body), timeout)
+
+    def serve_ttp(self) -> None:
+        """
+        Run the trusted third party until `stop_ttp` is called.
+        """
+        ttp = TrustedParamGenerator()
+        for participant_id in self.participant_ids:
+            ttp.add_participant(participant_id)
+
+        while True:
+            for record in self.inboxes[TTP_ID].drain():
+                kind, sender_id, op_id, _ = decode_record(record)
+                if kind == STOP:
+                    return
+                shares = ttp.retrieve_share(sender_id, op_id)
+                body = json.dumps([share.bn for share in shares]).encode("utf-8")
+                self.deliver(sender_id, TRIPLET_RESPONSE, TTP_ID, op_id, body)
+
+    def stop_ttp(self) -> None:
+        """
+        Ask the process running `serve_ttp` to return.
+        """
+        self.deliver(TTP_ID, STOP, TTP_ID, "", b"")
+
+    def close(self) -> None:
+        """
+        Release the shared memory segments; call once in the parent after all processes are done.
+        """
+        for inbox in self.inboxes.values():
+            inbox.shm.close()
+            inbox.shm.unlink()
+
+
+class SharedMemoryCommunication(Communication):
+    """
+    Drop-in replacement for `Communication` exchanging messages through shared memory.
+
+    Attributes:
+        network: the SharedMemoryNetwork this client is part of
+        client_id: Identifier of this client
+        poll_delay: maximum time to wait on the inbox before re-checking (default: 0.05 s)
+        send_timeout: maximum time to wait for room in a full inbox, then raise a TimeoutError
+            (default: 60 s)
+    """
+
+    def __init__(self, network: SharedMemoryNetwork, client_id: str, poll_delay: float = 0.05,
+                 send_timeout: float = DEFAULT_SEND_TIMEOUT):
+        self.network = network
+        self.client_id = client_id
+        self.poll_delay = poll_delay
+        self.send_timeout = send_timeout
+
+        # messages already taken out of the inbox
+        self.private_messages: Dict[str, bytes] = dict()
+        self.public_messages: Dict[Tuple[str, str], bytes] = dict()
+        self.triplet_messages: Dict[str, bytes] = dict()
+
+        self._init_metrics()
+
+    def _drain(self) -> None:
+        """
+        Move the records waiting in our inbox into the local dictionaries.
+        """
+        for record in self.network.inboxes[self.client_id].drain(self.poll_delay):
+            kind, sender_id, label, body = decode_record(record)
+            if kind == PRIVATE:
+                self.private_messages[label] = body
+            elif kind == PUBLIC:
+                self.public_messages[(sender_id, label)] = body
+            elif kind == TRIPLET_RESPONSE:
+                self.triplet_messages[label] = body
+
+    def _deliver(self, receiver_id: str, kind: int, label: str, body: bytes) -> None:
+        """
+        Write a record into the inbox of receiver_id. While it is full, keep draining our own inbox:
+        the receiver may be waiting for room in ours as well (both inboxes full), and would not drain
+        its own meanwhile.
+        """
+        deadline = timeit.default_timer() + self.send_timeout
+        while True:
+            try:
+                self.network.deliver(receiver_id, kind, self.client_id, label, body, self.poll_delay)
+                return
+            except TimeoutError:
+                if timeit.default_timer() > deadline:
+                    raise TimeoutError(f"The inbox of {receiver_id} stayed full for {self.send_timeout} s")
+                self._drain()
+
+    def _wait_for(self, messages: dict, key) -> bytes:
+        while key not in messages:
+            if self.stopped.is_set():
+                raise ConnectionAbortedError(f"Communication of client {self.client_id} stopped")
+            self._drain()
+        return messages[key]
+
+    def send_private_message(
+        self,
+        receiver_id: str,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Send a private message to another participant.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_send_private_msg = timeit.default_timer()
+
+        self._deliver(receiver_id, PRIVATE, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_send_private_msg)
+
+    def retrieve_private_message(
+        self,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a private message, waiting until it arrives.
+        """
+        starttime_retrieve_private_msg = timeit.default_timer()
+
+        message = self._wait_for(self.private_messages, label)
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_private_msg)
+
+        return message
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        """
+        Retrieve several private messages. Retrieval waits until the message arrives, so retrieving
+        them one after the other waits only as long as the last one takes to arrive.
+        """
+        return {label: self.retrieve_private_message(label) for label in labels}
+
+    def publish_message(
+        self,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        """
+        Publish a message: a copy is delivered to the inbox of every other participant.
+        """
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        with self.metrics_lock:
+            self.bytes_sent_smc_party = self.bytes_sent_smc_party + len(message)
+
+        starttime_publish_msg = timeit.default_timer()
+
+        self.public_messages[(self.client_id, label)] = message
+        for receiver_id in self.network.participant_ids:
+            if receiver_id != self.client_id:
+                self._deliver(receiver_id, PUBLIC, label, message)
+
+        self.time_spent_sending += (timeit.default_timer() - starttime_publish_msg)
+
+    def retrieve_public_message(
+        self,
+        sender_id: str,
+        label: str
+    ) -> bytes:
+        """
+        Retrieve a public message, waiting until it arrives.
+        """
+        starttime_retrieve_public_msg = timeit.default_timer()
+
+        message = self._wait_for(self.public_messages, (sender_id, label))
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+        self.time_spent_retrieving += (timeit.default_timer() - starttime_retrieve_public_msg)
+
+        return message
+
+    def retrieve_beaver_triplet_shares(
+        self,
+        op_id: str
+    ) -> Tuple[int, int, int]:
+        """
+        Retrieve a triplet of shares generated by the trusted third party.
+        """
+        starttime = timeit.default_timer()
+
+        if op_id not in self.triplet_messages:
+            self._deliver(TTP_ID, TRIPLET_REQUEST, op_id, b"")
+        message = self._wait_for(self.triplet_messages, op_id)
+
+        time_taken = timeit.default_timer() - starttime
+        self.comp_cost_ttp = time_taken
+        self.time_spent_retrieving += time_taken
+
+        with self.metrics_lock:
+            self.bytes_received_smc_party = self.bytes_received_smc_party + len(message)
+            self.bytes_sent_ttp = self.bytes_sent_ttp + len(message)
+
+        return tuple(json.loads(message))  # type: ignore
+
+
+def smc_client(client_id, prot, value_dict, network, queue, instrumented=False):
+    cli = SMCParty(
+        client_id,
+        "localhost",
+        0,
+        protocol_spec=prot,
+        value_dict=value_dict,
+        comm=network.communication(client_id)
+    )
+    res = cli.run_instrumented() if instrumented else cli.run()
+    queue.put(res)
+    print(f"{client_id} has finished!")
+
+
+def run_processes(server_args, *client_args, instrumented: bool = False):
+    """
+    Counterpart of `harness.run_processes` using shared memory instead of the server.
+
+    server_args is the list of participant IDs, each of client_args is (client_id, prot, value_dict).
+    """
+    network = SharedMemoryNetwork(server_args)
+    queue = Queue()
+
+    ttp = Process(target=network.serve_ttp)
+    clients = [Process(target=smc_client, args=(*args, network, queue, instrumented))
+               for args in client_args]
+
+    ttp.start()
+    for client in clients:
+        client.start()
+
+    # Empty the queue before joining: a child does not exit while its result is unread.
+    results = [queue.get() for _ in clients]
+
+    for client in clients:
+        client.join()
+
+    network.stop_ttp()
+    ttp.join()
+    network.close()
+
+    return results
@@ -0,0 +1,261 @@
+"""
+Single-process lockstep simulation of the SMC protocol.
+
+All parties of a `ProtocolSpec` are executed together, gate by gate: the value of every
+sub-expression is the list of the n parties' shares, and the openings of the Beaver
+multiplications are sums over these lists instead of messages through a server. The parties
+follow the same rules as `SMCParty.process_expression` (which party adds the scalars, which
+sub-expressions are multiplied locally, one triplet per operation ID from the TTP), so the
+result is the one the real parties would reconstruct.
+
+Every message the real parties would exchange is counted, with its exact size in the wire
+format of `smc_party` (jsonpickle'd shares) and `server.py` (JSON triplets):
+
+>>> result, counts = simulate(protocol_spec, {"Alice": {alice_secret: 3}, "Bob": {bob_secret: 14}})
+>>> counts['messages'], counts['bytes'], counts['triplets_generated']
+"""
+
+import random
+from typing import Any, Dict, List, Tuple
+
+from expression import AddOp, Expression, MultOp, Scalar, Secret, SubOp
+from protocol import ProtocolSpec
+from secret_sharing import Share, get_prime, share_secret
+from smc_party import input_secrets, multiplicative_depth, scalars_only, serialize_object
+
+
+# A jsonpickle'd share is a constant envelope around the decimal digits of its value.
+SHARE_ENVELOPE_LENGTH = len(serialize_object(Share(0))) - 1
+
+
+def share_message_length(value: int) -> int:
+    """
+    Size of the message carrying a share with this value.
+    """
+    return SHARE_ENVELOPE_LENGTH + len(str(value))
+
+
+def triplet_message_length(triplet: List[int]) -> int:
+    """
+    Size of the response of server.py carrying a party's triplet shares (pretty-printed JSON list).
+    """
+    return len("[\n  " + ", \n  ".join(str(value) for value in triplet) + "\n]\n")
+
+
+class PartyCounts:
+    """
+    What one party sends and receives during the simulation.
+    """
+
+    def __init__(self):
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.bytes_sent_smc_party = 0
+        self.bytes_received_smc_party = 0
+        self.bytes_sent_ttp = 0
+        self.triplets_retrieved = 0
+        self.rounds = 0
+
+    def send(self, num_bytes: int) -> None:
+        self.messages_sent += 1
+        self.bytes_sent_smc_party += num_bytes
+
+    def receive(self, num_bytes: int) -> None:
+        self.messages_received += 1
+        self.bytes_received_smc_party += num_bytes
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(vars(self))
+
+
+class LockstepSimulation:
+    """
+    The state of all parties of one computation.
+
+    Attributes:
+        protocol_spec: the computation
+        value_dicts: values of the secrets, per participant ID (parties without secrets may be left out)
+    """
+
+    def __init__(self, protocol_spec: ProtocolSpec, value_dicts: Dict[str, Dict[Secret, int]]):
+        self.protocol_spec = protocol_spec
+        self.participant_ids = list(protocol_spec.participant_ids)
+        self.value_dicts = value_dicts
+        self.prime = get_prime()
+        self.counts = {participant_id: PartyCounts() for participant_id in self.participant_ids}
+
+        # owner of every secret, and the shares of its value (one per party, in participant order)
+        self.owners: Dict[Secret, int] = dict()
+        self.shares: Dict[Secret, List[int]] = dict()
+
+        # the TTP generates one triplet per operation ID, shares it among all participants
+        self.triplets: Dict[str, List[List[int]]] = dict()
+
+    def share_inputs(self) -> None:
+        """
+        Every party shares its secrets used by the expression, keeps the last share and sends the others
+        to its peers (in participant order), then retrieves its shares of the others' secrets.
+        """
+        n = len(self.participant_ids)
+        used_secrets = input_secrets(self.protocol_spec.expr)
+        for owner, owner_id in enumerate(self.participant_ids):
+            peer_ids = [participant_id for participant_id in self.participant_ids if participant_id != owner_id]
+            value_dict = self.value_dicts.get(owner_id, dict())
+            for secret, value in ((secret, value_dict[secret]) for secret in used_secrets if secret in value_dict):
+                shares = [share.bn for share in share_secret(value, n)]
+                own_share = shares.pop()
+
+                party_shares = [0] * n
+                party_shares[owner] = own_share
+                for peer_id, share in zip(peer_ids, shares):
+                    party_shares[self.participant_ids.index(peer_id)] = share
+                    self.counts[owner_id].send(share_message_length(share))
+
+                self.owners[secret] = owner
+                self.shares[secret] = party_shares
+
+        unowned = [secret for secret in used_secrets if secret not in self.owners]
+        if unowned:
+            unowned_ids = [str(secret.id) for secret in unowned]
+            raise ValueError(f"No participant holds the secrets of the expression with IDs {unowned_ids}")
+
+        # every party but the owner retrieves its share of each secret of the expression, once
+        for secret in used_secrets:
+            for i, participant_id in enumerate(self.participant_ids):
+                if i != self.owners[secret]:
+                    self.counts[participant_id].receive(share_message_length(self.shares[secret][i]))
+
+        for counts in self.counts.values():
+            counts.rounds += 1
+
+    def triplet(self, op_id: str) -> List[List[int]]:
+        """
+        Shares of the triplet of an operation: [a, b, c] per party.
+        """
+        if op_id not in self.triplets:
+            a = random.randint(0, self.prime - 1)
+            b = random.randint(0, self.prime - 1)
+            components = [share_secret(value, len(self.participant_ids)) for value in (a, b, a * b % self.prime)]
+            self.triplets[op_id] = [[component[i].bn for component in components]
+                                    for i in range(len(self.participant_ids))]
+        return self.triplets[op_id]
+
+    def open(self, values: List[int]) -> int:
+        """
+        Every party publishes its share and retrieves those of its peers.
+        """
+        for i, participant_id in enumerate(self.participant_ids):
+            self.counts[participant_id].send(share_message_length(values[i]))
+            for j, value in enumerate(values):
+                if j != i:
+                    self.counts[participant_id].receive(share_message_length(value))
+        return sum(values) % self.prime
+
+    def open_result(self, values: List[int]) -> int:
+        """
+        Every party publishes its share of the result, the output parties retrieve those of their
+        peers; with a broadcast, the first output party publishes the result for the others.
+        """
+        output_ids = self.protocol_spec.output_ids
+        result = sum(values) % self.prime
+        for i, participant_id in enumerate(self.participant_ids):
+            self.counts[participant_id].send(share_message_length(values[i]))
+            if participant_id in output_ids:
+                for j, value in enumerate(values):
+                    if j != i:
+                        self.counts[participant_id].receive(share_message_length(value))
+            elif self.protocol_spec.broadcast:
+                self.counts[participant_id].receive(len(serialize_object(result)))
+        if self.protocol_spec.broadcast:
+            self.counts[output_ids[0]].send(len(serialize_object(result)))
+        return result
+
+    def first_party_only(self, value: int) -> List[int]:
+        return [value] + [0] * (len(self.participant_ids) - 1)
+
+    def evaluate(self, expr: Expression) -> List[int]:
+        """
+        Shares of the value of expr, one per party.
+        """
+        p = self.prime
+
+        if isinstance(expr, (AddOp, SubOp)):
+            sign = 1 if isinstance(expr, AddOp) else -1
+
+            # only the first party adds (or subtracts) scalars
+            if isinstance(expr.a, Scalar) and isinstance(expr.b, Scalar):
+                return self.first_party_only((expr.a.value + sign * expr.b.value) % p)
+            if isinstance(expr.a, Scalar):
+                b = self.evaluate(expr.b)
+                return [(expr.a.value + sign * b[0]) % p] + b[1:]
+            if isinstance(expr.b, Scalar):
+                a = self.evaluate(expr.a)
+                return [(a[0] + sign * expr.b.value) % p] + a[1:]
+
+            a, b = self.evaluate(expr.a), self.evaluate(expr.b)
+            return [(x + sign * y) % p for x, y in zip(a, b)]
+
+        if isinstance(expr, MultOp):
+            a, b = self.evaluate(expr.a), self.evaluate(expr.b)
+
+            if scalars_only(expr.a) and scalars_only(expr.b):
+                return self.first_party_only(a[0] * b[0] % p)
+            if scalars_only(expr.a) or scalars_only(expr.b):
+                return [x * y % p for x, y in zip(a, b)]
+
+            # Beaver multiplication
+            op_id = str(self.protocol_spec.expr)
+            triplet = self.triplet(op_id)
+            for i, participant_id in enumerate(self.participant_ids):
+                counts = self.counts[participant_id]
+                message_length = triplet_message_length(triplet[i])
+                counts.triplets_retrieved += 1
+                counts.bytes_received_smc_party += message_length
+                counts.bytes_sent_ttp += message_length
+
+            x_minus_a = self.open([(x - shares[0]) % p for x, shares in zip(a, triplet)])
+            y_minus_b = self.open([(y - shares[1]) % p for y, shares in zip(b, triplet)])
+
+            z = [(shares[2] + x * y_minus_b + y * x_minus_a) % p for x, y, shares in zip(a, b, triplet)]
+            z[0] = (z[0] - x_minus_a * y_minus_b) % p
+            return z
+
+        if isinstance(expr, Secret):
+            return self.shares[expr]
+
+        if isinstance(expr, Scalar):
+            # every party holds the scalar until an operation decides who keeps it
+            return [expr.value] * len(self.participant_ids)
+
+        raise TypeError(f"Cannot evaluate {expr!r}")
+
+    def run(self) -> Tuple[int, Dict[str, Any]]:
+        self.share_inputs()
+        outputs = self.evaluate(self.protocol_spec.expr)
+        result = self.open_result(outputs)
+
+        # the Beaver multiplications of a level are outstanding at the same time (see SMCParty.evaluate)
+        for counts in self.counts.values():
+            counts.rounds += multiplicative_depth(self.protocol_spec.expr) + 1
+
+        parties = {participant_id: counts.as_dict() for participant_id, counts in self.counts.items()}
+        return result, {
+            'parties': parties,
+            'messages': sum(counts['messages_sent'] for counts in parties.values()),
+            'bytes': sum(counts['bytes_sent_smc_party'] for counts in parties.values()),
+            'bytes_sent_ttp': sum(counts['bytes_sent_ttp'] for counts in parties.values()),
+            'triplets_generated': len(self.triplets),
+            'triplet_shares_served': sum(counts['triplets_retrieved'] for counts in parties.values()),
+            'rounds': max(counts['rounds'] for counts in parties.values()),
+        }
+
+
+def simulate(protocol_spec: ProtocolSpec, value_dicts: Dict[str, Dict[Secret, int]]) -> Tuple[int, Dict[str, Any]]:
+    """
+    Run the computation for all parties in this process, without a server.
+
+    Returns the result and the counts: per party ('parties': messages sent and received, bytes sent
+    and received, bytes sent to it by the TTP, triplets retrieved, rounds) and in total (messages,
+    bytes, bytes sent by the TTP, triplets generated and triplet shares served, rounds).
+    """
+    return LockstepSimulation(protocol_spec, value_dicts).run()
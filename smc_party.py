@@ -9,8 +9,16 @@ import ast
 
 import collections
 import json
+import threading
+import time
+import timeit
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from typing import (
+    Callable,
     Dict,
+    Hashable,
+    List,
+    Optional,
     Set,
     Tuple,
     Union,
@@ -27,6 +35,7 @@ from expression import (
     Scalar, SubOp
 )
 from protocol import ProtocolSpec
+from observers import MemoryObserver, MetricsObserver, Observer
 from secret_sharing import(
     reconstruct_secret,
     share_secret,
@@ -39,16 +48,16 @@ from server import send_private_message
 
 import jsonpickle
 
-# Imports for benchmarking
-import timeit
-from statistics import mean
-
 import sys
 sys.setrecursionlimit(10000)
 
 # Feel free to add as many imports as you want.
 
 
+# Input shares being sent at the same time by a party (see SMCParty.run)
+DEFAULT_MAX_IN_FLIGHT = 8
+
+
 def serialize_object(object: Any) -> bytes:
 
     return jsonpickle.encode(object).encode('utf-8')
@@ -70,6 +79,15 @@ class SMCParty:
         server_port: port of the server
         protocol_spec (ProtocolSpec): Protocol specification
         value_dict (dict): Dictionary assigning values to secrets belonging to this client.
+        comm (Communication): Transport to use instead of the HTTP relay at server_host:server_port
+            (optional, e.g. a SharedMemoryCommunication).
+        observers (List[Observer]): Notified of the phases of the protocol and of the evaluation
+            of every gate, e.g. a tracing.Tracer (optional, see observers.py).
+        max_in_flight (int): Number of input shares sent to the peers at the same time, in the
+            background of the evaluation, and of Beaver multiplications of the dataflow evaluation
+            waiting for the peers at the same time (default: 8).
+        dataflow (bool): Evaluate the expression with the dataflow scheduler (`evaluate`, the default)
+            rather than depth-first (`process_expression`).
     """
 
     def __init__(
@@ -78,314 +96,643 @@ class SMCParty:
         server_host: str,
         server_port: int,
         protocol_spec: ProtocolSpec,
-        value_dict: Dict[Secret, int]  # Has the form: {alice_secret: 3}
+        value_dict: Dict[Secret, int],  # Has the form: {alice_secret: 3}
+        comm: Optional[Communication] = None,
+        observers: Optional[List[Observer]] = None,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        dataflow: bool = True
     ):
-        self.comm = Communication(server_host, server_port, client_id)
+        if comm is None:
+            comm = Communication(server_host, server_port, client_id)
+        self.comm = comm
         self.client_id = client_id
         self.protocol_spec = protocol_spec
         self.value_dict = value_dict
-        self.shares_dict = dict()  # this will store own shares of own secrets
+        self.shares_dict = dict()  # this will store the shares of the input secrets (own and retrieved)
+        self.triplets: Dict[str, Tuple[int, int, int]] = dict()  # Beaver triplet shares retrieved by preprocess
+        self.observers = list(observers) if observers is not None else []
+        self.max_in_flight = max_in_flight
+        self.dataflow = dataflow
+        self.input_pool: Optional[ThreadPoolExecutor] = None  # sends and retrieves the input shares during run
+        # time the threads of the evaluation spent computing (not waiting for the network), see evaluate
+        self.worker_compute_time = 0.0
+        self.worker_lock = threading.Lock()
+
+    @property
+    def thread_name_prefix(self) -> str:
+        """
+        Prefix of the names of the party's background threads (see threads).
+        """
+        return f"SMCParty-{self.client_id}"
+
+    def threads(self) -> List[int]:
+        """
+        Identifiers of the party's background threads running right now: input sharing and Beaver
+        multiplications (e.g. for a profiler to sample them too).
+        """
+        return [thread.ident for thread in threading.enumerate()
+                if thread.name.rpartition("_")[0] == self.thread_name_prefix and thread.ident is not None]
+
+    def evaluation_rounds(self) -> int:
+        """
+        Communication rounds of the evaluation: one per Beaver multiplication with process_expression,
+        the multiplicative depth of the expression with the dataflow evaluate.
+        """
+        if self.dataflow:
+            return multiplicative_depth(self.protocol_spec.expr)
+        return len(beaver_gates(self.protocol_spec.expr))
+
+    def notify_phase_started(self, phase: str, key: Optional[Hashable] = None) -> None:
+        for observer in self.observers:
+            observer.phase_started(self, phase, key)
+
+    def notify_phase_finished(self, phase: str, key: Optional[Hashable] = None) -> None:
+        for observer in self.observers:
+            observer.phase_finished(self, phase, key)
+
+    def notify_gate_started(self, expr: Expression, key: Optional[Hashable] = None) -> None:
+        for observer in self.observers:
+            observer.gate_started(self, expr, key)
+
+    def notify_gate_finished(self, expr: Expression, key: Optional[Hashable] = None) -> None:
+        for observer in self.observers:
+            observer.gate_finished(self, expr, key)
+
+    def preprocess(self) -> None:
+        """
+        Offline phase: retrieve the shares of all the Beaver triplets the expression needs from the ttp
+        ahead of time, so that run uses them without talking to the ttp. Only needs the protocol spec
+        (not the inputs); call it any time after the ttp knows the participants and before run.
+        """
+        pending = [self.protocol_spec.expr]
+
+        while pending:
+
+            expr = pending.pop()
+
+            if needs_beaver_triplet(expr) and self.op_id(expr) not in self.triplets:
+
+                op_id = self.op_id(expr)
+
+                self.triplets[op_id] = self.comm.retrieve_beaver_triplet_shares(op_id)
+
+            if isinstance(expr, (AddOp, SubOp, MultOp)):
+
+                pending.extend((expr.b, expr.a))
+
+    def op_id(self, expr: MultOp) -> str:
+        """
+        ID under which the ttp hands out the triplet of a Beaver multiplication: one triplet for the
+        whole expression.
+        """
+        return str(self.protocol_spec.expr)
 
-    def run(self) -> int:
+    def run(self) -> Optional[int]:
         """
         The method the client use to do the SMC.
+
+        Returns the result, or None for a client that is not an output client of the protocol spec
+        (unless the result is broadcast).
         """
 
-        # Make a deep copy of the participant_ids in protocol_spec so we don't modify the original list
-        # when removing self from peer_ids!!!
-        # This way, we can still use self.protocol_spec.participant_ids when deciding whether to add a constant
+        for observer in self.observers:
+            observer.run_started(self)
 
-        self.peer_ids = []
+        try:
 
-        for participant_id in self.protocol_spec.participant_ids:
+            # Make a deep copy of the participant_ids in protocol_spec so we don't modify the original list
+            # when removing self from peer_ids!!!
+            # This way, we can still use self.protocol_spec.participant_ids when deciding whether to add a constant
 
-            self.peer_ids.append(participant_id)
+            self.peer_ids = []
 
-        self.peer_ids.remove(self.client_id)
+            for participant_id in self.protocol_spec.participant_ids:
 
-        # Map the secrets of self to lists of shares
-        # (produces List[List[Share]])
-        mapped_secrets = []
+                self.peer_ids.append(participant_id)
 
-        for sec in self.value_dict.values():
+            self.peer_ids.remove(self.client_id)
 
-            shares_list = share_secret(
-                sec, len(self.protocol_spec.participant_ids))
+            # Only the secrets the expression depends on are shared: the own ones are sent to the peers,
+            # the shares of the others' ones are the private messages to expect
+            used_secrets = input_secrets(self.protocol_spec.expr)
+            self.own_secrets = [secret for secret in used_secrets if secret in self.value_dict]
+            self.expected_secrets = [secret for secret in used_secrets if secret not in self.value_dict]
 
-            mapped_secrets.append(shares_list)
+            self.notify_phase_started("input sharing")
 
-        print(
-            f'Secrets of client with id {self.client_id} as lists of shares: {mapped_secrets}')
+            # Map the secrets of self to lists of shares
+            # (produces List[List[Share]])
+            mapped_secrets = []
 
-        # From each List[Share], take the first element and assign to self
+            for sec in (self.value_dict[secret] for secret in self.own_secrets):
 
-        self_secrets_keys = list(self.value_dict.keys())
+                if self.observers:
+                    self.notify_phase_started("secret sharing")
 
-        for k, share_list in enumerate(mapped_secrets):
+                shares_list = share_secret(
+                    sec, len(self.protocol_spec.participant_ids))
 
-            own_share = share_list.pop()
+                if self.observers:
+                    self.notify_phase_finished("secret sharing")
 
-            self.shares_dict.update({self_secrets_keys[k]: own_share})
+                mapped_secrets.append(shares_list)
 
-        # (I) Retrieve the IDs of other participants & send own secret to all of them
+            print(
+                f'Secrets of client with id {self.client_id} as lists of shares: {mapped_secrets}')
 
-        for i, participant_id in enumerate(self.peer_ids):
+            # From each List[Share], take the first element and assign to self
 
-            for j, secret_key in enumerate(self_secrets_keys):
+            self_secrets_keys = self.own_secrets
 
-                self.comm.send_private_message(
-                    participant_id, str(secret_key.id), serialize_object(mapped_secrets[j][i]))
+            for k, share_list in enumerate(mapped_secrets):
 
-                print(
-                    f'Client with ID {self.client_id} sent share of secret with id {secret_key.id} to {participant_id}')
+                own_share = share_list.pop()
 
-        local_comp_result = self.process_expression(self.protocol_spec.expr)
+                self.shares_dict.update({self_secrets_keys[k]: own_share})
 
-        # (III.) Send sum of received shares
+            # (I) Retrieve the IDs of other participants & send own secret to all of them
 
-        # Publish sum of received shares
+            # The shares go out in the background, max_in_flight at a time, and the shares of the other
+            # participants' secrets used by the expression are retrieved meanwhile, all at once: the
+            # evaluation starts right away and only waits for them at the first secret of someone else.
+            self.input_pool = ThreadPoolExecutor(max_workers=self.max_in_flight + 1,
+                                                 thread_name_prefix=self.thread_name_prefix)
 
-        label_comp_res = f'{self.client_id}-res'
+            self.input_shares: Future = self.input_pool.submit(
+                self.comm.retrieve_private_messages, [str(secret.id) for secret in self.expected_secrets])
 
-        comp_res = []  # list which will store
+            self.share_sends: List[Future] = []
 
-        comp_res.append(local_comp_result)
+            for i, participant_id in enumerate(self.peer_ids):
 
-        # message should be bytes or string to conform to communication class API
-        comp_res_to_send = serialize_object(local_comp_result)
+                for j, secret_key in enumerate(self_secrets_keys):
 
-        self.comm.publish_message(label_comp_res, comp_res_to_send)
+                    self.share_sends.append(self.input_pool.submit(
+                        self.send_share, participant_id, secret_key, mapped_secrets[j][i]))
 
-        print(
-            f'Client with ID {self.client_id} published the following computation result: {local_comp_result}')
+            self.notify_phase_finished("input sharing")
+
+            # (II.) Evaluate the expression on the shares
 
-        # (V). Retrieve the values computed by the others from the TTP
+            self.notify_phase_started("evaluation")
 
-        for sender_id in self.peer_ids:
+            if self.dataflow:
+                local_comp_result = self.evaluate(self.protocol_spec.expr)
+            else:
+                local_comp_result = self.process_expression(self.protocol_spec.expr)
 
-            recv_res_label = f'{sender_id}-res'
+            self.notify_phase_finished("evaluation")
 
-            message_received = self.comm.retrieve_public_message(
-                sender_id, recv_res_label)
+            # (III.) Send sum of received shares
 
-            # decode from bytes
-            message_decoded = deserialize_object(message_received)
+            self.notify_phase_started("result exchange")
+
+            # The peers need our input shares for their result, make sure they all went out
+            self.finish_input_sharing()
+
+            # Publish sum of received shares
+
+            label_comp_res = f'{self.client_id}-res'
+
+            comp_res = []  # list which will store
+
+            comp_res.append(local_comp_result)
+
+            # message should be bytes or string to conform to communication class API
+            comp_res_to_send = serialize_object(local_comp_result)
+
+            self.comm.publish_message(label_comp_res, comp_res_to_send)
 
             print(
-                f'Client with id {self.client_id} received computation result: {message_decoded} from participant {sender_id}')
+                f'Client with ID {self.client_id} published the following computation result: {local_comp_result}')
 
-            # add the received item to the value dict
-            comp_res.append(message_decoded)
+            output_ids = self.protocol_spec.output_ids
+
+            # Only the output parties reconstruct the result, the others are done (or wait for its broadcast)
+            if self.client_id not in output_ids:
+
+                reconstructed_secret = None
+
+                if self.protocol_spec.broadcast:
+
+                    reconstructed_secret = deserialize_object(
+                        self.comm.retrieve_public_message(output_ids[0], f'{output_ids[0]}-result'))
+
+                self.notify_phase_finished("result exchange")
+
+                for observer in self.observers:
+                    observer.run_finished(self)
+
+                return reconstructed_secret
+
+            # (V). Retrieve the values computed by the others from the TTP
+
+            for sender_id in self.peer_ids:
+
+                recv_res_label = f'{sender_id}-res'
+
+                message_received = self.comm.retrieve_public_message(
+                    sender_id, recv_res_label)
+
+                # decode from bytes
+                message_decoded = deserialize_object(message_received)
+
+                print(
+                    f'Client with id {self.client_id} received computation result: {message_decoded} from participant {sender_id}')
 
-        # (VI). Reconstruct Secret
+                # add the received item to the value dict
+                comp_res.append(message_decoded)
 
-        return reconstruct_secret(comp_res)
+            self.notify_phase_finished("result exchange")
 
-    # The instrumented version of run; returns a dictionary with computation and communication
-    # cost as well as the computation result
-    def run_instrumented(self) -> Tuple[int, Dict[str, int]]:
+            # (VI). Reconstruct Secret
+
+            self.notify_phase_started("reconstruction")
+
+            reconstructed_secret = reconstruct_secret(comp_res)
+
+            self.notify_phase_finished("reconstruction")
+
+            # (VII). Broadcast the result to the parties that are not output parties
+
+            if self.protocol_spec.broadcast and self.client_id == output_ids[0]:
+
+                self.comm.publish_message(f'{self.client_id}-result', serialize_object(reconstructed_secret))
+
+            for observer in self.observers:
+                observer.run_finished(self)
+
+            return reconstructed_secret
+
+        except BaseException as error:
+
+            for observer in self.observers:
+                observer.run_failed(self, error)
+
+            raise
+
+        finally:
+
+            # After a failure, give up the input sharing still in progress, so that the background
+            # threads do not keep polling (and the party alive) forever
+            if self.input_pool is not None:
+                self.abort()
+
+    def send_share(self, participant_id: str, secret: Secret, share: Share) -> None:
         """
-        The method the client use to do the SMC.
+        Send the share of one of our secrets to a peer (on a thread of the input pool).
+        """
+        self.comm.send_private_message(participant_id, str(secret.id), serialize_object(share))
+
+        print(
+            f'Client with ID {self.client_id} sent share of secret with id {secret.id} to {participant_id}')
+
+    def receive_input_shares(self) -> None:
+        """
+        Wait for the shares of the other participants' secrets retrieved in the background.
+        """
+        starttime = timeit.default_timer()
+        messages = self.input_shares.result()
+        # the background retrieval is not counted by the transport as a wait of the party, this is
+        self.comm.add_wait("retrieving", timeit.default_timer() - starttime)
+
+        for secret in self.expected_secrets:
+            self.shares_dict[secret] = deserialize_object(messages[str(secret.id)])
+
+    def finish_input_sharing(self) -> None:
+        """
+        Wait until the shares of our secrets are sent and the shares of the others' secrets are retrieved,
+        raising the error of any that failed.
+        """
+        if any(secret not in self.shares_dict for secret in self.expected_secrets):
+            self.receive_input_shares()
+
+        starttime = timeit.default_timer()
+        for send in self.share_sends:
+            send.result()
+        self.comm.add_wait("sending", timeit.default_timer() - starttime)
+
+        self.input_pool.shutdown()
+        self.input_pool = None
+
+    def abort(self) -> None:
+        """
+        Give up the background work of a failed run: cancel the input shares not sent yet, stop the
+        retrievals still waiting on the network (the input shares, the Beaver multiplications) and
+        shut the input pool down without waiting for its threads.
         """
+        for future in [self.input_shares] + self.share_sends:
+            future.cancel()
 
-        # Measure time taken overall
-        starttime_overall = timeit.default_timer()
+        self.comm.stop()
 
-        # Set up a dictionary which will contain the metrics
+        self.input_pool.shutdown(wait=False)
+        self.input_pool = None
+
+    def run_instrumented(self, memory: bool = False) -> Tuple[Optional[int], Dict[str, int]]:
+        """
+        Same as run, but also return a dictionary with the computation and communication cost
+        (see observers.MetricsObserver) and, with memory, the memory use (see observers.MemoryObserver).
+        """
+        instruments = [MetricsObserver()] + ([MemoryObserver()] if memory else [])
+        self.observers.extend(instruments)
+        try:
+            result = self.run()
+        finally:
+            for instrument in instruments:
+                self.observers.remove(instrument)
         metrics = dict()
+        for instrument in instruments:
+            metrics.update(instrument.metrics)
+        return result, metrics
 
-        # Map the secrets of self to lists of shares
-        # (produces List[List[Share]])
-        mapped_secrets = []
+    def evaluate(
+        self,
+        expr: Expression
+    ) -> Share:
+        """
+        Evaluate the expression on the shares as a dataflow graph: a gate is ready as soon as its
+        operands are. The gates computed locally are computed on the spot; the Beaver multiplications
+        are handed over to threads (max_in_flight at a time), so that the rounds of independent multiplications are outstanding
+        at the same time and the evaluation takes as many rounds as the multiplicative depth. The
+        secrets of others wait for the input shares retrieved in the background.
+
+        Same results and messages as process_expression (a sub-expression occurring twice is
+        evaluated twice); the observers are notified on this thread, the gates (and Beaver rounds)
+        waiting on the network overlap and are notified with their position in the traversal as key.
+        """
 
-        # Make a deep copy of the participant_ids in protocol_spec so we don't modify the original list
-        # when removing self from peer_ids!!!
-        # This way, we can still use self.protocol_spec.participant_ids when deciding whether to add a constant
+        # The gates, every one before its operands, with the position of their operands and operation
+        gates: List[Expression] = []
+        operands: List[List[int]] = []
+        parents: List[Optional[int]] = []
 
-        self.peer_ids = []
+        pending: List[Tuple[Expression, Optional[int]]] = [(expr, None)]
 
-        for participant_id in self.protocol_spec.participant_ids:
+        while pending:
 
-            self.peer_ids.append(participant_id)
+            gate, parent = pending.pop()
 
-        self.peer_ids.remove(self.client_id)
+            if parent is not None:
 
-        # ***********************************************************
-        # (1) First COMP metric: computation time for sharing secrets
+                operands[parent].append(len(gates))
 
-        computation_cost_sharing = []
+            gates.append(gate)
 
-        for sec in self.value_dict.values():
+            operands.append([])
 
-            # Start timer
-            starttime_sharing = timeit.default_timer()
+            parents.append(parent)
 
-            shares_list = share_secret(
-                sec, len(self.protocol_spec.participant_ids))
+            if isinstance(gate, (AddOp, SubOp, MultOp)):
 
-            # Compute time taken
-            time_taken_sharing = timeit.default_timer() - starttime_sharing
+                # left operand first
+                pending.extend(((gate.b, len(gates) - 1), (gate.a, len(gates) - 1)))
 
-            # append result
-            computation_cost_sharing.append(time_taken_sharing)
+        # Which gates have only scalars below them, and which need a Beaver triplet: bottom-up, the
+        # operands of a gate come after it
+        scalars: List[bool] = [False] * len(gates)
 
-            mapped_secrets.append(shares_list)
+        beaver: List[bool] = [False] * len(gates)
 
-        # append our first metric: average time for sharing each of this party's secrets
-        metrics.update(
-            {'comp_time_sharing': mean(computation_cost_sharing)})
-        # ***********************************************************
+        for i in reversed(range(len(gates))):
 
-        print(
-            f'Secrets of client with id {self.client_id} as lists of shares: {mapped_secrets}')
+            gate = gates[i]
 
-        # From each List[Share], take the first element and assign to self
+            if isinstance(gate, Scalar):
 
-        self_secrets_keys = list(self.value_dict.keys())
+                scalars[i] = True
 
-        for k, share_list in enumerate(mapped_secrets):
+            elif isinstance(gate, (AddOp, SubOp, MultOp)):
 
-            own_share = share_list.pop()
+                a, b = operands[i]
 
-            self.shares_dict.update({self_secrets_keys[k]: own_share})
+                scalars[i] = scalars[a] and scalars[b]
 
-        # (I) Retrieve the IDs of other participants & send own secret to all of them
+                beaver[i] = isinstance(gate, MultOp) and not (scalars[a] or scalars[b])
 
-        # Make a deep copy of the participant_ids in protocol_spec so we don't modify the original list
-        # when removing self from peer_ids!!!
-        # This way, we can still use self.protocol_spec.participant_ids when deciding whether to add a constant
+        results: Dict[int, Share] = dict()
 
-        self.peer_ids = []
+        missing = [len(gate_operands) for gate_operands in operands]
 
-        for participant_id in self.protocol_spec.participant_ids:
+        ready = collections.deque(i for i, gate_operands in enumerate(operands) if not gate_operands)
 
-            self.peer_ids.append(participant_id)
+        # gates waiting on the network: the Beaver multiplications, and the secrets of others
+        # (under the retrieval of the input shares, None)
+        outstanding: Dict[Future, Optional[int]] = dict()
 
-        self.peer_ids.remove(self.client_id)
+        waiting_for_inputs: List[int] = []
 
-        for i, participant_id in enumerate(self.peer_ids):
+        def finish(i: int, share: Share) -> None:
 
-            for j, secret_key in enumerate(self_secrets_keys):
+            results[i] = share
 
-                self.comm.send_private_message(
-                    participant_id, str(secret_key.id), serialize_object(mapped_secrets[j][i]))
+            parent = parents[i]
 
-                print(
-                    f'Client with ID {self.client_id} sent share of secret with id {secret_key.id} to {participant_id}')
+            if parent is not None:
 
-        # record the time spent sending up to now so we can use it later for correcting the time spent processing
-        # an expression
+                missing[parent] -= 1
 
-        time_spent_sending_shares = self.comm.time_spent_sending
+                if missing[parent] == 0:
 
-        # ***********************************************************
-        # (2) 2nd COMP metric: computation time for processing expression
+                    ready.append(parent)
 
-        # Start timer
-        starttime_processing = timeit.default_timer()
+        # max_in_flight multiplications at a time, started when needed. Their first half (triplet and
+        # published [x-a], [y-b]) has its own threads, which never wait for the peers, and is queued
+        # after the second half (retrieving the peers' [x-a], [y-b]): a multiplication waiting for a
+        # peer waits for a half the peer has published, or for a multiplication queued earlier, so
+        # the rounds cannot wait on each other in a circle.
+        num_workers = max(1, min(sum(beaver), self.max_in_flight))
 
-        local_comp_result = self.process_expression(self.protocol_spec.expr)
+        openings = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix=self.thread_name_prefix)
 
-        # Compute time taken
-        time_taken_processing = timeit.default_timer() - starttime_processing
+        multiplications = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix=self.thread_name_prefix)
 
-        # append our 2nd metric: average time for processing expression
-        # It needs to be corrected for time spent sending & retrieving messages:
-        # (I.) to correct it by the time spent retrieving messages, we can simply
-        #      subtract self.comm.time_spent_retrieving (up to this point in the protocol, 
-        #      the only instances of retrieving messages occur in process_expression, when 
-        #      retrieving a secret share or beaver shares)
-        # (II.) to correct it for the time spent publishing messages during process_expression, we 
-        #       subtract (self.comm.time_spent_sending - time_spent_sending_shares)
-        # maybe all of this is nitpicking, but we want to be precise :)
+        opened: List[Future] = []
 
-        comp_time_processing = (time_taken_processing - self.comm.time_spent_retrieving - (self.comm.time_spent_sending - time_spent_sending_shares))
+        def open_multiplication(gate: MultOp, res1: Share, res2: Share, masks: Future) -> None:
 
-        metrics.update({'comp_time_processing': comp_time_processing})
-        # ***********************************************************
+            try:
 
-        # (III.) Send sum of received shares
+                masks.set_result(self.in_background(self.open_beaver_multiplication, gate, res1, res2))
 
-        # Publish sum of received shares
+            except BaseException as error:
 
-        label_comp_res = f'{self.client_id}-res'
+                masks.set_exception(error)
 
-        comp_res = []  # list which will store
+        def close_multiplication(gate: MultOp, res1: Share, res2: Share, masks: Future) -> Share:
 
-        comp_res.append(local_comp_result)
+            return self.in_background(self.close_beaver_multiplication, gate, res1, res2, *masks.result())
 
-        # message should be bytes or string to conform to communication class API
-        comp_res_to_send = serialize_object(local_comp_result)
+        try:
 
-        self.comm.publish_message(label_comp_res, comp_res_to_send)
+            while True:
 
-        print(
-            f'Client with ID {self.client_id} published the following computation result: {local_comp_result}')
+                while ready:
 
-        # (V). Retrieve the values computed by the others from the TTP
+                    i = ready.popleft()
 
-        for sender_id in self.peer_ids:
+                    gate = gates[i]
 
-            recv_res_label = f'{sender_id}-res'
+                    if isinstance(gate, Secret) and gate not in self.shares_dict:
 
-            message_received = self.comm.retrieve_public_message(
-                sender_id, recv_res_label)
+                        if not waiting_for_inputs:
 
-            # decode from bytes
-            message_decoded = deserialize_object(message_received)
+                            outstanding[self.input_shares] = None
 
-            print(
-                f'Client with id {self.client_id} received computation result: {message_decoded} from participant {sender_id}')
+                        waiting_for_inputs.append(i)
+
+                        continue
+
+                    if beaver[i]:
+
+                        if self.observers:
+
+                            # the multiplications overlap, their position pairs their notifications
+                            self.notify_gate_started(gate, i)
+
+                            self.notify_phase_started("Beaver round", i)
+
+                        res1, res2 = (results[j] for j in operands[i])
+
+                        masks = Future()
+
+                        opened.append(masks)
+
+                        outstanding[multiplications.submit(close_multiplication, gate, res1, res2, masks)] = i
+
+                        openings.submit(open_multiplication, gate, res1, res2, masks)
+
+                    elif self.observers:
+
+                        self.notify_gate_started(gate)
+
+                        share = self.local_gate(gate, [results[j] for j in operands[i]], scalars[i])
+
+                        self.notify_gate_finished(gate)
+
+                        finish(i, share)
+
+                    else:
 
-            # add the received item to the value dict
-            comp_res.append(message_decoded)
+                        finish(i, self.local_gate(gate, [results[j] for j in operands[i]], scalars[i]))
 
-        # (VI). Reconstruct Secret
+                if not outstanding:
 
-        # ***********************************************************
-        # (3) 3rd COMP metric: computation time for reconstructing secret
+                    return results[0]
 
-        # Start timer
-        starttime_reconstruct = timeit.default_timer()
+                # the threads' waits are not counted by the transport as waits of the party, this is (the
+                # time they computed meanwhile is counted by in_background)
+                starttime = timeit.default_timer()
 
-        reconstructed_secret = reconstruct_secret(comp_res)
+                done, _ = wait(outstanding, return_when=FIRST_COMPLETED)
 
-        # Compute time taken
-        time_taken_reconstruct = timeit.default_timer() - starttime_reconstruct
+                self.comm.add_wait("retrieving", timeit.default_timer() - starttime)
 
-        # append our 3rd metric: average time for reconstructing the result
-        metrics.update({'comp_time_reconstruction': time_taken_reconstruct})
+                for future in done:
 
-        # ***********************************************************
+                    i = outstanding.pop(future)
 
-        time_taken_overall = timeit.default_timer() - starttime_overall
+                    if i is None:
 
-        # Again, correct for time spent sending and receiving messages
-        time_taken_overall_corrected = time_taken_overall - (self.comm.time_spent_sending + self.comm.time_spent_retrieving)
+                        self.receive_input_shares()
 
-        # Print how much time was spent waiting for network
-        print(f'Time spent sending: {self.comm.time_spent_sending}, time spent receiving: {self.comm.time_spent_retrieving}')
+                        ready.extend(waiting_for_inputs)
 
-        # append our 4th metric: total time for running this function
-        metrics.update({'runtime_overall': time_taken_overall_corrected})
+                        waiting_for_inputs.clear()
 
-        # (4) Now pull all the communication cost metrics from comm
+                        continue
 
-        metrics.update(
-            {'bytes_sent_smc_party': self.comm.bytes_sent_smc_party})
-        metrics.update(
-            {'bytes_received_smc_party': self.comm.bytes_received_smc_party})
-        metrics.update({'bytes_sent_ttp': self.comm.bytes_sent_ttp})
-        # metrics.update({'bytes_received_ttp': self.comm.bytes_received_ttp})
-        metrics.update({'comp_cost_ttp': self.comm.comp_cost_ttp})
+                    share = future.result()
 
-        return reconstructed_secret, metrics
+                    if self.observers:
+
+                        self.notify_phase_finished("Beaver round", i)
+
+                        self.notify_gate_finished(gates[i], i)
+
+                    finish(i, share)
+
+        finally:
+
+            # on a failure, the multiplications still waiting on the network are stopped by run
+            # (see abort), do not wait for them; those not opened yet give up
+            openings.shutdown(wait=False, cancel_futures=True)
+
+            multiplications.shutdown(wait=False, cancel_futures=True)
+
+            for masks in opened:
+
+                masks.cancel()
+
+    def local_gate(
+        self,
+        expr: Expression,
+        operands: List[Share],
+        scalars: bool
+    ) -> Share:
+        """
+        Share of a gate computed without communication, from the shares of its operands, following
+        the rules of process_gate: only the first participant adds (or subtracts) the scalars.
+        scalars tells whether the gate has only scalars below it.
+        """
+
+        if isinstance(expr, Secret):
+
+            return self.shares_dict[expr]
+
+        if isinstance(expr, Scalar):
+
+            return Share(expr.value)
+
+        res1, res2 = operands
+
+        first = self.client_id == self.protocol_spec.participant_ids[0]
+
+        if isinstance(expr, (AddOp, SubOp)):
+
+            if isinstance(expr.a, Scalar) and isinstance(expr.b, Scalar) and not first:
+
+                return Share(0)
+
+            # (the others' [x] for the scalar minus [x] is +[x], as in process_gate)
+            if isinstance(expr.a, Scalar) and not first:
+
+                return res2
+
+            if isinstance(expr.b, Scalar) and not first:
+
+                return res1
+
+            return res1 + res2 if isinstance(expr, AddOp) else res1 - res2
+
+        # multiplication by scalars
+        if scalars and not first:
+
+            return Share(0)
+
+        return res1 * res2
 
     def process_expression(
         self,
         expr: Expression
     ) -> Share:
 
+        if not self.observers:
+            return self.process_gate(expr)
+
+        self.notify_gate_started(expr)
+
+        share = self.process_gate(expr)
+
+        self.notify_gate_finished(expr)
+
+        return share
+
+    def process_gate(
+        self,
+        expr: Expression
+    ) -> Share:
+
         # if expr is a addition operation:
         if isinstance(expr, AddOp):
 
@@ -619,127 +966,193 @@ class SMCParty:
 
                 print("Using Beaver triplet scheme!")
 
-                # (I) Retrieve beaver triplets from ttp
+                if self.observers:
+                    self.notify_phase_started("Beaver round")
+
+                z_share = self.beaver_multiplication(expr, res1, res2)
+
+                if self.observers:
+                    self.notify_phase_finished("Beaver round")
+
+                return z_share
+
+        # if expr is a secret: its share was kept (own secret) or retrieved (someone else's) by the input sharing
+        if isinstance(expr, Secret):
+
+            if expr not in self.shares_dict:
+
+                self.receive_input_shares()
+
+            return self.shares_dict[expr]
+
+                # if expr is a scalar:
+        if isinstance(expr, Scalar):
+
+            return Share(expr.value)  # ??? slightly unsure about that
+        #
+        # Call specialized methods for each expression type, and have these specialized
+        # methods in turn call `process_expression` on their sub-expressions to process
+        # further.
+
+    def in_background(
+        self,
+        function: Callable[..., Any],
+        *args: Any
+    ) -> Any:
+        """
+        function(*args) on a thread of evaluate, adding the time it computed to worker_compute_time:
+        not the time it waited for the network (as counted by the transport on this thread), nor the
+        time it waited for the interpreter lock or for other threads (its CPU time bounds it).
+        """
+        starttime = timeit.default_timer()
+        cpu_starttime = time.thread_time()
+        time_spent_waiting = self.comm.time_spent_sending + self.comm.time_spent_retrieving
 
-                triplet: Tuple[int, int, int] = self.comm.retrieve_beaver_triplet_shares(
-                    str(self.protocol_spec.expr))
+        result = function(*args)
 
-                a_share: Share = Share(triplet[0])
+        time_spent_waiting = self.comm.time_spent_sending + self.comm.time_spent_retrieving - time_spent_waiting
+        compute_time = min(timeit.default_timer() - starttime - time_spent_waiting, time.thread_time() - cpu_starttime)
+        with self.worker_lock:
+            self.worker_compute_time += compute_time
 
-                b_share: Share = Share(triplet[1])
+        return result
 
-                # '(II): Computate & publish
+    def beaver_multiplication(
+        self,
+        expr: MultOp,
+        res1: Share,
+        res2: Share
+    ) -> Share:
+        """
+        Share of the product of two secret operands (shares res1 and res2) with a Beaver triplet:
+        one round of communication with the ttp and the peers.
+        """
 
-                # (a) compute [x - a], broadcast (public message)
+        return self.close_beaver_multiplication(expr, res1, res2, *self.open_beaver_multiplication(expr, res1, res2))
 
-                x_minus_a: Share = res1 - a_share
+    def open_beaver_multiplication(
+        self,
+        expr: MultOp,
+        res1: Share,
+        res2: Share
+    ) -> Tuple[Tuple[int, int, int], Share, Share]:
+        """
+        First half of beaver_multiplication, which does not wait for the peers: retrieve the triplet
+        and publish [x-a] and [y-b]. Returns the triplet, [x-a] and [y-b].
+        """
 
-                label_x_minus_a = f'{self.client_id}-{expr}-(x-a)'
+        # (I) Retrieve beaver triplets from ttp (unless preprocess already did)
 
-                msg_to_send_x_minus_a = serialize_object(x_minus_a)
+        op_id = self.op_id(expr)
 
-                self.comm.publish_message(
-                    label_x_minus_a, msg_to_send_x_minus_a)
+        if op_id in self.triplets:
 
-                # (b) compute [y - b], broadcast (public message)
+            triplet: Tuple[int, int, int] = self.triplets[op_id]
 
-                y_minus_b: Share = res2 - b_share
+        else:
 
-                label_y_minus_b = f'{self.client_id}-{expr}-(y-b)'
+            triplet = self.comm.retrieve_beaver_triplet_shares(op_id)
 
-                msg_to_send_y_minus_b = serialize_object(y_minus_b)
+        a_share: Share = Share(triplet[0])
 
-                self.comm.publish_message(
-                    label_y_minus_b, msg_to_send_y_minus_b)
+        b_share: Share = Share(triplet[1])
 
-                # (III) Reconstruct (x-a), (x-b) using the published computation results
+        # '(II): Computate & publish
 
-                # retrieve what the other peers have computed
+        # (a) compute [x - a], broadcast (public message)
 
-                x_minus_a_shares = [x_minus_a]
+        x_minus_a: Share = res1 - a_share
 
-                y_minus_b_shares = [y_minus_b]
+        label_x_minus_a = f'{self.client_id}-{expr}-(x-a)'
 
-                for peer in self.peer_ids:
+        msg_to_send_x_minus_a = serialize_object(x_minus_a)
 
-                    # (a) Receive the [x-a] share of this peer
+        self.comm.publish_message(
+            label_x_minus_a, msg_to_send_x_minus_a)
 
-                    recv_res_label_x_minus_a = f'{peer}-{expr}-(x-a)'
+        # (b) compute [y - b], broadcast (public message)
 
-                    message_received_x_minus_a = self.comm.retrieve_public_message(
-                        peer, recv_res_label_x_minus_a)
+        y_minus_b: Share = res2 - b_share
 
-                    # decode from bytes
-                    message_decoded_x_minus_a = deserialize_object(
-                        message_received_x_minus_a)
+        label_y_minus_b = f'{self.client_id}-{expr}-(y-b)'
 
-                    # add the received share to the respective list
-                    x_minus_a_shares.append(message_decoded_x_minus_a)
+        msg_to_send_y_minus_b = serialize_object(y_minus_b)
 
-                    # (b) Receive the [y-b] share of this peer
+        self.comm.publish_message(
+            label_y_minus_b, msg_to_send_y_minus_b)
 
-                    recv_res_label_y_minus_b = f'{peer}-{expr}-(y-b)'
+        return triplet, x_minus_a, y_minus_b
 
-                    message_received_y_minus_b = self.comm.retrieve_public_message(
-                        peer, recv_res_label_y_minus_b)
+    def close_beaver_multiplication(
+        self,
+        expr: MultOp,
+        res1: Share,
+        res2: Share,
+        triplet: Tuple[int, int, int],
+        x_minus_a: Share,
+        y_minus_b: Share
+    ) -> Share:
+        """
+        Second half of beaver_multiplication: retrieve [x-a] and [y-b] of the peers and compute the
+        share of the product.
+        """
 
-                    # decode from bytes
-                    message_decoded_y_minus_b = deserialize_object(
-                        message_received_y_minus_b)
+        # (III) Reconstruct (x-a), (x-b) using the published computation results
 
-                    # add the received share to the respective list
-                    y_minus_b_shares.append(message_decoded_y_minus_b)
+        # retrieve what the other peers have computed
 
-                x_minus_a_reconstructed: int = reconstruct_secret(
-                    x_minus_a_shares)
+        x_minus_a_shares = [x_minus_a]
 
-                y_minus_b_reconstructed: int = reconstruct_secret(
-                    y_minus_b_shares)
+        y_minus_b_shares = [y_minus_b]
 
-                # (IV) Perform computation outlined in handout, with red term only if self.client_id == self.protocol_spec.participant_ids[0]
+        for peer in self.peer_ids:
 
-                z_share = Share(
-                    triplet[2]) + res1 * Share(y_minus_b_reconstructed) + res2 * Share(x_minus_a_reconstructed)
+            # (a) Receive the [x-a] share of this peer
 
-                if self.client_id == self.protocol_spec.participant_ids[0]:
+            recv_res_label_x_minus_a = f'{peer}-{expr}-(x-a)'
 
-                    z_share = z_share - \
-                        Share(x_minus_a_reconstructed) * \
-                        Share(y_minus_b_reconstructed)
+            message_received_x_minus_a = self.comm.retrieve_public_message(
+                peer, recv_res_label_x_minus_a)
 
-                return z_share
+            # decode from bytes
+            message_decoded_x_minus_a = deserialize_object(
+                message_received_x_minus_a)
 
-        # if expr is a secret:
-        if isinstance(expr, Secret):
+            # add the received share to the respective list
+            x_minus_a_shares.append(message_decoded_x_minus_a)
 
-            # (I.) It is a share of one of this participant's own secrets => lookup in self.shares_dict
+            # (b) Receive the [y-b] share of this peer
 
-            if expr in list(self.shares_dict.keys()):
+            recv_res_label_y_minus_b = f'{peer}-{expr}-(y-b)'
 
-                print("Retrieve own value!!")
+            message_received_y_minus_b = self.comm.retrieve_public_message(
+                peer, recv_res_label_y_minus_b)
 
-                return self.shares_dict[expr]
+            # decode from bytes
+            message_decoded_y_minus_b = deserialize_object(
+                message_received_y_minus_b)
 
-            # (II.) It is a share of someone else's secret => retrieve private message from TTP
+            # add the received share to the respective list
+            y_minus_b_shares.append(message_decoded_y_minus_b)
 
-            else:
+        x_minus_a_reconstructed: int = reconstruct_secret(
+            x_minus_a_shares)
 
-                print("Retrieve someone else's value!!")
+        y_minus_b_reconstructed: int = reconstruct_secret(
+            y_minus_b_shares)
 
-                msg_bytes = self.comm.retrieve_private_message(str(expr.id))
+        # (IV) Perform computation outlined in handout, with red term only if self.client_id == self.protocol_spec.participant_ids[0]
 
-                msg_restored = deserialize_object(msg_bytes)
+        z_share = Share(
+            triplet[2]) + res1 * Share(y_minus_b_reconstructed) + res2 * Share(x_minus_a_reconstructed)
 
-                return msg_restored
+        if self.client_id == self.protocol_spec.participant_ids[0]:
 
-                # if expr is a scalar:
-        if isinstance(expr, Scalar):
+            z_share = z_share - \
+                Share(x_minus_a_reconstructed) * \
+                Share(y_minus_b_reconstructed)
 
-            return Share(expr.value)  # ??? slightly unsure about that
-        #
-        # Call specialized methods for each expression type, and have these specialized
-        # methods in turn call `process_expression` on their sub-expressions to process
-        # further.
+        return z_share
 
     # Feel free to add as many methods as you want.
 
@@ -757,4 +1170,67 @@ def scalars_only(expr: Expression):
 
     else:
 
-        return scalars_only(expr.a) and scalars_only(expr.b)
\ No newline at end of file
+        return scalars_only(expr.a) and scalars_only(expr.b)
+
+
+# determine if an expression is a multiplication of two secret operands, which takes a Beaver triplet
+def needs_beaver_triplet(expr: Expression) -> bool:
+
+    return isinstance(expr, MultOp) and not (scalars_only(expr.a) or scalars_only(expr.b))
+
+
+# the multiplications of an expression that need a Beaver triplet, in the order of evaluation of
+# process_expression (a sub-expression occurring twice is evaluated twice)
+def beaver_gates(expr: Expression) -> List[MultOp]:
+
+    if isinstance(expr, (AddOp, SubOp, MultOp)):
+
+        gates = beaver_gates(expr.a) + beaver_gates(expr.b)
+
+        if needs_beaver_triplet(expr):
+
+            gates.append(expr)
+
+        return gates
+
+    return []
+
+
+# number of Beaver multiplications on the longest path from a leaf to the root: the rounds of the
+# dataflow evaluation, whose independent multiplications are outstanding at the same time
+def multiplicative_depth(expr: Expression) -> int:
+
+    if isinstance(expr, (AddOp, SubOp, MultOp)):
+
+        depth = max(multiplicative_depth(expr.a), multiplicative_depth(expr.b))
+
+        if needs_beaver_triplet(expr):
+
+            depth += 1
+
+        return depth
+
+    return 0
+
+
+# the secrets an expression depends on, once each, in the order of evaluation
+def input_secrets(expr: Expression) -> List[Secret]:
+
+    secrets: Dict[Secret, None] = dict()  # ordered set
+
+    pending = [expr]
+
+    while pending:
+
+        node = pending.pop()
+
+        if isinstance(node, Secret):
+
+            secrets[node] = None
+
+        elif not isinstance(node, Scalar):
+
+            # left operand first
+            pending.extend((node.b, node.a))
+
+    return list(secrets)
@@ -0,0 +1,104 @@
+"""
+Tests of the static cost model against the simulation and against a real run.
+"""
+
+import re
+
+import pytest
+
+from cost_model import analyze
+from expression import Scalar, Secret
+from harness import run_processes
+from protocol import ProtocolSpec
+from simulator import simulate
+from smc_party import SMCParty
+
+
+def test_cost_model_matches_simulation():
+    """
+    f(a, b, c, d, e) = ((a + K0) + b ∗ K1 - c) ∗ (d + e) ∗ (a ∗ b)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    david_secret = Secret()
+    elusinia_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2},
+        "David": {david_secret: 5},
+        "Elusinia": {elusinia_secret: 7}
+    }
+
+    expr = (
+        (
+            (alice_secret + Scalar(8)) +
+            ((bob_secret * Scalar(9)) - charlie_secret)
+        ) * (david_secret + elusinia_secret) * (alice_secret * bob_secret)
+    )
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+
+    costs = analyze(prot, parties)
+    _, counts = simulate(prot, parties)
+
+    assert costs['multiplicative_depth'] == 2
+    assert costs['beaver_multiplications'] == 3
+    assert costs['rounds'] == 2 + 2
+    assert costs['sequential_rounds'] == 3 + 2
+    for key in ['triplets_generated', 'triplet_shares_served', 'rounds', 'messages']:
+        assert costs[key] == counts[key]
+    for participant_id, party in counts['parties'].items():
+        assert costs['parties'][participant_id]['messages_sent'] == party['messages_sent']
+        assert costs['parties'][participant_id]['messages_received'] == party['messages_received']
+    assert abs(costs['bytes'] - counts['bytes']) <= 0.05 * counts['bytes']
+
+    # without the owners of the secrets, the totals are the same
+    assert analyze(prot)['messages'] == costs['messages']
+
+
+def test_cost_model_matches_real_run():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+
+    costs = analyze(prot, parties)
+    real = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                         instrumented=True)
+
+    # the three multiplications are one round of the dataflow evaluation, three of process_expression
+    assert all(metrics['rounds'] == costs['rounds'] == 3 for _, metrics in real)
+    sequential = SMCParty("Alice", "localhost", 0, prot, parties["Alice"], dataflow=False)
+    assert sequential.evaluation_rounds() + 2 == costs['sequential_rounds'] == 5
+    for key in ['bytes_sent_smc_party', 'bytes_received_smc_party', 'bytes_sent_ttp']:
+        real_bytes = sum(metrics[key] for _, metrics in real)
+        predicted_bytes = sum(party[key] for party in costs['parties'].values())
+        assert abs(real_bytes - predicted_bytes) <= 0.05 * real_bytes
+
+
+def test_unowned_secret():
+    alice_secret = Secret()
+    orphan_secret = Secret()
+    parties = {"Alice": {alice_secret: 3}, "Bob": {}}
+    prot = ProtocolSpec(expr=alice_secret * orphan_secret, participant_ids=list(parties))
+
+    for model in (analyze, simulate):
+        with pytest.raises(ValueError, match=re.escape(str(orphan_secret.id))):
+            model(prot, parties)
@@ -0,0 +1,58 @@
+"""
+Test of the parallel execution of the repetitions of an experiment.
+"""
+
+import threading
+import time
+
+import harness
+from harness import run_parallel
+
+
+def run_jobs(jobs, concurrency, processes_per_job):
+    """
+    Run jobs that only record the slot they got, the later ones finishing first.
+    """
+    lock = threading.Lock()
+    busy = set()
+    slots = []
+
+    def run_job(job, server, cpus):
+        with lock:
+            # a slot (server) serves one job at a time
+            assert server.port not in busy
+            busy.add(server.port)
+            slots.append((server.port, cpus))
+        time.sleep(0.01 * (len(jobs) - job))
+        with lock:
+            busy.remove(server.port)
+        return job * 10
+
+    results = run_parallel(run_job, jobs, concurrency, processes_per_job)
+    return results, slots
+
+
+def test_results_in_job_order_with_pinning(monkeypatch):
+    monkeypatch.setattr(harness, "usable_cpus", lambda: [0, 1, 2, 3, 4])
+    jobs = list(range(6))
+
+    results, slots = run_jobs(jobs, concurrency=2, processes_per_job=2)
+
+    assert results == [job * 10 for job in jobs]
+    assert len(slots) == len(jobs)
+    cpus_per_port = dict(slots)
+    assert len(cpus_per_port) == 2
+    # every slot has its own cores, always the same ones
+    assert sorted(sorted(cpus) for cpus in cpus_per_port.values()) == [[0, 1], [2, 3]]
+    assert all(cpus == cpus_per_port[port] for port, cpus in slots)
+
+
+def test_results_in_job_order_without_pinning(monkeypatch):
+    monkeypatch.setattr(harness, "usable_cpus", lambda: [0, 1, 2])
+    jobs = list(range(5))
+
+    results, slots = run_jobs(jobs, concurrency=2, processes_per_job=2)
+
+    assert results == [job * 10 for job in jobs]
+    assert len({port for port, _ in slots}) == 2
+    assert all(cpus is None for _, cpus in slots)
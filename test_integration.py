@@ -5,63 +5,11 @@ You can *add* new tests here, but it is best to  add them to a new test file.
 ALL EXISTING TESTS IN THIS SUITE SHOULD PASS WITHOUT ANY MODIFICATION TO THEM.
 """
 
-import time
-from multiprocessing import Process, Queue
-
 import pytest
 
 from expression import Scalar, Secret
+from harness import run_processes
 from protocol import ProtocolSpec
-from server import run
-
-from smc_party import SMCParty
-
-
-def smc_client(client_id, prot, value_dict, queue):
-    cli = SMCParty(
-        client_id,
-        "localhost",
-        5000,
-        protocol_spec=prot,
-        value_dict=value_dict
-    )
-    res = cli.run()
-    queue.put(res)
-    print(f"{client_id} has finished!")
-
-
-def smc_server(args):
-    run("localhost", 5000, args)
-
-
-def run_processes(server_args, *client_args):
-    queue = Queue()
-
-    server = Process(target=smc_server, args=(server_args,))
-    clients = [Process(target=smc_client, args=(*args, queue))
-               for args in client_args]
-
-    server.start()
-    time.sleep(3)
-    for client in clients:
-        client.start()
-
-    results = list()
-    for client in clients:
-        client.join()
-
-    for client in clients:
-        results.append(queue.get())
-
-    server.terminate()
-    server.join()
-
-    # To "ensure" the workers are dead.
-    time.sleep(2)
-
-    print("Server stopped.")
-
-    return results
 
 
 def suite(parties, expr, expected):
@@ -0,0 +1,71 @@
+"""
+Test of the load generator and of the cleanup of the sessions by the relay.
+"""
+
+import pytest
+import requests
+
+import server
+from harness import RelayServer
+from load_generator import parse_mix, percentile, run_load
+from server_metrics import ServerMetrics
+
+
+def test_percentile():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 20) == 1.0
+    assert percentile(values, 50) == 3.0
+    assert percentile(values, 90) == 5.0
+    assert percentile(values, 100) == 5.0
+    assert percentile([7.0], 99) == 7.0
+
+
+def test_parse_mix():
+    assert parse_mix("sum:2,product:0.5,mixed") == {"sum": 2.0, "product": 0.5, "mixed": 1.0}
+    assert parse_mix("product") == {"product": 1.0}
+
+    with pytest.raises(ValueError, match="division"):
+        parse_mix("sum,division:3")
+
+
+def test_finished_sessions_are_dropped(monkeypatch):
+    monkeypatch.setattr(server, "metrics", ServerMetrics())
+    client = server.app.test_client()
+    client.post("/reset", json=[])
+
+    for session in ("first", "second"):
+        client.post("/sessions", json=[f"{session}-Alice", f"{session}-Bob"])
+        client.post(f"/private/{session}-Alice/{session}-Bob/share", data=b"12345")
+        client.post(f"/public/{session}-Bob/{session}-Bob-res", data=b"678")
+        client.get(f"/shares/{session}-Alice/op")
+
+    client.delete("/sessions", json=["first-Alice", "first-Bob"])
+
+    assert client.get("/memory").get_json()['store_entries'] == 2
+    assert client.get("/memory").get_json()['store_bytes'] == 8
+    assert set(server.session_ttps) == {"second-Alice", "second-Bob"}
+
+    # the servers of the next tests are forked from this process: leave them a fresh ttp
+    client.post("/reset", json=[])
+
+
+def test_run_load():
+    relay = RelayServer()
+    relay.start([])
+    try:
+        report = run_load("localhost", relay.port, sessions=4, concurrency=2, num_parties=3,
+                          mix={"sum": 1.0, "product": 1.0}, server_pid=relay.process.pid)
+        memory = requests.get(f"http://localhost:{relay.port}/memory").json()
+    finally:
+        relay.stop()
+
+    assert report['failures'] == 0
+    assert report['sessions_per_sec'] > 0
+    assert report['latency']['p50'] <= report['latency']['p99'] <= report['latency']['max']
+    assert set(report['latency_p99_per_circuit']) <= {"sum", "product"}
+    assert report['server']['cpu_seconds'] > 0
+    # every session dropped its messages once finished
+    assert memory['store_entries'] == 0
+    assert memory['store_bytes'] == 0
@@ -0,0 +1,89 @@
+"""
+Test of the memory accounting of the parties and the server.
+"""
+
+import tracemalloc
+
+from evaluate_performance import suite
+from expression import Secret
+from observers import MemoryObserver
+from protocol import ProtocolSpec
+
+
+def test_memory():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    expected = ((3 * 14) + (14 * 2) + (2 * 3))
+
+    metrics = suite(parties, expr, expected, memory=True)
+
+    for phase in ["overall", "input_sharing", "secret_sharing", "evaluation", "Beaver_round", "result_exchange",
+                  "reconstruction"]:
+        assert metrics[f'memory_peak_{phase}'] >= 0
+        assert f'memory_retained_{phase}' in metrics
+    assert metrics['memory_peak_overall'] >= metrics['memory_peak_evaluation'] > 0
+    assert metrics['memory_expression'] > 0
+    # all messages stay in the store until the next computation
+    assert metrics['memory_server_store_peak'] >= metrics['bytes_sent_smc_party'] * len(parties)
+
+    assert not any(key.startswith('memory_') for key in suite(parties, expr, expected))
+
+
+class Party:
+
+    def __init__(self, protocol_spec):
+        self.protocol_spec = protocol_spec
+
+
+def test_overlapping_runs_share_the_tracing():
+    """
+    Parties running as threads of one process: the first one to finish does not stop the tracing
+    for the others.
+    """
+    alice_secret = Secret()
+    party = Party(ProtocolSpec(expr=alice_secret * alice_secret, participant_ids=["Alice", "Bob"]))
+    first, second = MemoryObserver(), MemoryObserver()
+
+    first.run_started(party)
+    second.run_started(party)
+    second.phase_started(party, "evaluation")
+    first.run_finished(party)
+    assert tracemalloc.is_tracing()
+
+    kept = [bytearray(1000) for _ in range(100)]
+    second.phase_finished(party, "evaluation")
+    second.run_finished(party)
+    assert not tracemalloc.is_tracing()
+
+    assert second.metrics['memory_retained_evaluation'] >= 100 * 1000
+    assert second.metrics['memory_retained_overall'] >= 100 * 1000
+    del kept
+
+
+def test_memory_with_threads():
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    parties = {"Alice": {alice_secret: 3}, "Bob": {bob_secret: 14}, "Charlie": {charlie_secret: 2}}
+
+    metrics = suite(parties, alice_secret * bob_secret + charlie_secret, 3 * 14 + 2, memory=True,
+                    runner="threads")
+
+    assert metrics['memory_peak_overall'] >= metrics['memory_peak_evaluation'] > 0
+    assert not tracemalloc.is_tracing()
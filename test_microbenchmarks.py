@@ -0,0 +1,72 @@
+"""
+Test of the micro-benchmarks and of their comparison with a baseline.
+"""
+
+import json
+
+import microbenchmarks
+from microbenchmarks import LoopbackCommunication, compare, main, synthetic_circuit
+from protocol import ProtocolSpec
+from secret_sharing import Share
+from smc_party import SMCParty
+
+
+def report(ops_per_sec):
+    return {'benchmarks': {name: {'ops_per_sec': value} for name, value in ops_per_sec.items()}}
+
+
+def test_compare():
+    baseline = report({'fast': 1000.0, 'slow': 1000.0, 'steady': 1000.0, 'removed': 1000.0})
+    candidate = report({'fast': 2000.0, 'slow': 850.0, 'steady': 950.0, 'added': 10.0})
+
+    assert compare(candidate, baseline, threshold=0.1) == ['slow']
+    assert compare(candidate, baseline, threshold=0.2) == []
+    assert compare(candidate, baseline, threshold=0.01) == ['slow', 'steady']
+
+
+def test_loopback_evaluation():
+    expr, values, expected = synthetic_circuit(20, 5, 0.5)
+    party = SMCParty("bench", "localhost", 0, ProtocolSpec(["bench"], expr), values,
+                     comm=LoopbackCommunication("bench"))
+    party.peer_ids = []
+    party.shares_dict = {secret: Share(value) for secret, value in values.items()}
+
+    assert party.process_expression(expr).bn == expected
+    assert party.evaluate(expr).bn == expected
+
+
+def test_dataflow_computing_time():
+    expr, values, expected = synthetic_circuit(200, 8, 0.5)
+    for dataflow in (False, True):
+        party = SMCParty("bench", "localhost", 0, ProtocolSpec(["bench"], expr), values,
+                         comm=LoopbackCommunication("bench"), dataflow=dataflow)
+        result, metrics = party.run_instrumented()
+
+        assert result == expected
+        assert {'comp_time_processing', 'runtime_overall', 'runtime_wall_clock'} <= metrics.keys()
+        # only the threads of the dataflow evaluation compute the Beaver multiplications (the times
+        # themselves are compared by the benchmarks)
+        assert (party.worker_compute_time > 0) == dataflow
+
+
+def test_quick_run(tmp_path, monkeypatch):
+    # the circuits only, the small ones of the quick run
+    monkeypatch.setattr(microbenchmarks, "DEFAULT_CIRCUITS", [(10, 4, 0.5), (100, 8, 0.5), (1000, 16, 0.5)])
+    monkeypatch.setattr(microbenchmarks, "primitive_benchmarks", lambda: dict())
+    output = tmp_path / "report.json"
+
+    assert main(["--quick", "--repeat", "1", "--output", str(output)]) == 0
+
+    saved = json.loads(output.read_text())
+    assert sorted(saved['benchmarks']) == [f"{benchmark}[size={size},depth={depth},mult=0.5]"
+                                           for benchmark in ("evaluate", "process_expression", "scalars_only")
+                                           for size, depth in ((10, 4), (100, 8))]
+    assert all(result['ops_per_sec'] > 0 for result in saved['benchmarks'].values())
+
+    # compared with a baseline 10 % or 50 % faster
+    monkeypatch.setattr(microbenchmarks, "run_benchmarks", lambda circuits, repeat: saved)
+    baseline = tmp_path / "baseline.json"
+    for speedup, regression in ((1.1, 0), (1.5, 1)):
+        baseline.write_text(json.dumps(report({name: result['ops_per_sec'] * speedup
+                                               for name, result in saved['benchmarks'].items()})))
+        assert main(["--quick", "--baseline", str(baseline), "--threshold", "0.2"]) == regression
@@ -0,0 +1,48 @@
+"""
+Test of the flame graph of the parties and the server.
+"""
+
+from expression import Secret
+from harness import run_processes
+from protocol import ProtocolSpec
+
+
+def test_profile(tmp_path):
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+    profile = tmp_path / "profile"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            profile=str(profile))
+
+    assert results == [(3 * 14) + (14 * 2) + (2 * 3)] * 3
+
+    stacks = dict(line.rsplit(" ", 1) for line in (tmp_path / "profile.collapsed").read_text().splitlines())
+    assert all(int(weight) > 0 for weight in stacks.values())
+    participants = {stack.split(";")[0] for stack in stacks}
+    assert participants == {"Alice", "Bob", "Charlie", "server"}
+    # the stacks of the parties are grouped by phase, those of the server by route
+    assert any(stack.startswith("Alice;evaluation;") for stack in stacks)
+    # the Beaver multiplications run on the background threads of the parties
+    assert any("beaver_multiplication" in stack for stack in stacks if stack.startswith("Alice;"))
+    routes = {"send_private_message", "retrieve_private_message", "publish_message", "retrieve_public_message",
+              "retrieve_share"}
+    assert all(stack.split(";")[1] in routes for stack in stacks if stack.startswith("server;"))
+    assert (tmp_path / "profile.svg").read_text().startswith("<svg")
@@ -0,0 +1,64 @@
+"""
+Tests of the benchmark results store and of its regression detection.
+"""
+
+from results_store import ResultsStore, compare_runs, group_by_configuration, metric_kind
+
+
+def repetitions(num_participants, server_time, comp_time_processing=0.01, count=8):
+    return [{'num_participants': num_participants, 'iteration': i, 'comp_time_processing': comp_time_processing,
+             'server_time': server_time + 0.001 * i, 'bytes_sent_smc_party': 850}
+            for i in range(count)]
+
+
+def test_timings_are_metrics():
+    for name in ['comp_time_processing', 'runtime_overall', 'server_time', 'ttp_time']:
+        assert metric_kind(name) == "compute time"
+    assert list(group_by_configuration(repetitions(3, 0.05))) == ['{"num_participants": 3}']
+
+
+def test_runs_of_the_same_suite_are_compared(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    baseline = store.record_run("num_participants", repetitions(3, 0.05))
+    candidate = store.record_run("num_participants", repetitions(3, 0.08))
+
+    comparisons = compare_runs(store.results(baseline), store.results(candidate))
+    store.close()
+
+    assert {comparison['metric'] for comparison in comparisons} == \
+        {'comp_time_processing', 'server_time', 'bytes_sent_smc_party'}
+    regressions = {comparison['metric'] for comparison in comparisons if comparison['regression']}
+    assert regressions == {'server_time'}
+
+
+def test_bytes_tolerate_noise():
+    baseline = [{'num_participants': 3, 'bytes_sent_smc_party': 810 + 10 * (i % 10), 'rounds': 3}
+                for i in range(10)]
+    noisy = [dict(metrics, bytes_sent_smc_party=metrics['bytes_sent_smc_party'] + 5) for metrics in baseline]
+    larger = [dict(metrics, bytes_sent_smc_party=metrics['bytes_sent_smc_party'] * 2) for metrics in baseline]
+    more_rounds = [dict(metrics, rounds=4) for metrics in baseline]
+
+    def regressions(candidate):
+        return {comparison['metric'] for comparison in compare_runs(baseline, candidate) if comparison['regression']}
+
+    assert regressions(noisy) == set()
+    assert regressions(larger) == {'bytes_sent_smc_party'}
+    assert regressions(more_rounds) == {'rounds'}
+
+
+def test_record_and_list_runs(tmp_path, capsys):
+    from results_store import main
+
+    path = str(tmp_path / "results.sqlite")
+    store = ResultsStore(path)
+    baseline = store.record_run("num_participants", repetitions(3, 0.05))
+    candidate = store.record_run("num_participants", repetitions(3, 0.05, comp_time_processing=0.1))
+    assert [run['run_id'] for run in store.runs("num_participants")] == [baseline, candidate]
+    assert store.runs("other") == []
+    assert store.results(baseline) == repetitions(3, 0.05)
+    store.close()
+
+    assert main(["--db", path, "list"]) == 0
+    assert main(["--db", path, "compare", str(baseline), str(baseline)]) == 0
+    assert main(["--db", path, "compare", str(baseline), str(candidate)]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
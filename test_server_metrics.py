@@ -0,0 +1,39 @@
+"""
+Test of the metrics served by the relay.
+"""
+
+import server
+from server_metrics import ServerMetrics
+
+
+def sample(text, line_start):
+    return float(next(line for line in text.splitlines() if line.startswith(line_start)).split()[-1])
+
+
+def test_metrics(monkeypatch):
+    monkeypatch.setattr(server, "metrics", ServerMetrics())
+    client = server.app.test_client()
+    client.post("/reset", json=["Alice", "Bob"])
+
+    client.get("/private/Bob/share")  # not there yet
+    client.get("/private/Bob/share")
+    client.post("/private/Alice/Bob/share", data=b"12345")
+    client.get("/private/Bob/share")
+    client.get("/shares/Alice/op")
+    client.get("/shares/Bob/op")
+
+    text = client.get("/metrics").get_data(as_text=True)
+
+    route = '{route="retrieve_private_message"}'
+    assert sample(text, f"smc_relay_poll_misses_total{route}") == 2
+    assert sample(text, f"smc_relay_poll_hits_total{route}") == 1
+    assert sample(text, f"smc_relay_poll_miss_ratio{route}") == 2
+    assert sample(text, 'smc_relay_store_entries{pool="private"}') == 1
+    assert sample(text, 'smc_relay_store_bytes{pool="private"}') == 5
+    assert sample(text, "smc_relay_triplets_generated_total") == 1
+    assert sample(text, "smc_relay_triplet_shares_served_total") == 2
+    assert sample(text, 'smc_relay_request_duration_seconds_count{route="retrieve_private_message"}') == 3
+    assert sample(text, 'smc_relay_request_duration_seconds_bucket{route="retrieve_private_message",le="+Inf"}') == 3
+
+    # the servers of the next tests are forked from this process: leave them a fresh ttp
+    client.post("/reset", json=[])
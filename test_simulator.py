@@ -0,0 +1,157 @@
+"""
+Tests of the lockstep simulation against the expected results and against real runs.
+"""
+
+from cost_model import analyze
+from expression import Scalar, Secret
+from harness import run_processes
+from protocol import ProtocolSpec
+from simulator import SHARE_ENVELOPE_LENGTH, simulate
+
+
+def test_simulation_results():
+    """
+    f(a, b, c, d, e) = ((a + K0) + b ∗ K1 - c) ∗ (d + e)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    david_secret = Secret()
+    elusinia_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2},
+        "David": {david_secret: 5},
+        "Elusinia": {elusinia_secret: 7}
+    }
+
+    expr = (
+        (
+            (alice_secret + Scalar(8)) +
+            ((bob_secret * Scalar(9)) - charlie_secret)
+        ) * (david_secret + elusinia_secret)
+    )
+    expected = (((3 + 8) + (14 * 9) - 2) * (5 + 7))
+
+    result, counts = simulate(ProtocolSpec(expr=expr, participant_ids=list(parties)), parties)
+
+    assert result == expected
+    assert counts['triplets_generated'] == 1
+    assert counts['triplet_shares_served'] == 5
+    assert counts['rounds'] == 3
+    # inputs: 5 secrets to 4 peers; one opening of x-a and y-b, one of the result: 3 per party
+    assert counts['messages'] == 5 * 4 + 3 * 5
+    # every party but the owner retrieves each of the 5 secrets once, and the 3 openings
+    assert all(party['messages_received'] == 4 + 3 * 4 for party in counts['parties'].values())
+
+
+def test_simulation_matches_real_run():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+
+    result, counts = simulate(prot, parties)
+    real = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                         instrumented=True)
+
+    assert all(real_result == result for real_result, _ in real)
+    assert all(metrics['rounds'] == counts['rounds'] for _, metrics in real)
+
+    # The sizes depend on the number of digits of the random shares, so they only match closely.
+    for key in ['bytes_sent_smc_party', 'bytes_received_smc_party', 'bytes_sent_ttp']:
+        real_bytes = sum(metrics[key] for _, metrics in real)
+        simulated_bytes = sum(party[key] for party in counts['parties'].values())
+        assert abs(real_bytes - simulated_bytes) <= 0.05 * real_bytes
+
+    # server.py accounts for the HTTP overhead as well: headers and the polls missing their message
+    for _, metrics in real:
+        assert metrics['wire_bytes_sent_smc_party'] > metrics['bytes_sent_smc_party']
+        assert metrics['wire_bytes_received_smc_party'] > metrics['bytes_received_smc_party'] + metrics['bytes_sent_ttp']
+        assert metrics['server_time'] > 0
+        assert metrics['ttp_time'] is not None
+
+
+def test_unreferenced_secrets_are_not_shared():
+    """
+    f(a, b) = a + b, Alice and Charlie also hold secrets the expression does not use
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3, Secret(): 5},
+        "Bob": {bob_secret: 14},
+        "Charlie": {Secret(): 2}
+    }
+
+    prot = ProtocolSpec(expr=alice_secret + bob_secret, participant_ids=list(parties))
+
+    result, counts = simulate(prot, parties)
+    real = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                         instrumented=True)
+
+    assert result == 3 + 14
+    assert all(real_result == result for real_result, _ in real)
+    # Alice and Bob send a share of their secret to 2 peers, everybody publishes the result share
+    assert [party['messages_sent'] for party in counts['parties'].values()] == [3, 3, 1]
+    for _, metrics in real:
+        assert metrics['bytes_sent_smc_party'] < 4 * SHARE_ENVELOPE_LENGTH
+
+
+def test_output_parties():
+    """
+    f(a, b, c) = a ∗ b + c, only Alice reconstructs the result (and, with broadcast, publishes it)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+    expr = alice_secret * bob_secret + charlie_secret
+
+    for broadcast in (False, True):
+        prot = ProtocolSpec(expr=expr, participant_ids=list(parties), output_ids=["Alice"], broadcast=broadcast)
+
+        result, counts = simulate(prot, parties)
+        real = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                             instrumented=True)
+
+        assert result == 3 * 14 + 2
+        real_results = [real_result for real_result, _ in real]
+        assert real_results.count(result) == (3 if broadcast else 1)
+        assert real_results.count(None) == (0 if broadcast else 2)
+        assert analyze(prot, parties)['messages'] == counts['messages']
+
+        # Bob and Charlie retrieve 2 input shares and 4 openings (plus the broadcast result), Alice also
+        # the 2 result shares
+        simulated = counts['parties']
+        assert simulated['Alice']['messages_received'] == 8
+        assert simulated['Bob']['messages_received'] == simulated['Charlie']['messages_received'] == 6 + broadcast
+        assert simulated['Alice']['messages_sent'] == 5 + broadcast
+
+        for key in ['bytes_sent_smc_party', 'bytes_received_smc_party']:
+            real_bytes = sum(metrics[key] for _, metrics in real)
+            simulated_bytes = sum(party[key] for party in simulated.values())
+            assert abs(real_bytes - simulated_bytes) <= 0.05 * real_bytes
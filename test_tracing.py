@@ -0,0 +1,312 @@
+"""
+Test of the Chrome trace recorded by the parties and the server.
+"""
+
+import json
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import pytest
+
+from communication import Communication
+from expression import Scalar, Secret
+from harness import run_processes, shared_server
+from network_emulation import LinkConditions, NetworkEmulation
+from observers import MemoryObserver, Observer
+from profiling import Profiler
+from protocol import ProtocolSpec
+from secret_sharing import get_prime
+from smc_party import SMCParty
+from tracing import Tracer, TracingCommunication
+
+
+def async_spans(events, pid, name):
+    """
+    (start, end) of the async spans of a participant with this name, per ID.
+    """
+    spans = dict()
+    for event in events:
+        if event['pid'] == pid and event['name'] == name and event['ph'] in ('b', 'e'):
+            spans.setdefault(event['id'], dict())[event['ph']] = event['ts']
+    return {key: (span['b'], span['e']) for key, span in spans.items()}
+
+
+def test_trace(tmp_path):
+    """
+    f(a, b, c) = (a ∗ b + c) ∗ K1 + K2
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (alice_secret * bob_secret + charlie_secret) * Scalar(5) + Scalar(7)
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+    trace = tmp_path / "trace.json"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            trace=str(trace))
+    assert results == [(3 * 14 + 2) * 5 + 7] * 3
+
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['pid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    assert sorted(names.values()) == ["Alice", "Bob", "Charlie", "server"]
+
+    for pid, name in names.items():
+        spans = [event for event in events if event['ph'] == 'X' and event['pid'] == pid]
+        if name == "server":
+            assert {span['name'] for span in spans} >= {"send_private_message", "publish_message", "retrieve_share"}
+            continue
+        # phases in the order they finished; the Beaver rounds may overlap, they are async spans
+        assert [span['name'] for span in spans if span['cat'] == 'phase'] == \
+            ["secret sharing", "input sharing", "evaluation", "result exchange", "reconstruction"]
+        assert len(async_spans(events, pid, "Beaver round")) == 1
+        assert len([span for span in spans if span['name'] == 'retrieve_beaver_triplet_shares']) == 1
+
+
+def test_input_shares_sent_concurrently(tmp_path):
+    """
+    With 100 ms to the relay, sending 4 shares to each of 2 peers one after the other would take 1.6 s.
+    """
+    parties = {name: {Secret(): value for value in range(1, 5)} for name in ("Alice", "Bob", "Charlie")}
+    expr = Scalar(0)
+    for value_dict in parties.values():
+        for secret in value_dict:
+            expr = expr + secret
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+    trace = tmp_path / "trace.json"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            network=NetworkEmulation(default=LinkConditions(latency=0.1)), trace=str(trace))
+    assert results == [3 * (1 + 2 + 3 + 4)] * 3
+
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['pid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    for pid, name in names.items():
+        if name == "server":
+            continue
+        sends = [event for event in events if event['pid'] == pid and event['name'] == 'send_private_message']
+        assert len(sends) == 8
+        # microseconds from the first send to the last acknowledgement: about one round trip
+        assert max(send['ts'] + send['dur'] for send in sends) - min(send['ts'] for send in sends) < 0.8e6
+
+
+class SilentCommunication(Communication):
+    """
+    Transport to peers that never send anything.
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+        self.poll_delay = 0.01
+        self._init_metrics()
+
+    def send_private_message(self, receiver_id: str, label: str, message: bytes) -> None:
+        pass
+
+    def retrieve_private_messages(self, labels: List[str]) -> Dict[str, bytes]:
+        while True:
+            self.wait_poll_delay()
+
+
+class FailingObserver(Observer):
+
+    def phase_started(self, party, phase, key=None):
+        if phase == "evaluation":
+            raise RuntimeError("evaluation failed")
+
+
+def test_failed_run_stops_input_sharing():
+    """
+    A party failing during the evaluation gives up retrieving the input shares instead of polling forever.
+    """
+    alice_secret, bob_secret = Secret(), Secret()
+    prot = ProtocolSpec(expr=alice_secret * bob_secret, participant_ids=["Alice", "Bob"])
+    memory, profiler = MemoryObserver(), Profiler("Alice")
+    party = SMCParty("Alice", "localhost", 0, prot, {alice_secret: 3},
+                     comm=SilentCommunication("Alice"), observers=[memory, profiler, FailingObserver()])
+
+    with pytest.raises(RuntimeError, match="evaluation failed"):
+        party.run()
+
+    assert party.input_pool is None
+    assert isinstance(party.input_shares.exception(timeout=1), ConnectionAbortedError)
+    # the observers stopped what they started
+    assert not tracemalloc.is_tracing()
+    assert not profiler.sampler.thread.is_alive()
+    assert 'memory_peak_input_sharing' in memory.metrics
+
+
+def test_independent_multiplications_overlap(tmp_path):
+    """
+    f(a, b, c, d) = a ∗ b + c ∗ d + a ∗ d + b ∗ c: four Beaver rounds, of multiplicative depth 1.
+    """
+    a, b, c, d = Secret(), Secret(), Secret(), Secret()
+    parties = {"Alice": {a: 3, b: 5}, "Bob": {c: 7}, "Charlie": {d: 11}}
+    prot = ProtocolSpec(expr=a * b + c * d + a * d + b * c, participant_ids=list(parties))
+    trace = tmp_path / "trace.json"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            network=NetworkEmulation(default=LinkConditions(latency=0.05)), trace=str(trace))
+    assert results == [3 * 5 + 7 * 11 + 3 * 11 + 5 * 7] * 3
+
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['pid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    for pid, name in names.items():
+        if name == "server":
+            continue
+        rounds = async_spans(events, pid, "Beaver round").values()
+        assert len(rounds) == 4
+        # the rounds are outstanding at the same time rather than one after the other
+        assert max(start for start, _ in rounds) < min(end for _, end in rounds)
+
+
+class ThreadCounter(Observer):
+    """
+    Most background threads the party had at the start of a gate.
+    """
+
+    def __init__(self):
+        self.most = 0
+
+    def gate_started(self, party, expr, key=None):
+        self.most = max(self.most, len(party.threads()))
+
+
+def test_multiplications_in_flight():
+    """
+    f = the sum of the 15 products of two of six secrets, spread over the parties, and one product of
+    products: the multiplications run max_in_flight at a time, without a thread each and without the
+    parties waiting on each other in a circle.
+    """
+    secrets = [Secret() for _ in range(6)]
+    values = [3, 5, 7, 11, 13, 17]
+    parties = {"Alice": {secrets[0]: values[0], secrets[3]: values[3]},
+               "Bob": {secrets[1]: values[1], secrets[4]: values[4]},
+               "Charlie": {secrets[2]: values[2], secrets[5]: values[5]}}
+    expr = (secrets[0] * secrets[1]) * (secrets[2] * secrets[3])
+    expected = values[0] * values[1] * values[2] * values[3]
+    for i in range(6):
+        for j in range(i + 1, 6):
+            expr = expr + secrets[i] * secrets[j]
+            expected += values[i] * values[j]
+    prot = ProtocolSpec(expr=expr, participant_ids=list(parties))
+
+    server = shared_server()
+    server.reset(list(parties))
+    counters = {name: ThreadCounter() for name in parties}
+    smc_parties = [SMCParty(name, server.host, server.port, prot, value_dict, max_in_flight=2,
+                            observers=[counters[name]])
+                   for name, value_dict in parties.items()]
+    with ThreadPoolExecutor(max_workers=len(smc_parties)) as pool:
+        results = list(pool.map(SMCParty.run, smc_parties))
+
+    assert results == [expected % get_prime()] * 3
+    # the input sharing (max_in_flight + 1), the openings and the rounds of the multiplications
+    assert all(0 < counter.most <= 3 + 2 + 2 for counter in counters.values())
+
+
+def test_overlapping_round_durations(tmp_path):
+    """
+    f(a, b, c, d, e) = (a ∗ b) ∗ c + d ∗ e: the rounds of a ∗ b and d ∗ e overlap, the one of (a ∗ b) ∗ c
+    follows the one of a ∗ b. Every round is one round trip of the evaluation, which takes two.
+    """
+    a, b, c, d, e = Secret(), Secret(), Secret(), Secret(), Secret()
+    parties = {"Alice": {a: 3, d: 5}, "Bob": {b: 7, e: 2}, "Charlie": {c: 11}}
+    prot = ProtocolSpec(expr=(a * b) * c + d * e, participant_ids=list(parties))
+    trace = tmp_path / "trace.json"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            network=NetworkEmulation(default=LinkConditions(latency=0.05)), trace=str(trace))
+    assert results == [3 * 7 * 11 + 5 * 2] * 3
+
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['pid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    for pid, name in names.items():
+        if name == "server":
+            continue
+        evaluation = next(event for event in events
+                          if event['pid'] == pid and event['ph'] == 'X' and event['name'] == 'evaluation')
+        rounds = async_spans(events, pid, "Beaver round")
+        gates = async_spans(events, pid, "MultOp")
+        assert len(rounds) == 3 and rounds.keys() == gates.keys()
+        for key, (start, end) in rounds.items():
+            assert 0 < end - start < 0.75 * evaluation['dur']
+            # the gate of the round spans it
+            assert gates[key][0] <= start and end <= gates[key][1]
+        # the last round waited for the first one
+        first, second, last = sorted(rounds.values())
+        assert last[0] >= min(first[1], second[1])
+
+
+def test_preprocessed_triplets(tmp_path):
+    """
+    With the triplets retrieved ahead of time, the evaluation does not talk to the ttp.
+    """
+    a, b, c = Secret(), Secret(), Secret()
+    parties = {"Alice": {a: 3}, "Bob": {b: 14}, "Charlie": {c: 2}}
+    prot = ProtocolSpec(expr=a * b * c + a * c, participant_ids=list(parties))
+    trace = tmp_path / "trace.json"
+
+    results = run_processes(list(parties), *((name, prot, value_dict) for name, value_dict in parties.items()),
+                            trace=str(trace), preprocess=True)
+    assert results == [3 * 14 * 2 + 3 * 2] * 3
+
+    events = json.loads(trace.read_text())['traceEvents']
+    names = {event['pid']: event['args']['name'] for event in events if event['ph'] == 'M'}
+    for pid, name in names.items():
+        if name == "server":
+            continue
+        spans = {event['name']: event for event in events if event['pid'] == pid and event['ph'] == 'X'}
+        assert len([event for event in events
+                    if event['pid'] == pid and event['name'] == 'retrieve_beaver_triplet_shares']) == 1
+        assert spans['retrieve_beaver_triplet_shares']['ts'] + spans['retrieve_beaver_triplet_shares']['dur'] <= \
+            spans['input sharing']['ts']
+
+
+def test_waits_through_wrappers():
+    """
+    The waits counted through a wrapped transport are those of the transport, of the calling thread.
+    """
+    inner = SilentCommunication("Alice")
+    comm = TracingCommunication(NetworkEmulation().wrap(inner), Tracer("Alice"))
+
+    comm.add_wait("retrieving", 1.0)
+    inner.add_wait("retrieving", 4.0)
+    comm.add_wait("sending", 0.5)
+
+    assert comm.time_spent_retrieving == inner.time_spent_retrieving == 5.0
+    assert comm.time_spent_sending == inner.time_spent_sending == 0.5
+    assert "time_spent_retrieving" not in vars(comm) and "time_spent_retrieving" not in vars(comm.comm)
+
+    waits = []
+    thread = threading.Thread(target=lambda: waits.append(comm.time_spent_retrieving))
+    thread.start()
+    thread.join()
+    assert waits == [0]
+
+    with pytest.raises(ValueError, match="computing"):
+        comm.add_wait("computing", 1.0)
+
+
+def test_emulated_link_is_shared():
+    """
+    Messages on the link of a party at the same time (e.g. sent by several of its threads) share its bandwidth.
+    """
+    comm = NetworkEmulation(default=LinkConditions(bandwidth=1e5)).wrap(SilentCommunication("Alice"))
+
+    # 10 ms each on their own: every one waits for those before it, in its direction only
+    delays = [comm.transmission_delay("up", 1000) for _ in range(4)]
+    assert delays == pytest.approx([0.01, 0.02, 0.03, 0.04], abs=0.002)
+    assert comm.transmission_delay("down", 1000) == pytest.approx(0.01, abs=0.002)
+
+    # a message sent now waits for the rest of the four (40 ms from their start)
+    comm.send_private_message("Bob", "label", b"x" * 1000)
+    assert comm.time_spent_sending > 0.02
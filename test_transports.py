@@ -0,0 +1,391 @@
+"""
+Integration tests running the protocol over the alternative transports.
+"""
+
+import functools
+import queue as queue_module
+import threading
+from multiprocessing import Process, Queue
+
+import pytest
+
+from communication import MAX_IDLE_CONNECTIONS, BinaryCommunication, Communication
+from expression import Scalar, Secret
+from protocol import ProtocolSpec
+from smc_party import SMCParty
+
+import binary_server
+import mesh_communication
+from relay_benchmark import relay_worker
+from harness import free_port, run_threads, wait_for_port
+import server
+import shared_memory_communication
+
+
+def binary_client(client_id, prot, value_dict, port, queue):
+    cli = SMCParty(
+        client_id,
+        "localhost",
+        port,
+        protocol_spec=prot,
+        value_dict=value_dict,
+        comm=BinaryCommunication("localhost", port, client_id)
+    )
+    queue.put(cli.run())
+
+
+def run_processes_binary(server_args, *client_args):
+    port = free_port()
+    queue = Queue()
+
+    server = Process(target=binary_server.run, args=("localhost", port, server_args))
+    clients = [Process(target=binary_client, args=(*args, port, queue))
+               for args in client_args]
+
+    server.start()
+    wait_for_port("localhost", port)
+    for client in clients:
+        client.start()
+
+    results = [queue.get() for _ in clients]
+
+    for client in clients:
+        client.join()
+
+    server.terminate()
+    server.join()
+
+    return results
+
+
+def sharded_client(client_id, prot, value_dict, relays, queue):
+    host, port = relays[0]
+    cli = SMCParty(
+        client_id,
+        host,
+        port,
+        protocol_spec=prot,
+        value_dict=value_dict,
+        comm=Communication(host, port, client_id, poll_delay=0.05, relays=relays)
+    )
+    queue.put(cli.run())
+
+
+def run_processes_sharded(server_args, *client_args, num_shards=3):
+    relays = [("localhost", free_port()) for _ in range(num_shards)]
+    queue = Queue()
+
+    servers = [Process(target=server.run, args=(host, port, server_args)) for host, port in relays]
+    clients = [Process(target=sharded_client, args=(*args, relays, queue))
+               for args in client_args]
+
+    for shard in servers:
+        shard.start()
+    for host, port in relays:
+        wait_for_port(host, port)
+    for client in clients:
+        client.start()
+
+    results = [queue.get() for _ in clients]
+
+    for client in clients:
+        client.join()
+    for shard in servers:
+        shard.terminate()
+        shard.join()
+
+    return results
+
+
+def suite(run_processes, parties, expr, expected):
+    participants = list(parties.keys())
+
+    prot = ProtocolSpec(expr=expr, participant_ids=participants)
+    clients = [(name, prot, value_dict)
+               for name, value_dict in parties.items()]
+
+    results = run_processes(participants, *clients)
+
+    assert len(results) == len(parties)
+    for result in results:
+        assert result == expected
+
+
+def test_shared_memory_additions():
+    """
+    f(a, b, c) = (a + b + c) + K
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = ((alice_secret + bob_secret + charlie_secret) + Scalar(5))
+    expected = (3 + 14 + 2) + 5
+    suite(shared_memory_communication.run_processes, parties, expr, expected)
+
+
+def test_shared_memory_multiplications():
+    """
+    f(a, b, c, d, e) = ((a + K0) + b ∗ K1 - c) ∗ (d + e)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    david_secret = Secret()
+    elusinia_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2},
+        "David": {david_secret: 5},
+        "Elusinia": {elusinia_secret: 7}
+    }
+
+    expr = (
+        (
+            (alice_secret + Scalar(8)) +
+            ((bob_secret * Scalar(9)) - charlie_secret)
+        ) * (david_secret + elusinia_secret)
+    )
+    expected = (((3 + 8) + (14 * 9) - 2) * (5 + 7))
+    suite(shared_memory_communication.run_processes, parties, expr, expected)
+
+
+def test_shared_memory_both_inboxes_full():
+    """
+    Two parties sending each other more than fits into their inboxes before retrieving anything.
+    """
+    network = shared_memory_communication.SharedMemoryNetwork(["Alice", "Bob"], inbox_size=256)
+    comms = {name: network.communication(name, poll_delay=0.01, send_timeout=10) for name in ("Alice", "Bob")}
+    received = dict()
+
+    def exchange(client_id, peer_id):
+        for i in range(50):
+            comms[client_id].send_private_message(peer_id, f"msg-{i}", f"{client_id}-{i}")
+        received[client_id] = [comms[client_id].retrieve_private_message(f"msg-{i}") for i in range(50)]
+
+    threads = [threading.Thread(target=exchange, args=pair, daemon=True) for pair in (("Alice", "Bob"), ("Bob", "Alice"))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        assert received == {"Alice": [f"Bob-{i}".encode() for i in range(50)],
+                            "Bob": [f"Alice-{i}".encode() for i in range(50)]}
+
+        # nobody drains the inbox of Bob any more
+        while True:
+            try:
+                network.inboxes["Bob"].write(b"x" * 16, timeout=0)
+            except TimeoutError:
+                break
+        with pytest.raises(TimeoutError, match="Bob"):
+            network.communication("Alice", poll_delay=0.01, send_timeout=0.1).send_private_message("Bob", "late", b"x")
+    finally:
+        network.close()
+
+
+def test_mesh_additions():
+    """
+    f(a, b, c) = (a + b + c) + K
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = ((alice_secret + bob_secret + charlie_secret) + Scalar(5))
+    expected = (3 + 14 + 2) + 5
+    suite(mesh_communication.run_processes, parties, expr, expected)
+
+
+def test_mesh_multiplications():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    expected = ((3 * 14) + (14 * 2) + (2 * 3))
+    suite(mesh_communication.run_processes, parties, expr, expected)
+
+
+def test_binary_server():
+    """
+    f(a, b, c, d, e) = ((a + K0) + b ∗ K1 - c) ∗ (d + e)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    david_secret = Secret()
+    elusinia_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2},
+        "David": {david_secret: 5},
+        "Elusinia": {elusinia_secret: 7}
+    }
+
+    expr = (
+        (
+            (alice_secret + Scalar(8)) +
+            ((bob_secret * Scalar(9)) - charlie_secret)
+        ) * (david_secret + elusinia_secret)
+    )
+    expected = (((3 + 8) + (14 * 9) - 2) * (5 + 7))
+    suite(run_processes_binary, parties, expr, expected)
+
+
+def test_binary_connections_reused():
+    """
+    The requests of short-lived threads reuse the idle connections instead of keeping one per thread open.
+    """
+    port = free_port()
+    server = Process(target=binary_server.run, args=("localhost", port, ["Alice"]))
+    server.start()
+    try:
+        wait_for_port("localhost", port)
+        comm = BinaryCommunication("localhost", port, "Alice")
+        retrieved = []
+
+        def publish_and_retrieve(i):
+            comm.publish_message(f"label-{i}", f"message-{i}")
+            retrieved.append(comm.retrieve_public_message("Alice", f"label-{i}"))
+
+        for batch in range(5):
+            threads = [threading.Thread(target=publish_and_retrieve, args=(batch * 20 + i,)) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert sorted(retrieved) == sorted(f"message-{i}".encode("utf-8") for i in range(100))
+        assert len(comm.sockets) <= MAX_IDLE_CONNECTIONS
+        comm.stop()
+    finally:
+        server.terminate()
+        server.join()
+
+
+def test_binary_relay_equivalence():
+    """
+    The workers of relay_benchmark.py exchange the same messages through binary_server.py as through
+    server.py (their throughputs are compared by the benchmark itself).
+    """
+    reports = []
+    for relay in (server.run, binary_server.run):
+        port = free_port()
+        process = Process(target=relay, args=("localhost", port, []))
+        process.start()
+        try:
+            wait_for_port("localhost", port)
+            queue = queue_module.Queue()
+            relay_worker(0, [("localhost", port)], 50, queue, binary=relay is binary_server.run)
+            reports.append(queue.get())
+        finally:
+            process.terminate()
+            process.join()
+
+    (http_messages, _, *http_bytes), (binary_messages, _, *binary_bytes) = reports
+    assert http_messages == binary_messages == 100
+    assert http_bytes == binary_bytes == [50 * 64, 50 * 64]
+
+
+def test_sharded_relay():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    expected = ((3 * 14) + (14 * 2) + (2 * 3))
+    suite(run_processes_sharded, parties, expr, expected)
+
+
+def test_threads():
+    """
+    f(a, b, c) = (a ∗ b) + (b ∗ c) + (c ∗ a)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2}
+    }
+
+    expr = (
+        (alice_secret * bob_secret) +
+        (bob_secret * charlie_secret) +
+        (charlie_secret * alice_secret)
+    )
+    expected = ((3 * 14) + (14 * 2) + (2 * 3))
+    suite(run_threads, parties, expr, expected)
+
+
+def test_threads_worker_pool():
+    """
+    f(a, b, c, d, e) = ((a + K0) + b ∗ K1 - c) ∗ (d + e)
+    """
+    alice_secret = Secret()
+    bob_secret = Secret()
+    charlie_secret = Secret()
+    david_secret = Secret()
+    elusinia_secret = Secret()
+
+    parties = {
+        "Alice": {alice_secret: 3},
+        "Bob": {bob_secret: 14},
+        "Charlie": {charlie_secret: 2},
+        "David": {david_secret: 5},
+        "Elusinia": {elusinia_secret: 7}
+    }
+
+    expr = (
+        (
+            (alice_secret + Scalar(8)) +
+            ((bob_secret * Scalar(9)) - charlie_secret)
+        ) * (david_secret + elusinia_secret)
+    )
+    expected = (((3 + 8) + (14 * 9) - 2) * (5 + 7))
+    suite(functools.partial(run_threads, num_workers=2), parties, expr, expected)
@@ -0,0 +1,198 @@
+"""
+Tracing of the protocol phases, exportable as a Chrome trace.
+
+A `Tracer` records nested spans (a name, a category, a start and a duration) for one participant:
+a party (as an observer: the phases of the protocol, see observers.py, and the evaluation of
+every gate; through `TracingCommunication`: every transport call) or the server (every
+request). The spans of all participants are merged into one timeline with `write_chrome_trace`, which can be opened in
+chrome://tracing or https://ui.perfetto.dev to see the critical path and the waiting times
+across the parties.
+
+Example:
+>>> tracer = Tracer("Alice")
+>>> party = SMCParty("Alice", "localhost", 5000, protocol_spec=prot, value_dict=values, observers=[tracer])
+>>> party.comm = TracingCommunication(party.comm, tracer)
+>>> party.run()
+>>> write_chrome_trace("trace.json", {"Alice": tracer.events})
+"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple, Union
+
+from communication import Communication
+from expression import Expression
+from observers import Observer
+
+
+def now() -> float:
+    """
+    Microseconds since the epoch, comparable across processes.
+    """
+    return time.time_ns() / 1000
+
+
+class Tracer(Observer):
+    """
+    Spans recorded by one participant, as Chrome trace "complete" events (without pid); the
+    overlapping Beaver rounds and gates of the dataflow evaluation as async events.
+
+    Attributes:
+        name: the participant (client ID, "server")
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.events: List[Dict[str, Any]] = []
+        # of the phases and gates not finished yet, per category and key (see observers.py): the
+        # ones without a key nest, the others are paired by their key
+        self.starttimes: Dict[Tuple[str, Optional[Hashable]], List[float]] = collections.defaultdict(list)
+
+    def add_span(self, name: str, category: str, start: float, end: float, **args) -> None:
+        """
+        Record a span that started and ended at the given times (see `now`).
+        """
+        self.events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': end - start,
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+    def add_async_span(self, name: str, category: str, key: Hashable, start: float, end: float, **args) -> None:
+        """
+        Record a span that may overlap the other spans of its thread without nesting, as a pair of
+        Chrome async events (begin and end) with the ID key.
+        """
+        for phase, timestamp in (('b', start), ('e', end)):
+            self.events.append({
+                'name': name,
+                'cat': category,
+                'ph': phase,
+                'id': str(key),
+                'ts': timestamp,
+                'tid': threading.get_ident(),
+                'args': args,
+            })
+
+    def finish(self, name: str, category: str, key: Optional[Hashable]) -> None:
+        start = self.starttimes[(category, key)].pop()
+        if key is None:
+            self.add_span(name, category, start, now())
+        else:
+            self.add_async_span(name, category, key, start, now())
+
+    def phase_started(self, party, phase: str, key: Optional[Hashable] = None) -> None:
+        self.starttimes[("phase", key)].append(now())
+
+    def phase_finished(self, party, phase: str, key: Optional[Hashable] = None) -> None:
+        self.finish(phase, "phase", key)
+
+    def gate_started(self, party, expr: Expression, key: Optional[Hashable] = None) -> None:
+        self.starttimes[("gate", key)].append(now())
+
+    def gate_finished(self, party, expr: Expression, key: Optional[Hashable] = None) -> None:
+        self.finish(type(expr).__name__, "gate", key)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[None]:
+        """
+        Record the execution of the with block as a span.
+        """
+        start = now()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, now(), **args)
+
+
+def merge_traces(traces: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    One Chrome trace with a process (row group) per participant.
+    """
+    events = []
+    for pid, (name, participant_events) in enumerate(traces.items()):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+        events.extend(dict(event, pid=pid) for event in participant_events)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(path: str, traces: Dict[str, List[Dict[str, Any]]]) -> None:
+    with open(path, 'w') as out:
+        json.dump(merge_traces(traces), out)
+
+
+class TracingCommunication:
+    """
+    Transport wrapper recording every call as a span of category "transport".
+
+    Everything that is not a transport call (client_id, the metrics, ...) is read from the
+    wrapped transport.
+
+    Attributes:
+        comm: the wrapped transport
+        tracer: the tracer of the party
+    """
+
+    def __init__(self, comm: Communication, tracer: Tracer):
+        self.comm = comm
+        self.tracer = tracer
+
+    def __getattr__(self, name):
+        return getattr(self.comm, name)
+
+    def add_wait(self, kind: str, seconds: float) -> None:
+        self.comm.add_wait(kind, seconds)
+
+    def send_private_message(
+        self,
+        receiver_id: str,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        with self.tracer.span("send_private_message", "transport", receiver=receiver_id, label=label,
+                              bytes=len(message)):
+            self.comm.send_private_message(receiver_id, label, message)
+
+    def retrieve_private_message(
+        self,
+        label: str
+    ) -> bytes:
+        with self.tracer.span("retrieve_private_message", "transport", label=label):
+            return self.comm.retrieve_private_message(label)
+
+    def retrieve_private_messages(
+        self,
+        labels: List[str]
+    ) -> Dict[str, bytes]:
+        with self.tracer.span("retrieve_private_messages", "transport", labels=labels):
+            return self.comm.retrieve_private_messages(labels)
+
+    def publish_message(
+        self,
+        label: str,
+        message: Union[bytes, str]
+    ) -> None:
+        with self.tracer.span("publish_message", "transport", label=label, bytes=len(message)):
+            self.comm.publish_message(label, message)
+
+    def retrieve_public_message(
+        self,
+        sender_id: str,
+        label: str
+    ) -> bytes:
+        with self.tracer.span("retrieve_public_message", "transport", sender=sender_id, label=label):
+            return self.comm.retrieve_public_message(sender_id, label)
+
+    def retrieve_beaver_triplet_shares(
+        self,
+        op_id: str
+    ) -> Tuple[int, int, int]:
+        with self.tracer.span("retrieve_beaver_triplet_shares", "transport"):
+            return self.comm.retrieve_beaver_triplet_shares(op_id)